@@ -1,10 +1,28 @@
-from dataclasses import dataclass
+import json
+import math
+import os
+import tempfile
+import threading
+from dataclasses import dataclass, field
 from functools import lru_cache
-from typing import Dict, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 from sklearn.ensemble import IsolationForest
 
+from model_store import (
+    artifact_token,
+    fingerprint,
+    get_models_dir,
+    load_latest_artifact,
+    load_or_train,
+    save_artifact,
+)
+
+# Пороги decision_function → уровень аномалии
+NORMAL_THRESHOLD = 0.1
+WARNING_THRESHOLD = -0.2
+
 
 @dataclass
 class ExpenseAnomalyDetector:
@@ -24,21 +42,37 @@ class ExpenseAnomalyDetector:
         score ~ 0  → подозрительно
         score < 0  → сильно выбивается
         """
-        if amount <= 0:
-            return "invalid", -1.0
+        labels, scores = self.score_batch([amount], [category])
+        return str(labels[0]), float(scores[0])
 
-        cat_id = self.category_to_id.get(category, -1)
-        x = np.array([[amount, float(cat_id)]])
-        raw_score = float(self.model.decision_function(x)[0])
+    def score_batch(
+        self,
+        amounts: Sequence[float],
+        categories: Sequence[str],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Пакетная оценка: (массив уровней, массив score) той же длины, что вход.
 
-        if raw_score > 0.1:
-            label = "normal"
-        elif raw_score > -0.2:
-            label = "warning"
-        else:
-            label = "anomaly"
+        Вся пачка уходит в decision_function одним вызовом; уровни считаются
+        по тем же порогам, что и в score(). Суммы <= 0 — "invalid" со score -1.
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        # Категории → id через словарь по уникальным значениям, а не по каждой строке
+        uniques, inverse = np.unique(np.asarray(categories, dtype=object).astype(str), return_inverse=True)
+        ids = np.array([self.category_to_id.get(c, -1) for c in uniques], dtype=float)[inverse]
 
-        return label, raw_score
+        valid = amounts > 0
+        scores = np.full(len(amounts), -1.0)
+        if valid.any():
+            X = np.column_stack([amounts[valid], ids[valid]])
+            scores[valid] = self.model.decision_function(X)
+
+        labels = np.select(
+            [~valid, scores > NORMAL_THRESHOLD, scores > WARNING_THRESHOLD],
+            ["invalid", "normal", "warning"],
+            default="anomaly",
+        )
+        return labels, scores
 
 
 def _generate_synthetic_data() -> Tuple[np.ndarray, Dict[str, int]]:
@@ -71,18 +105,460 @@ def _generate_synthetic_data() -> Tuple[np.ndarray, Dict[str, int]]:
     return X, category_to_id
 
 
+# Гиперпараметры IsolationForest; входят в хэш артефакта модели
+_FOREST_PARAMS = {"contamination": 0.05, "random_state": 42}
+
+
+def _fit_forest(X: np.ndarray) -> IsolationForest:
+    model = IsolationForest(**_FOREST_PARAMS)
+    model.fit(X)
+    return model
+
+
 def _train_anomaly_detector() -> ExpenseAnomalyDetector:
     X, cat_map = _generate_synthetic_data()
-    model = IsolationForest(contamination=0.05, random_state=42)
-    model.fit(X)
+    fp = fingerprint(X, cat_map, _FOREST_PARAMS)
+    model = load_or_train("anomaly_forest", fp, lambda: _fit_forest(X), IsolationForest)
     return ExpenseAnomalyDetector(model=model, category_to_id=cat_map)
 
 
-@lru_cache(maxsize=1)
+# ---------------------------------------------------------------------------
+# Обучение и пересчёт по реальной истории из SQLite
+# ---------------------------------------------------------------------------
+# Имя артефакта модели, обученной на таблице transactions (см. model_store)
+DB_MODEL_NAME = "anomaly_forest_db"
+
+
+def _reservoir_sample_transactions(
+    max_rows: int,
+    chunk_size: int,
+    seed: int = 42,
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Равномерная выборка до max_rows строк (amount, category) из всей истории.
+
+    История читается пачками кортежей (database.iter_transaction_chunks), а не
+    словарями, и в памяти держится только резервуар фиксированного размера —
+    объём истории на память не влияет. Алгоритм R, векторно по пачке: строка с
+    порядковым номером t попадает в резервуар с вероятностью max_rows / t.
+    IsolationForest всё равно обучает деревья на подвыборках по 256 строк,
+    так что качество от выборки не страдает.
+    """
+    from database import iter_transaction_chunks
+
+    rng = np.random.default_rng(seed)
+    amounts = np.empty(max_rows, dtype=float)
+    categories = np.empty(max_rows, dtype=object)
+    seen = 0
+
+    for chunk in iter_transaction_chunks(columns=("amount", "category"), chunk_size=chunk_size):
+        chunk_amounts = np.fromiter((r[0] for r in chunk), dtype=float, count=len(chunk))
+        chunk_categories = np.array([r[1] for r in chunk], dtype=object)
+
+        # Сначала добиваем резервуар до заполнения
+        take = min(max(max_rows - seen, 0), len(chunk))
+        if take:
+            amounts[seen:seen + take] = chunk_amounts[:take]
+            categories[seen:seen + take] = chunk_categories[:take]
+
+        # Остальные строки замещают случайные элементы (при повторе индекса
+        # побеждает последняя строка — как в последовательном алгоритме)
+        if take < len(chunk):
+            positions = np.arange(seen + take + 1, seen + len(chunk) + 1)
+            slots = rng.integers(0, positions)
+            keep = slots < max_rows
+            amounts[slots[keep]] = chunk_amounts[take:][keep]
+            categories[slots[keep]] = chunk_categories[take:][keep]
+
+        seen += len(chunk)
+
+    n = min(seen, max_rows)
+    return amounts[:n], categories[:n], seen
+
+
+def retrain_from_database(
+    max_rows: int = 200_000,
+    chunk_size: int = 20_000,
+    min_rows: int = 50,
+) -> ExpenseAnomalyDetector:
+    """
+    Обучает детектор на реальных тратах из таблицы transactions и сохраняет его
+    в хранилище моделей — после этого get_expense_anomaly_detector() в новых
+    процессах подхватывает именно эту модель.
+
+    Raises:
+        ValueError: если в истории меньше min_rows трат.
+    """
+    amounts, categories, seen = _reservoir_sample_transactions(max_rows, chunk_size)
+    if len(amounts) < min_rows:
+        raise ValueError(f"Недостаточно трат для обучения: {seen} (нужно хотя бы {min_rows})")
+
+    cat_map = {c: i for i, c in enumerate(sorted(set(categories.tolist())))}
+    ids = np.array([cat_map[c] for c in categories.tolist()], dtype=float)
+    X = np.column_stack([amounts, ids])
+
+    model = _fit_forest(X)
+    save_artifact(DB_MODEL_NAME, fingerprint(X, cat_map, _FOREST_PARAMS), (model, cat_map))
+    _load_expense_anomaly_detector.cache_clear()
+    return ExpenseAnomalyDetector(model=model, category_to_id=cat_map)
+
+
+def score_database(
+    detector: ExpenseAnomalyDetector,
+    chunk_size: int = 50_000,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Пересчёт оценок по всей истории: по пачкам (ids, уровни, score).
+
+    Каждая пачка — один вызов score_batch, так что ночной пересчёт — это один
+    векторный проход по таблице без построчных вызовов модели.
+    """
+    from database import iter_transaction_chunks
+
+    for chunk in iter_transaction_chunks(columns=("id", "amount", "category"), chunk_size=chunk_size):
+        ids, amounts, categories = zip(*chunk)
+        labels, scores = detector.score_batch(amounts, categories)
+        yield np.asarray(ids, dtype=np.int64), labels, scores
+
+
 def get_expense_anomaly_detector() -> ExpenseAnomalyDetector:
     """
     Возвращает обученный детектор аномалий.
-    Обучение выполняется один раз и кэшируется.
+    Если есть модель, обученная на истории (retrain_from_database), — берётся она,
+    иначе модель на синтетических данных.
+    Внутри процесса кэшируется, между процессами — загружается с диска (model_store);
+    кэш привязан к артефакту на диске, так что ночное переобучение в другом
+    процессе подхватывается без перезапуска.
     """
+    return _load_expense_anomaly_detector(artifact_token(DB_MODEL_NAME))
+
+
+@lru_cache(maxsize=1)
+def _load_expense_anomaly_detector(token: Optional[Tuple[str, int]]) -> ExpenseAnomalyDetector:
+    stored = load_latest_artifact(DB_MODEL_NAME, tuple)
+    if stored is not None and len(stored) == 2 and isinstance(stored[0], IsolationForest):
+        model, cat_map = stored
+        return ExpenseAnomalyDetector(model=model, category_to_id=cat_map)
     return _train_anomaly_detector()
 
+
+# ---------------------------------------------------------------------------
+# Потоковый режим: онлайн-статистика по каждой категории
+# ---------------------------------------------------------------------------
+# IsolationForest с id категории как числовым признаком смешивает категории
+# в одном пространстве и требует вызова модели на каждую трату. Потоковый режим
+# держит для каждой категории свою базовую линию — среднее/дисперсию (Уэлфорд)
+# и квантили p95/p99 (P²-алгоритм Джейна–Хламтача): обновление и проверка — O(1)
+# на трату, без хранения истории. Состояние — маленький JSON в каталоге моделей,
+# поэтому после перезапуска базовые линии не нужно пересчитывать по БД.
+#
+# Вместе с базовыми линиями хранится, до какого состояния БД они доведены:
+# версия данных (database.get_data_version) и наибольший учтённый id. sync()
+# сверяет их с БД: если с тех пор были только вставки (кнопка «Сохранить»,
+# add_transactions_bulk, импорт выписок), новые строки дочитываются по id;
+# если было удаление или правка — базовые линии пересчитываются заново, так как
+# из P²-квантилей значение не «вычесть».
+
+
+class P2Quantile:
+    """
+    Оценка квантиля p по потоку за O(1) памяти (P²: 5 маркеров).
+    Первые 5 значений хранятся как есть, дальше маркеры сдвигаются
+    параболической (или линейной) интерполяцией.
+    """
+
+    def __init__(self, p: float):
+        self.p = p
+        self.count = 0
+        self.q: List[float] = []  # высоты маркеров
+        self.n = [0, 1, 2, 3, 4]  # фактические позиции
+        self.desired = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]  # желаемые позиции
+        self.increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def update(self, x: float) -> None:
+        self.count += 1
+        if self.count <= 5:
+            self.q.append(x)
+            self.q.sort()
+            return
+
+        q, n = self.q, self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                candidate = q[i] + step / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                q[i] = candidate
+                n[i] += step
+
+    def value(self) -> float:
+        if not self.q:
+            return math.nan
+        if self.count <= 5:
+            # Мало данных — ближайший ранг по отсортированным значениям
+            return self.q[min(len(self.q) - 1, int(self.p * len(self.q)))]
+        return self.q[2]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"p": self.p, "count": self.count, "q": self.q, "n": self.n, "desired": self.desired}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "P2Quantile":
+        sketch = cls(data["p"])
+        sketch.count = data["count"]
+        sketch.q = list(data["q"])
+        sketch.n = list(data["n"])
+        sketch.desired = list(data["desired"])
+        return sketch
+
+
+@dataclass
+class CategoryBaseline:
+    """Базовая линия категории: Уэлфорд (count/mean/m2) + квантили p95, p99."""
+
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    p95: P2Quantile = field(default_factory=lambda: P2Quantile(0.95))
+    p99: P2Quantile = field(default_factory=lambda: P2Quantile(0.99))
+
+    def update(self, amount: float) -> None:
+        self.count += 1
+        delta = amount - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (amount - self.mean)
+        self.p95.update(amount)
+        self.p99.update(amount)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "p95": self.p95.to_dict(),
+            "p99": self.p99.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CategoryBaseline":
+        return cls(
+            count=data["count"],
+            mean=data["mean"],
+            m2=data["m2"],
+            p95=P2Quantile.from_dict(data["p95"]),
+            p99=P2Quantile.from_dict(data["p99"]),
+        )
+
+
+STREAMING_STATE_FILENAME = "streaming_anomaly_state.json"
+
+
+@dataclass
+class StreamingAnomalyDetector:
+    """
+    Потоковый детектор аномалий с отдельной базовой линией на каждую категорию.
+
+    Уровни (как у ExpenseAnomalyDetector, плюс "learning"):
+        invalid  — сумма <= 0;
+        learning — по категории меньше min_count трат, судить рано;
+        anomaly  — выше p99 категории или z-score >= z_anomaly;
+        warning  — выше p95 категории или z-score >= z_warning;
+        normal   — всё остальное.
+    Score — z-score суммы относительно среднего категории.
+    """
+
+    baselines: Dict[str, CategoryBaseline] = field(default_factory=dict)
+    min_count: int = 30
+    z_warning: float = 2.0
+    z_anomaly: float = 3.0
+    # До какого состояния БД доведены базовые линии; None — неизвестно (пересчёт)
+    data_version: Optional[int] = None
+    last_id: int = 0
+    # Один экземпляр процесса делят сессии Streamlit — изменения под блокировкой
+    _lock: threading.RLock = field(default_factory=threading.RLock, repr=False, compare=False)
+
+    def score(self, amount: float, category: str) -> Tuple[str, float]:
+        """Оценивает трату относительно текущей базовой линии, не обновляя её."""
+        if amount <= 0:
+            return "invalid", -1.0
+        with self._lock:
+            baseline = self.baselines.get(category)
+            if baseline is None or baseline.count < self.min_count:
+                return "learning", 0.0
+            mean, std = baseline.mean, baseline.std
+            p95, p99 = baseline.p95.value(), baseline.p99.value()
+
+        z = (amount - mean) / std if std > 0 else 0.0
+        if amount > p99 or z >= self.z_anomaly:
+            return "anomaly", z
+        if amount > p95 or z >= self.z_warning:
+            return "warning", z
+        return "normal", z
+
+    def update(self, amount: float, category: str) -> None:
+        """
+        Добавляет трату в базовую линию категории (O(1)). Траты, уже записанные
+        в БД, сюда не передавайте — их подхватит sync(), иначе они учтутся дважды.
+        """
+        if amount <= 0:
+            return
+        with self._lock:
+            baseline = self.baselines.get(category)
+            if baseline is None:
+                baseline = self.baselines[category] = CategoryBaseline()
+            baseline.update(float(amount))
+
+    def observe(self, amount: float, category: str) -> Tuple[str, float]:
+        """Оценка по истории *до* этой траты, затем обновление базовой линии."""
+        with self._lock:
+            result = self.score(amount, category)
+            self.update(amount, category)
+        return result
+
+    def sync(self, chunk_size: int = 20_000) -> bool:
+        """
+        Доводит базовые линии до текущего состояния БД; True — если что-то менялось.
+
+        Только вставки после last_id — дочитываются новые строки; удаления,
+        правки или неизвестное состояние — полный пересчёт по истории.
+        Если версия совпадает, это один запрос к БД.
+        """
+        from database import count_transactions_after, get_data_version, iter_transaction_chunks
+
+        with self._lock:
+            version = get_data_version()
+            if version == self.data_version:
+                return False
+            appended = self.data_version is not None and count_transactions_after(self.last_id) == (
+                version - self.data_version
+            )
+            if not appended:
+                self.baselines = {}
+                self.last_id = 0
+            for chunk in iter_transaction_chunks(
+                columns=("id", "amount", "category"),
+                chunk_size=chunk_size,
+                after_id=self.last_id if appended else None,
+            ):
+                for row_id, amount, category in chunk:
+                    self.update(amount, category)
+                    self.last_id = max(self.last_id, int(row_id))
+            self.data_version = version
+            return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "min_count": self.min_count,
+                "z_warning": self.z_warning,
+                "z_anomaly": self.z_anomaly,
+                "data_version": self.data_version,
+                "last_id": self.last_id,
+                "baselines": {c: b.to_dict() for c, b in self.baselines.items()},
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StreamingAnomalyDetector":
+        return cls(
+            baselines={c: CategoryBaseline.from_dict(b) for c, b in data["baselines"].items()},
+            min_count=data["min_count"],
+            z_warning=data["z_warning"],
+            z_anomaly=data["z_anomaly"],
+            # В состояниях до появления этих полей версии нет — sync() пересчитает
+            data_version=data.get("data_version"),
+            last_id=data.get("last_id", 0),
+        )
+
+    def save(self, path: Optional[str] = None) -> str:
+        """Сохраняет состояние в JSON атомарно (временный файл + os.replace)."""
+        path = path or os.path.join(get_models_dir(), STREAMING_STATE_FILENAME)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        state = self.to_dict()
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".streaming-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> Optional["StreamingAnomalyDetector"]:
+        """Состояние с диска; None — если файла нет или он повреждён."""
+        path = path or os.path.join(get_models_dir(), STREAMING_STATE_FILENAME)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def sync_streaming_detector(detector: StreamingAnomalyDetector) -> StreamingAnomalyDetector:
+    """sync() с БД и сохранение состояния, если оно изменилось (ошибка записи не мешает работе)."""
+    if detector.sync():
+        try:
+            detector.save()
+        except OSError:
+            pass
+    return detector
+
+
+@lru_cache(maxsize=1)
+def get_streaming_anomaly_detector() -> StreamingAnomalyDetector:
+    """
+    Потоковый детектор процесса: из сохранённого состояния (или пустой),
+    доведённый до текущего состояния БД — при первом запуске это полный проход
+    по истории. Экземпляр кэшируется, поэтому после записи в БД (кнопка
+    «Сохранить», импорт) вызывайте sync_streaming_detector().
+    """
+    detector = StreamingAnomalyDetector.load() or StreamingAnomalyDetector()
+    return sync_streaming_detector(detector)
+
+
+if __name__ == "__main__":
+    # Ночная задача: переобучить детектор по истории и пересчитать оценки
+    import argparse
+    from collections import Counter
+
+    from database import init_db
+
+    parser = argparse.ArgumentParser(description="Переобучение детектора аномалий по истории трат")
+    parser.add_argument("--max-rows", type=int, default=200_000)
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    args = parser.parse_args()
+
+    init_db()
+    detector = retrain_from_database(max_rows=args.max_rows)
+    totals: Counter = Counter()
+    for _ids, labels, _scores in score_database(detector, chunk_size=args.chunk_size):
+        totals.update(labels.tolist())
+    print(dict(totals))
+
@@ -0,0 +1,196 @@
+# src/benchmarks.py
+"""
+Замеры производительности SpendFlow на синтетических данных.
+
+Запуск из каталога src/:
+    python benchmarks.py rules --rows 1000000
+    python benchmarks.py forecast --series 1000 10000 100000
+    python benchmarks.py fuzzy --merchants 100000 --queries 5000
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+
+def _benchmark_rules():
+    """Правила для замеров: rules.json, если он есть, иначе лимиты как в README."""
+    from logic import RULES_PATH, CompiledRules, get_compiled_rules
+
+    if os.path.exists(RULES_PATH):
+        return get_compiled_rules()
+    return CompiledRules(
+        block_if_budget_exceeded=True,
+        must_not_exceed_total_budget=True,
+        must_not_exceed_category_budget=True,
+        min_amount=0,
+        max_total_budget=10000,
+        category_limits={"Transport": 5000, "Food": 3000, "Shopping": 2000, "Entertainment": 1500, "Other": 1000},
+        blacklist=frozenset({"fraud", "suspicious"}),
+        whitelist=frozenset({"taxi", "verified"}),
+    )
+
+
+def _synthetic_rule_inputs(n: int, seed: int = 0):
+    import pandas as pd
+
+    # Распределение похоже на реальный месяц: большинство трат проходит проверку,
+    # заметная доля — предупреждения и отказы, редкие запрещённые теги.
+    # Немного строк с пустой категорией и None среди тегов — сверка с check_rules
+    # должна покрывать и их.
+    rng = np.random.default_rng(seed)
+    categories = np.array(["Transport", "Food", "Shopping", "Entertainment", "Other", "Coffee", None], dtype=object)
+    category_weights = [0.17, 0.17, 0.17, 0.17, 0.15, 0.15, 0.02]
+    tag_pool = [[], [], [], ["taxi"], ["ride", "taxi"], ["gift"], ["fraud"], ["verified", "suspicious"], [None, "taxi"]]
+    tag_weights = [0.4, 0.2, 0.1, 0.1, 0.1, 0.07, 0.01, 0.01, 0.01]
+    return pd.DataFrame(
+        {
+            "amount": rng.integers(-1, 1000, size=n),
+            "category": rng.choice(categories, size=n, p=category_weights),
+            "tags_list": [tag_pool[i] for i in rng.choice(len(tag_pool), size=n, p=tag_weights)],
+            "total_spent": rng.integers(0, 9500, size=n),
+            "category_total": rng.integers(0, 1500, size=n),
+            "is_budget_exceeded": rng.random(n) < 0.01,
+        }
+    )
+
+
+def bench_rules(rows: int, scalar_rows: int) -> None:
+    """check_rules (построчно) против check_rules_batch (векторно)."""
+    from logic import check_rules, check_rules_batch
+
+    rules = _benchmark_rules()
+    df = _synthetic_rule_inputs(rows)
+
+    started = time.perf_counter()
+    check_rules_batch(df, rules=rules, with_messages=False)
+    status_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch = check_rules_batch(df, rules=rules)
+    batch_sec = time.perf_counter() - started
+
+    # Построчный путь можно мерить на части строк (--scalar-rows); ответы сверяем с пакетными
+    sample = df.head(scalar_rows)
+    records = sample.to_dict("records")
+    started = time.perf_counter()
+    scalar = [check_rules(r, rules=rules) for r in records]
+    scalar_sec = time.perf_counter() - started
+
+    mismatches = int((batch["message"].head(scalar_rows).to_numpy() != np.array(scalar, dtype=object)).sum())
+    batch_rate = rows / batch_sec
+    scalar_rate = len(records) / scalar_sec
+    status_rate = rows / status_sec
+    print(f"check_rules_batch (только статусы): {rows:,} строк за {status_sec:.3f} с ({status_rate:,.0f} строк/с)")
+    print(f"check_rules_batch (с текстами):     {rows:,} строк за {batch_sec:.3f} с ({batch_rate:,.0f} строк/с)")
+    print(f"check_rules (построчно):            {len(records):,} строк за {scalar_sec:.3f} с ({scalar_rate:,.0f} строк/с)")
+    print(
+        f"ускорение: x{status_rate / scalar_rate:.1f} по статусам, x{batch_rate / scalar_rate:.1f} с текстами; "
+        f"расхождений в ответах: {mismatches}"
+    )
+
+
+def bench_forecast(series_counts, months: int, loop_series: int) -> None:
+    """forecast_matrix на тысячах рядов против цикла LinearRegression по рядам."""
+    from sklearn.linear_model import LinearRegression
+
+    from forecast import forecast_matrix
+
+    rng = np.random.default_rng(0)
+    t = np.arange(months)
+    for count in series_counts:
+        base = rng.uniform(5_000, 80_000, size=(count, 1))
+        trend = rng.normal(0, 500, size=(count, 1))
+        Y = base + trend * t + rng.normal(0, 3_000, size=(count, months))
+
+        started = time.perf_counter()
+        forecast_matrix(Y, horizon=1)
+        sec = time.perf_counter() - started
+        print(f"forecast_matrix: {count:>9,} рядов × {months} мес. за {sec * 1000:9.1f} мс "
+              f"({count / sec:,.0f} рядов/с)")
+
+    # Цикл со своей sklearn-моделью на каждый ряд — как выглядел бы прогноз по категориям раньше
+    X = t.reshape(-1, 1)
+    started = time.perf_counter()
+    for row in Y[:loop_series]:
+        LinearRegression().fit(X, row).predict([[months]])
+    sec = time.perf_counter() - started
+    print(f"цикл LinearRegression: {loop_series:,} рядов за {sec * 1000:.1f} мс ({loop_series / sec:,.0f} рядов/с)")
+
+
+def _synthetic_merchants(n: int, rng) -> list:
+    """Названия магазинов: 1–2 слова с частотами букв как в тексте + типичный суффикс."""
+    letters = np.array(list("etaoinshrdlcumwfgypbvkjxqz"))
+    freq = np.array([12.7, 9.1, 8.2, 7.5, 7.0, 6.7, 6.3, 6.1, 6.0, 4.3, 4.0, 2.8, 2.8,
+                     2.4, 2.4, 2.2, 2.0, 2.0, 1.9, 1.5, 1.0, 0.8, 0.2, 0.2, 0.1, 0.1])
+    freq /= freq.sum()
+    suffixes = ["Market", "Cafe", "Store", "LLC", "Express", "Taxi", "Pharmacy", "", "", "", ""]
+
+    def word() -> str:
+        return "".join(rng.choice(letters, size=rng.integers(4, 10), p=freq)).title()
+
+    names = []
+    for _ in range(n):
+        parts = [word()] + ([word()] if rng.random() < 0.4 else []) + [rng.choice(suffixes)]
+        names.append(" ".join(p for p in parts if p))
+    return names
+
+
+def bench_fuzzy(merchants: int, queries: int) -> None:
+    """Триграммный поиск магазинов по «грязным» строкам выписок."""
+    from merchant_matcher import TrigramIndex
+
+    rng = np.random.default_rng(0)
+    names = _synthetic_merchants(merchants, rng)
+
+    started = time.perf_counter()
+    index = TrigramIndex.build((name, i) for i, name in enumerate(names))
+    build_sec = time.perf_counter() - started
+
+    # Строки как в выписке: верхний регистр, звёздочка и номер операции
+    picks = rng.integers(0, merchants, size=queries)
+    texts = [f"{names[i].upper()} *{rng.integers(0, 10_000)}" for i in picks]
+    latencies = np.empty(queries)
+    correct = 0
+    for j, (i, text) in enumerate(zip(picks, texts)):
+        started = time.perf_counter()
+        found = index.search(text, k=5)
+        latencies[j] = time.perf_counter() - started
+        # Совпадение по нормализованному имени: у синтетики бывают одноимённые магазины
+        correct += bool(found) and index.names[found[0][0]] == index.names[i]
+
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print(f"индекс: {len(index):,} строк, {len(index.gram_ids):,} триграмм, построен за {build_sec:.2f} с")
+    print(f"поиск top-5: среднее {latencies.mean() * 1000:.3f} мс, p50 {p50:.3f} мс, p99 {p99:.3f} мс")
+    print(f"верный магазин на первом месте: {correct / queries:.2%}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Замеры производительности SpendFlow")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_rules = sub.add_parser("rules", help="пакетная проверка правил против построчной")
+    p_rules.add_argument("--rows", type=int, default=1_000_000)
+    p_rules.add_argument("--scalar-rows", type=int, default=1_000_000)
+
+    p_forecast = sub.add_parser("forecast", help="пакетный прогноз по многим рядам")
+    p_forecast.add_argument("--series", type=int, nargs="+", default=[100, 1_000, 10_000, 100_000])
+    p_forecast.add_argument("--months", type=int, default=36)
+    p_forecast.add_argument("--loop-series", type=int, default=1_000)
+
+    p_fuzzy = sub.add_parser("fuzzy", help="нечёткий поиск магазинов по триграммам")
+    p_fuzzy.add_argument("--merchants", type=int, default=100_000)
+    p_fuzzy.add_argument("--queries", type=int, default=5_000)
+
+    args = parser.parse_args()
+    if args.command == "rules":
+        bench_rules(args.rows, min(args.scalar_rows, args.rows))
+    elif args.command == "forecast":
+        bench_forecast(args.series, args.months, args.loop_series)
+    elif args.command == "fuzzy":
+        bench_fuzzy(args.merchants, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,10 +24,16 @@
 
 Потоки и Streamlit:
 -------------------
-Каждое действие пользователя перезапускает скрипт `main.py`. Мы открываем
-соединение на время одной операции и сразу закрываем (`with sqlite3.connect`).
-Так мы не держим «висящее» соединение между перезапусками и избегаем блокировок
-файла на Windows/macOS при простых сценариях.
+Каждое действие пользователя перезапускает скрипт `main.py`, причём каждый
+перезапуск Streamlit выполняет в новом потоке (ScriptRunner.scriptThread), так что
+соединение «на поток» выбрасывалось бы на каждом rerun вместе с connect и PRAGMA.
+Поэтому соединение одно на процесс для каждого пути к БД: открывается при первом
+`get_connection()` с check_same_thread=False и живёт, пока процесс не завершится
+(или до close_connection()). Обращения из разных потоков (сессии Streamlit, фоновые
+задачи) сериализуются блокировкой этого соединения — функции модуля работают с ним
+через `locked_connection()`, и транзакция одного потока не смешивается с запросами
+другого. Счётчик `connection_stats()["opened"]` показывает, сколько раз реально
+вызывался connect — между перезапусками скрипта он не растёт.
 
 Схема таблицы `transactions`:
 -----------------------------
@@ -37,16 +43,35 @@
 - description   — человекочитаемое описание (магазин, комментарий).
 - amount        — сумма в тенге; CHECK (amount >= 0) отсекает отрицательные на уровне БД.
 - category      — строка категории (как в rules.json / UI).
-- tags          — теги одной строкой через запятую (проще, чем отдельная таблица
-                  tag_transaction для учебного проекта; при росте — нормализовать).
+- tags          — теги одной строкой «a, b, c»; для фильтра по тегу её «разворот»
+                  хранится в transaction_tags (см. ниже).
+
+Агрегат `daily_category_totals`:
+--------------------------------
+Материализованная сводка «день × категория → сумма, количество». Её поддерживают
+триггеры SQLite на INSERT/DELETE/UPDATE в `transactions`, поэтому любая запись —
+через add_transaction, массовый импорт или руками в sqlite3 — сразу отражается
+в сводке. Дашборд читает O(дней × категорий) строк вместо SUM по всей истории.
+День — первые 10 символов created_at, то есть дата в UTC.
+
+Индекс тегов `transaction_tags`:
+--------------------------------
+Строки (тег, created_at, id транзакции) с первичным ключом в этом порядке —
+тоже на триггерах. Страница истории с фильтром по тегу читается поиском по
+ключу, а не LIKE по всем записям.
 """
 
 from __future__ import annotations
 
 import os
 import sqlite3
-from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from itertools import count, islice
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 
 
 # ---------------------------------------------------------------------------
@@ -70,6 +95,99 @@ def get_db_path() -> str:
     return DB_PATH
 
 
+# ---------------------------------------------------------------------------
+# Менеджер соединений: одно соединение на процесс для каждого пути к БД
+# ---------------------------------------------------------------------------
+# Размер кэша подготовленных выражений sqlite3 (ключ — текст SQL). Пока соединение
+# живёт, повторный execute того же SQL не компилирует запрос заново, поэтому тексты
+# запросов ниже вынесены в константы и не собираются динамически.
+STATEMENT_CACHE_SIZE = 256
+
+# Путь к БД → (соединение, его блокировка). RLock — функции модуля могут вызывать
+# друг друга, не отпуская соединение.
+_pool: Dict[str, Tuple[sqlite3.Connection, threading.RLock]] = {}
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_connections_opened = 0
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    """Открывает и настраивает новое соединение (вызывается только из get_connection)."""
+    global _connections_opened
+
+    # timeout=5 — если другой процесс держит файл, подождём чуть-чуть вместо мгновенного сбоя
+    # check_same_thread=False — соединение общее для потоков, доступ к нему идёт под
+    # блокировкой из _pool
+    conn = sqlite3.connect(
+        path,
+        timeout=5,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    conn.row_factory = sqlite3.Row  # доступ к колонкам по имени (и по индексу тоже)
+    conn.execute("PRAGMA foreign_keys = ON;")  # при будущих FK — уже включено
+    # WAL — режим журнала сохраняется в самом файле БД: читатели (UI) не блокируют
+    # писателя (импорт), а коммит — это дозапись в -wal файл вместо перезаписи страниц.
+    conn.execute("PRAGMA journal_mode = WAL;")
+    # В WAL режим NORMAL не теряет целостность базы, но убирает fsync на каждый commit
+    conn.execute("PRAGMA synchronous = NORMAL;")
+
+    with _stats_lock:
+        _connections_opened += 1
+    return conn
+
+
+def _pool_entry() -> Tuple[sqlite3.Connection, threading.RLock]:
+    """(соединение, блокировка) для текущего DB_PATH; открывает соединение при первом обращении."""
+    path = DB_PATH  # тесты подменяют DB_PATH — у каждого пути своё соединение
+    entry = _pool.get(path)
+    if entry is None:
+        with _pool_lock:
+            entry = _pool.get(path)
+            if entry is None:
+                entry = (_open_connection(path), threading.RLock())
+                _pool[path] = entry
+    return entry
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Общее соединение процесса с текущей БД, открывается при первом обращении.
+
+    Соединение не закрывается после операции: транзакции оформляются через
+    `with conn:` (commit/rollback без close). Если соединение используют
+    несколько потоков, работайте с ним через locked_connection().
+    """
+    return _pool_entry()[0]
+
+
+@contextmanager
+def locked_connection() -> Iterator[sqlite3.Connection]:
+    """
+    Общее соединение под его блокировкой: пока блок выполняется, другие потоки
+    ждут — чтения не видят чужую незавершённую транзакцию, записи не попадают в неё.
+    """
+    conn, lock = _pool_entry()
+    with lock:
+        yield conn
+
+
+def close_connection() -> None:
+    """Закрывает соединение с текущей БД (например, перед удалением файла БД)."""
+    with _pool_lock:
+        entry = _pool.pop(DB_PATH, None)
+    if entry is not None:
+        conn, lock = entry
+        with lock:
+            conn.close()
+
+
+def connection_stats() -> Dict[str, int]:
+    """Сколько соединений открыто за время жизни процесса (для проверки пула)."""
+    with _stats_lock:
+        return {"opened": _connections_opened}
+
+
 def init_db() -> None:
     """
     Создаёт файл БД (если его ещё нет) и таблицу `transactions`.
@@ -81,9 +199,7 @@ def init_db() -> None:
     - Явная точка инициализации в main.py читается как «здесь поднимается хранилище».
     - Сюда же позже можно добавить CREATE INDEX, миграции версий схемы и т.д.
     """
-    # timeout=5 — если другой процесс держит файл, подождём чуть-чуть вместо мгновенного сбоя
-    with sqlite3.connect(DB_PATH, timeout=5) as conn:
-        conn.execute("PRAGMA foreign_keys = ON;")  # при будущих FK — уже включено
+    with locked_connection() as conn, conn:
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS transactions (
@@ -103,7 +219,342 @@ def init_db() -> None:
             ON transactions (created_at DESC);
             """
         )
-        conn.commit()
+        # Составные индексы под постраничную историю (fetch_transactions_page):
+        # порядок (created_at, id) совпадает с ORDER BY, поэтому страница — это
+        # поиск по индексу от курсора и чтение page_size записей, без сортировки.
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_transactions_created_id
+            ON transactions (created_at, id);
+            """
+        )
+        # Фильтр по категории: равенство по category + тот же порядок внутри неё
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_transactions_category_created_id
+            ON transactions (category, created_at, id);
+            """
+        )
+        _init_rollup(conn)
+        _init_tag_index(conn)
+
+
+def _tags_json_sql(column: str) -> str:
+    """
+    SQL-выражение: колонка tags («a, b, c») → JSON-массив ["a","b","c"] для json_each.
+
+    Внутри триггеров SQLite нельзя WITH (рекурсивный CTE для разбиения строки),
+    поэтому строка превращается в JSON заменой разделителя. Кавычки, обратный
+    слэш и переводы строк экранируются; если тег всё же не даёт валидный JSON
+    (другие управляющие символы), он просто не попадает в индекс тегов.
+    """
+    escaped = column
+    for raw, json_escape in (
+        (r"'\'", r"'\\'"),
+        (r"""'"'""", r"""'\"'"""),
+        ("char(9)", r"'\t'"),
+        ("char(10)", r"'\n'"),
+        ("char(13)", r"'\r'"),
+    ):
+        escaped = f"replace({escaped}, {raw}, {json_escape})"
+    as_json = f"""'["' || replace({escaped}, ', ', '","') || '"]'"""
+    return f"CASE WHEN json_valid({as_json}) THEN {as_json} ELSE '[]' END"
+
+
+def _init_tag_index(conn: sqlite3.Connection) -> None:
+    """
+    Индекс тегов transaction_tags (тег, created_at, id) и триггеры, которые его поддерживают.
+
+    Колонка tags остаётся строкой «a, b, c», а эта таблица — её «разворот» по
+    тегам: фильтр истории по тегу становится поиском по первичному ключу
+    (тег → записи в порядке времени) вместо LIKE по каждой строке. COLLATE NOCASE —
+    та же нечувствительность к регистру (ASCII), что была у LIKE. Для старой БД
+    таблица один раз заполняется по всей истории.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transaction_tags';"
+    ).fetchone()
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS transaction_tags (
+            tag TEXT NOT NULL COLLATE NOCASE,
+            created_at TEXT NOT NULL,
+            tx_id INTEGER NOT NULL,
+            PRIMARY KEY (tag, created_at, tx_id)
+        ) WITHOUT ROWID;
+        """
+    )
+
+    if not exists:
+        conn.execute(
+            f"""
+            INSERT OR IGNORE INTO transaction_tags (tag, created_at, tx_id)
+            SELECT j.value, t.created_at, t.id
+            FROM transactions AS t, json_each({_tags_json_sql("t.tags")}) AS j
+            WHERE t.tags <> '' AND j.value <> '';
+            """
+        )
+
+    insert_new = f"""
+            INSERT OR IGNORE INTO transaction_tags (tag, created_at, tx_id)
+            SELECT value, NEW.created_at, NEW.id
+            FROM json_each({_tags_json_sql("NEW.tags")})
+            WHERE COALESCE(NEW.tags, '') <> '' AND value <> '';"""
+    # Удаление по тегам OLD — поиск по первичному ключу, без индекса по tx_id
+    delete_old = f"""
+            DELETE FROM transaction_tags
+            WHERE created_at = OLD.created_at AND tx_id = OLD.id
+              AND tag IN (SELECT value FROM json_each({_tags_json_sql("COALESCE(OLD.tags, '')")}));"""
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_tags_insert
+        AFTER INSERT ON transactions
+        BEGIN{insert_new}
+        END;
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_tags_delete
+        AFTER DELETE ON transactions
+        BEGIN{delete_old}
+        END;
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_tags_update
+        AFTER UPDATE OF created_at, tags ON transactions
+        BEGIN{delete_old}{insert_new}
+        END;
+        """
+    )
+
+
+def _init_rollup(conn: sqlite3.Connection) -> None:
+    """
+    Создаёт сводку daily_category_totals и триггеры, которые её поддерживают.
+
+    Если сводки ещё не было (старая БД), она один раз заполняется по всей истории,
+    дальше обновляется только инкрементально.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_category_totals';"
+    ).fetchone()
+
+    # WITHOUT ROWID: строка сводки хранится прямо в B-дереве первичного ключа,
+    # выборка диапазона дней — один проход по индексу
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS daily_category_totals (
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            tx_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category)
+        ) WITHOUT ROWID;
+        """
+    )
+
+    if not exists:
+        conn.execute(
+            """
+            INSERT INTO daily_category_totals (day, category, total, tx_count)
+            SELECT substr(created_at, 1, 10), category, SUM(amount), COUNT(*)
+            FROM transactions
+            GROUP BY substr(created_at, 1, 10), category;
+            """
+        )
+
+    # Вставка: прибавляем сумму к ячейке (день, категория) или создаём её
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO daily_category_totals (day, category, total, tx_count)
+            VALUES (substr(NEW.created_at, 1, 10), NEW.category, NEW.amount, 1)
+            ON CONFLICT (day, category) DO UPDATE SET
+                total = total + excluded.total,
+                tx_count = tx_count + 1;
+        END;
+        """
+    )
+    # Удаление: вычитаем, а опустевшую ячейку убираем совсем
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            UPDATE daily_category_totals
+            SET total = total - OLD.amount, tx_count = tx_count - 1
+            WHERE day = substr(OLD.created_at, 1, 10) AND category = OLD.category;
+            DELETE FROM daily_category_totals
+            WHERE day = substr(OLD.created_at, 1, 10) AND category = OLD.category
+              AND tx_count <= 0;
+        END;
+        """
+    )
+    # Правка суммы/даты/категории = удаление старой версии + вставка новой
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_update
+        AFTER UPDATE OF created_at, amount, category ON transactions
+        BEGIN
+            UPDATE daily_category_totals
+            SET total = total - OLD.amount, tx_count = tx_count - 1
+            WHERE day = substr(OLD.created_at, 1, 10) AND category = OLD.category;
+            DELETE FROM daily_category_totals
+            WHERE day = substr(OLD.created_at, 1, 10) AND category = OLD.category
+              AND tx_count <= 0;
+            INSERT INTO daily_category_totals (day, category, total, tx_count)
+            VALUES (substr(NEW.created_at, 1, 10), NEW.category, NEW.amount, 1)
+            ON CONFLICT (day, category) DO UPDATE SET
+                total = total + excluded.total,
+                tx_count = tx_count + 1;
+        END;
+        """
+    )
+    _init_data_version(conn)
+
+
+def _init_data_version(conn: sqlite3.Connection) -> None:
+    """
+    Счётчик версии данных: увеличивается при любом изменении transactions.
+
+    Кэши вычислений (прогноз, кластеры) используют его как часть ключа: пока
+    версия та же, пересчитывать нечего. Чтение — одна строка по первичному ключу.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0);")
+    for event in ("INSERT", "DELETE", "UPDATE"):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_version_{event.lower()}
+            AFTER {event} ON transactions
+            BEGIN
+                UPDATE data_version SET version = version + 1 WHERE id = 1;
+            END;
+            """
+        )
+
+
+# Тексты запросов — константы: так они попадают в кэш подготовленных выражений
+_INSERT_TRANSACTION_SQL = """
+    INSERT INTO transactions (created_at, description, amount, category, tags)
+    VALUES (?, ?, ?, ?, ?);
+"""
+
+_SELECT_RECENT_SQL = """
+    SELECT id, created_at, description, amount, category, tags
+    FROM transactions
+    ORDER BY created_at DESC
+    LIMIT ?;
+"""
+
+_SUM_SINCE_SQL = "SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE created_at >= ?;"
+
+_DELETE_TRANSACTION_SQL = "DELETE FROM transactions WHERE id = ?;"
+
+# Промежуточная таблица массовой вставки: TEMP — своя у соединения и не берёт
+# блокировку записи основной БД. {name} — уникальное имя на вызов.
+_CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE {name} (
+        created_at  TEXT,
+        description TEXT,
+        amount      REAL,
+        category    TEXT,
+        tags        TEXT
+    );
+"""
+_INSERT_STAGING_SQL = "INSERT INTO temp.{name} VALUES (?, ?, ?, ?, ?);"
+_COPY_STAGING_SQL = """
+    INSERT INTO transactions (created_at, description, amount, category, tags)
+    SELECT created_at, description, amount, category, tags
+    FROM temp.{name}
+    ORDER BY rowid;
+"""
+_DROP_STAGING_SQL = "DROP TABLE IF EXISTS temp.{name};"
+_CLEAR_STAGING_SQL = "DELETE FROM temp.{name};"
+_staging_ids = count(1)
+
+_COUNT_AFTER_ID_SQL = "SELECT COUNT(*) FROM transactions WHERE id > ?;"
+_MAX_ID_SQL = "SELECT MAX(id) FROM transactions;"
+_MAX_ROWID = 2 ** 63 - 1
+
+# Запросы к сводке daily_category_totals (границы дней включительно)
+_ROLLUP_TOTAL_SINCE_SQL = "SELECT COALESCE(SUM(total), 0) FROM daily_category_totals WHERE day >= ?;"
+_ROLLUP_TOTAL_ALL_SQL = "SELECT COALESCE(SUM(total), 0) FROM daily_category_totals;"
+
+_ROLLUP_CATEGORY_TOTALS_SQL = """
+    SELECT category, SUM(total) AS total
+    FROM daily_category_totals
+    WHERE day BETWEEN ? AND ?
+    GROUP BY category
+    ORDER BY total DESC;
+"""
+
+_ROLLUP_DAILY_SERIES_SQL = """
+    SELECT day, SUM(total) AS total
+    FROM daily_category_totals
+    WHERE day BETWEEN ? AND ?
+    GROUP BY day
+    ORDER BY day;
+"""
+
+_ROLLUP_DAILY_SERIES_CATEGORY_SQL = """
+    SELECT day, total
+    FROM daily_category_totals
+    WHERE day BETWEEN ? AND ? AND category = ?
+    ORDER BY day;
+"""
+
+_ROLLUP_MONTHLY_SQL = """
+    SELECT substr(day, 1, 7) AS month, SUM(total) AS total
+    FROM daily_category_totals
+    GROUP BY substr(day, 1, 7)
+    ORDER BY month;
+"""
+
+_ROLLUP_MONTHLY_CATEGORY_SQL = """
+    SELECT substr(day, 1, 7) AS month, category, SUM(total) AS total
+    FROM daily_category_totals
+    GROUP BY substr(day, 1, 7), category
+    ORDER BY month, category;
+"""
+
+# Метрики дашборда за период одним запросом: суммы по категориям и по дням недели
+# (strftime('%w'): 0 — воскресенье). Обе части читают диапазон PK сводки.
+_DASHBOARD_AGGREGATES_SQL = """
+    SELECT 'category' AS kind, category AS key, SUM(total) AS total, SUM(tx_count) AS tx_count
+    FROM daily_category_totals
+    WHERE day BETWEEN ? AND ?
+    GROUP BY category
+    UNION ALL
+    SELECT 'weekday', strftime('%w', day), SUM(total), SUM(tx_count)
+    FROM daily_category_totals
+    WHERE day BETWEEN ? AND ?
+    GROUP BY strftime('%w', day)
+    UNION ALL
+    SELECT 'last_week', strftime('%w', day), SUM(total), SUM(tx_count)
+    FROM daily_category_totals
+    WHERE day BETWEEN ? AND ?
+    GROUP BY strftime('%w', day);
+"""
+
+_DATA_VERSION_SQL = "SELECT version FROM data_version WHERE id = 1;"
+
+# Для «от начала времён до конца времён» — строки, которые сравниваются как ISO-даты
+_MIN_DAY = "0000-01-01"
+_MAX_DAY = "9999-12-31"
 
 
 def add_transaction(
@@ -121,7 +572,7 @@ def add_transaction(
                       но CHECK в таблице всё равно защитит от ошибок.
         category    — одна из категорий бюджета (Transport, Food, ...).
         tags        — список тегов; в БД склеивается в строку через запятую,
-                      чтобы не усложнять схему второй таблицей.
+                      а индекс по тегам (transaction_tags) ведут триггеры.
 
     Возвращает:
         INTEGER — первичный ключ новой строки (lastrowid).
@@ -129,22 +580,17 @@ def add_transaction(
     Исключения:
         sqlite3.IntegrityError — если нарушен CHECK (amount < 0) и т.п.
     """
-    tags = tags or []
-    tags_str = ", ".join(tags) if tags else ""
+    tags_str = _tags_to_str(tags)
 
     # Время в UTC в ISO — однозначно при разборе и сортировке как строка
     created_at = datetime.now(timezone.utc).isoformat()
 
-    with sqlite3.connect(DB_PATH, timeout=5) as conn:
+    with locked_connection() as conn, conn:
         cur = conn.execute(
-            """
-            INSERT INTO transactions (created_at, description, amount, category, tags)
-            VALUES (?, ?, ?, ?, ?);
-            """,
+            _INSERT_TRANSACTION_SQL,
             (created_at, description.strip(), float(amount), category.strip(), tags_str),
         )
-        conn.commit()
-        return int(cur.lastrowid)
+    return int(cur.lastrowid)
 
 
 def fetch_recent_transactions(limit: int = 50) -> List[Dict[str, Any]]:
@@ -158,37 +604,524 @@ def fetch_recent_transactions(limit: int = 50) -> List[Dict[str, Any]]:
     """
     limit = max(1, min(int(limit), 500))  # защита от случайного limit=10**9
 
-    with sqlite3.connect(DB_PATH, timeout=5) as conn:
-        conn.row_factory = sqlite3.Row  # доступ к колонкам по имени
-        cur = conn.execute(
-            """
-            SELECT id, created_at, description, amount, category, tags
-            FROM transactions
-            ORDER BY created_at DESC
-            LIMIT ?;
-            """,
-            (limit,),
-        )
-        rows = cur.fetchall()
+    with locked_connection() as conn:
+        rows = conn.execute(_SELECT_RECENT_SQL, (limit,)).fetchall()
 
     # Row → обычный dict для Streamlit / JSON-сериализации
     return [dict(r) for r in rows]
 
 
+DayLike = Union[date, datetime, str, None]
+
+
+def _day_key(value: DayLike, default: str) -> str:
+    """date/datetime/ISO-строка → 'YYYY-MM-DD' (ключ сводки и границ периода); None → default."""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value[:10]
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.isoformat()
+
+
+# Курсор страницы истории: (created_at, id) последней показанной записи
+PageCursor = Tuple[str, int]
+
+MAX_PAGE_SIZE = 500
+
+
+def fetch_transactions_page(
+    start: DayLike = None,
+    end: DayLike = None,
+    category: Optional[str] = None,
+    tag: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    cursor: Optional[PageCursor] = None,
+    page_size: int = 50,
+) -> Tuple[List[Dict[str, Any]], Optional[PageCursor]]:
+    """
+    Одна страница истории (от новых к старым) с фильтрами и keyset-пагинацией.
+
+    Параметры:
+        start, end             — период по дням, обе границы включительно.
+        category               — точное совпадение категории.
+        tag                    — один тег из списка тегов записи (без учёта регистра).
+        min_amount, max_amount — диапазон суммы, включительно.
+        cursor                 — значение next_cursor предыдущей страницы; None — первая.
+        page_size              — размер страницы (не больше MAX_PAGE_SIZE).
+
+    Возвращает:
+        (строки, next_cursor) — next_cursor равен None, если дальше записей нет.
+
+    Почему курсор, а не OFFSET:
+        OFFSET 100000 заставляет SQLite пройти и выбросить 100k строк, и страница
+        становится тем дороже, чем дальше листаешь. Условие
+        `(created_at, id) < (курсор)` — это поиск по индексу (created_at, id),
+        (category, created_at, id) или, с фильтром по тегу, по первичному ключу
+        transaction_tags (tag, created_at, tx_id), поэтому любая страница стоит
+        одинаково. id в ключе делает порядок однозначным при совпадающих created_at.
+
+    Ограничение: индекс выбирается по одному фильтру — тег, иначе категория,
+    иначе только время. min_amount / max_amount (и категория вместе с тегом)
+    проверяются уже на строках из индекса: если таким фильтром отсекается почти
+    всё, страница стоит столько, сколько записей пришлось просмотреть до
+    page_size подходящих.
+    """
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+
+    # С тегом строки идут из transaction_tags в порядке (created_at, tx_id)
+    # для этого тега; время и курсор проверяются по его колонкам.
+    if tag:
+        source = "transaction_tags AS g JOIN transactions AS t ON t.id = g.tx_id"
+        time_col, id_col = "g.created_at", "g.tx_id"
+    else:
+        source = "transactions AS t"
+        time_col, id_col = "t.created_at", "t.id"
+
+    # Набор условий ограничен (максимум 2^7 вариантов SQL), так что все варианты
+    # запроса помещаются в кэш подготовленных выражений соединения.
+    where: List[str] = []
+    params: List[Any] = []
+    if tag:
+        where.append("g.tag = ?")
+        params.append(tag.strip())
+    if start is not None:
+        where.append(f"{time_col} >= ?")
+        params.append(_day_key(start, _MIN_DAY))
+    if end is not None:
+        # «До конца дня end» = строго меньше начала следующего дня
+        end_day = date.fromisoformat(_day_key(end, _MAX_DAY))
+        where.append(f"{time_col} < ?")
+        params.append((end_day + timedelta(days=1)).isoformat())
+    if category:
+        where.append("t.category = ?")
+        params.append(category)
+    if min_amount is not None:
+        where.append("t.amount >= ?")
+        params.append(float(min_amount))
+    if max_amount is not None:
+        where.append("t.amount <= ?")
+        params.append(float(max_amount))
+    if cursor is not None:
+        where.append(f"({time_col}, {id_col}) < (?, ?)")
+        params.extend([cursor[0], int(cursor[1])])
+
+    sql = f"SELECT t.id, t.created_at, t.description, t.amount, t.category, t.tags FROM {source}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    # +1 строка — дешёвый способ узнать, есть ли следующая страница
+    sql += f" ORDER BY {time_col} DESC, {id_col} DESC LIMIT ?;"
+    params.append(page_size + 1)
+
+    with locked_connection() as conn:
+        rows = [dict(r) for r in conn.execute(sql, params)]
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, (last["created_at"], last["id"])
+
+
+_ITER_TRANSACTIONS_SQL = """
+    SELECT id, created_at, description, amount, category, tags
+    FROM transactions
+    WHERE created_at >= ? AND created_at < ?
+    ORDER BY created_at, id;
+"""
+
+
+def iter_transactions(
+    start: DayLike = None,
+    end: DayLike = None,
+    chunk_size: int = 5000,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Лениво отдаёт транзакции периода [start, end] от старых к новым.
+
+    Строки читаются пачками через fetchmany, поэтому проход по всей истории
+    (бэктест правил, переобучение моделей) не держит её целиком в памяти.
+    Порядок (created_at, id) обслуживается индексом idx_transactions_created_id.
+    """
+    start_key = _day_key(start, _MIN_DAY)
+    end_key = (date.fromisoformat(_day_key(end, _MAX_DAY)) + timedelta(days=1)).isoformat() if end else _MAX_DAY
+    # Блокировка берётся на каждую пачку, а не на весь проход: генератор могут
+    # читать медленно (или бросить недочитанным), и другие потоки не должны ждать
+    conn, lock = _pool_entry()
+    with lock:
+        cur = conn.execute(_ITER_TRANSACTIONS_SQL, (start_key, end_key))
+    try:
+        while True:
+            with lock:
+                rows = cur.fetchmany(max(1, int(chunk_size)))
+            if not rows:
+                break
+            for r in rows:
+                yield dict(r)
+    finally:
+        cur.close()
+
+
+# Колонки, которые можно запрашивать у iter_transaction_chunks (имена попадают
+# в текст SQL, поэтому только из этого списка)
+_CHUNK_COLUMNS = ("id", "created_at", "description", "amount", "category", "tags")
+
+
+def iter_transaction_chunks(
+    columns: Sequence[str] = ("amount", "category"),
+    chunk_size: int = 10_000,
+    after_id: Optional[int] = None,
+    until_id: Optional[int] = None,
+) -> Iterator[List[Tuple[Any, ...]]]:
+    """
+    Отдаёт всю историю пачками кортежей — для обучения и пересчёта моделей.
+
+    В отличие от iter_transactions, строки не превращаются в словари: пачку
+    кортежей можно сразу разложить в массивы NumPy (`zip(*chunk)`).
+    Порядок — (created_at, id), от старых к новым.
+
+    after_id — только записи с id > after_id (и id <= until_id, если задан),
+    по возрастанию id (поиск по первичному ключу): так инкрементальные модели
+    догоняют новые вставки.
+    """
+    unknown = [c for c in columns if c not in _CHUNK_COLUMNS]
+    if unknown:
+        raise ValueError(f"Неизвестные колонки: {unknown}")
+
+    params: Tuple[Any, ...] = ()
+    if after_id is None:
+        sql = f"SELECT {', '.join(columns)} FROM transactions ORDER BY created_at, id;"
+    else:
+        sql = f"SELECT {', '.join(columns)} FROM transactions WHERE id > ? AND id <= ? ORDER BY id;"
+        params = (int(after_id), int(until_id) if until_id is not None else _MAX_ROWID)
+    # Отдельный курсор без row_factory: нужны обычные кортежи, а не sqlite3.Row
+    # Блокировка — на каждую пачку, как в iter_transactions
+    conn, lock = _pool_entry()
+    cur = conn.cursor()
+    cur.row_factory = None
+    try:
+        with lock:
+            cur.execute(sql, params)
+        while True:
+            with lock:
+                rows = cur.fetchmany(max(1, int(chunk_size)))
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+
+
+def count_transactions_after(after_id: int) -> int:
+    """Сколько записей с id > after_id (диапазон по первичному ключу)."""
+    with locked_connection() as conn:
+        return int(conn.execute(_COUNT_AFTER_ID_SQL, (int(after_id),)).fetchone()[0])
+
+
+def delete_transaction(transaction_id: int) -> bool:
+    """Удаляет транзакцию по id; True, если запись была. Сводку поправит триггер."""
+    with locked_connection() as conn, conn:
+        cur = conn.execute(_DELETE_TRANSACTION_SQL, (int(transaction_id),))
+    return cur.rowcount > 0
+
+
 def sum_amounts_since(created_after_iso: Optional[str] = None) -> float:
     """
     Сумма всех amount (опционально только записей новее указанной даты ISO).
 
-    Заготовка для будущих отчётов «сколько потрачено за месяц» без выгрузки
-    всех строк в Python. Пока можно не вызывать из UI — но API уже есть.
+    Без аргумента или с чистой датой («2024-05-01») ответ берётся из сводки
+    daily_category_totals — без сканирования transactions. Полная метка времени
+    (с часами) требует точного сравнения, и тогда суммируются сами транзакции.
     """
-    with sqlite3.connect(DB_PATH, timeout=5) as conn:
-        if created_after_iso:
-            cur = conn.execute(
-                "SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE created_at >= ?;",
-                (created_after_iso,),
-            )
+    with locked_connection() as conn:
+        if not created_after_iso:
+            cur = conn.execute(_ROLLUP_TOTAL_ALL_SQL)
+        elif len(created_after_iso) == 10:
+            cur = conn.execute(_ROLLUP_TOTAL_SINCE_SQL, (created_after_iso,))
         else:
-            cur = conn.execute("SELECT COALESCE(SUM(amount), 0) FROM transactions;")
+            cur = conn.execute(_SUM_SINCE_SQL, (created_after_iso,))
         row = cur.fetchone()
-        return float(row[0] if row and row[0] is not None else 0.0)
+    return float(row[0] if row and row[0] is not None else 0.0)
+
+
+# ---------------------------------------------------------------------------
+# Чтение сводки daily_category_totals
+# ---------------------------------------------------------------------------
+
+def total_since(since: DayLike = None) -> float:
+    """Сумма трат начиная с дня `since` (включительно); без аргумента — за всё время."""
+    return sum_amounts_since(_day_key(since, "") or None)
+
+
+def category_totals_between(start: DayLike = None, end: DayLike = None) -> Dict[str, float]:
+    """
+    Суммы по категориям за период [start, end] (обе границы — дни, включительно).
+
+    Порядок — от самой затратной категории к наименее затратной.
+    """
+    with locked_connection() as conn:
+        cur = conn.execute(
+            _ROLLUP_CATEGORY_TOTALS_SQL,
+            (_day_key(start, _MIN_DAY), _day_key(end, _MAX_DAY)),
+        )
+        return {row["category"]: float(row["total"]) for row in cur}
+
+
+def daily_totals_series(
+    start: DayLike = None,
+    end: DayLike = None,
+    category: Optional[str] = None,
+) -> List[Tuple[str, float]]:
+    """
+    Ряд (день, сумма) за период [start, end], по возрастанию дней.
+
+    Дни без трат в сводке отсутствуют — при построении графика их нужно
+    дополнить нулями на стороне вызывающего кода.
+    """
+    start_key, end_key = _day_key(start, _MIN_DAY), _day_key(end, _MAX_DAY)
+    with locked_connection() as conn:
+        if category:
+            cur = conn.execute(_ROLLUP_DAILY_SERIES_CATEGORY_SQL, (start_key, end_key, category))
+        else:
+            cur = conn.execute(_ROLLUP_DAILY_SERIES_SQL, (start_key, end_key))
+        return [(row["day"], float(row["total"])) for row in cur]
+
+
+def monthly_totals() -> List[Tuple[str, float]]:
+    """Ряд (месяц 'YYYY-MM', сумма) по всей истории; месяцы без трат отсутствуют."""
+    with locked_connection() as conn:
+        return [(row["month"], float(row["total"])) for row in conn.execute(_ROLLUP_MONTHLY_SQL)]
+
+
+def monthly_category_totals() -> List[Tuple[str, str, float]]:
+    """Строки (месяц, категория, сумма) по всей истории — O(месяцев × категорий)."""
+    with locked_connection() as conn:
+        cur = conn.execute(_ROLLUP_MONTHLY_CATEGORY_SQL)
+        return [(row["month"], row["category"], float(row["total"])) for row in cur]
+
+
+@dataclass
+class DashboardAggregates:
+    """
+    Метрики дашборда за период.
+
+    total / tx_count — сумма и число трат; category_totals — суммы по категориям
+    (от самой затратной); weekday_totals — суммы по дням недели [Пн, ..., Вс];
+    last_week_totals — то же за последние 7 дней периода (end − 6 … end, каждый
+    день недели ровно один раз) — ряд для недельного отчёта.
+    """
+    total: float
+    tx_count: int
+    category_totals: Dict[str, float]
+    weekday_totals: List[float]
+    last_week_totals: List[float]
+
+
+def dashboard_aggregates(start: DayLike = None, end: DayLike = None) -> DashboardAggregates:
+    """
+    Итог периода [start, end], суммы по категориям, по дням недели и по дням
+    последней недели периода — за один запрос к сводке daily_category_totals.
+    Стоимость зависит от числа дней × категорий в периоде, а не от числа трат,
+    поэтому дашборд остаётся быстрым и на миллионах записей. Без end последняя
+    неделя считается до сегодняшнего дня.
+    """
+    start_key, end_key = _day_key(start, _MIN_DAY), _day_key(end, _MAX_DAY)
+    week_end = date.fromisoformat(_day_key(end, date.today().isoformat()))
+    week_keys = ((week_end - timedelta(days=6)).isoformat(), week_end.isoformat())
+    with locked_connection() as conn:
+        rows = conn.execute(
+            _DASHBOARD_AGGREGATES_SQL, (start_key, end_key, start_key, end_key, *week_keys)
+        ).fetchall()
+
+    category_totals: Dict[str, float] = {}
+    weekday_totals = [0.0] * 7
+    last_week_totals = [0.0] * 7
+    tx_count = 0
+    for row in rows:
+        if row["kind"] == "category":
+            category_totals[row["key"]] = float(row["total"])
+            tx_count += int(row["tx_count"])
+        else:
+            # %w: 0 = воскресенье → индекс с понедельника
+            series = weekday_totals if row["kind"] == "weekday" else last_week_totals
+            series[(int(row["key"]) + 6) % 7] = float(row["total"])
+
+    category_totals = dict(sorted(category_totals.items(), key=lambda kv: kv[1], reverse=True))
+    return DashboardAggregates(
+        total=float(sum(category_totals.values())),
+        tx_count=tx_count,
+        category_totals=category_totals,
+        weekday_totals=weekday_totals,
+        last_week_totals=last_week_totals,
+    )
+
+
+def get_data_version() -> int:
+    """Текущая версия данных (растёт с каждой вставкой/удалением/правкой трат)."""
+    with locked_connection() as conn:
+        row = conn.execute(_DATA_VERSION_SQL).fetchone()
+    return int(row[0]) if row else 0
+
+
+# ---------------------------------------------------------------------------
+# Массовая загрузка (импорт выписок)
+# ---------------------------------------------------------------------------
+# add_transaction рассчитан на кнопку «Сохранить»: одно соединение и один commit
+# (fsync) на строку. Для выписки на 200k строк это 200k соединений и 200k fsync —
+# часы вместо секунд. Массовый путь делает всё в одной транзакции и шлёт строки
+# пачками через executemany, не материализуя весь вход в памяти.
+
+DEFAULT_BULK_CHUNK_SIZE = 5000
+
+# Строка для импорта: словарь с ключами description/amount/category/tags/created_at
+# или кортеж (description, amount, category[, tags[, created_at]]).
+BulkRow = Union[Mapping[str, Any], Sequence[Any]]
+
+
+@dataclass
+class BulkInsertReport:
+    """
+    Итог массовой вставки: сколько строк, за сколько секунд и с какой скоростью.
+    first_id..last_id — id вставленных строк (подряд: перенос в transactions —
+    один INSERT…SELECT под блокировкой записи); None, если строк не было.
+    """
+
+    rows: int
+    seconds: float
+    chunks: int
+    first_id: Optional[int] = None
+    last_id: Optional[int] = None
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float(self.rows)
+
+    def __str__(self):
+        return (
+            f"{self.rows} строк за {self.seconds:.2f} с "
+            f"({self.rows_per_sec:,.0f} строк/с, пачек: {self.chunks})"
+        )
+
+
+def _tags_to_str(tags: Any) -> str:
+    """
+    Теги в формате колонки `tags`, как их пишет add_transaction: "a, b".
+    Строка "a,b" / "a , b" разбивается по запятым и склеивается заново — иначе
+    фильтр по тегу (fetch_transactions_page) её не находит.
+    """
+    if not tags:
+        return ""
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return ", ".join(str(t).strip() for t in tags if str(t).strip())
+
+
+def _created_at_to_iso(value: Any, default: str) -> str:
+    """datetime/date → ISO; строка считается уже ISO; пустое значение → default."""
+    if not value:
+        return default
+    if isinstance(value, str):
+        return value
+    return value.isoformat()
+
+
+def _bulk_row_params(row: BulkRow, default_created_at: str) -> Tuple[str, str, float, str, str]:
+    """Приводит одну входную строку к параметрам _INSERT_TRANSACTION_SQL."""
+    if isinstance(row, Mapping):
+        description = row["description"]
+        amount = row["amount"]
+        category = row["category"]
+        tags = row.get("tags")
+        created_at = row.get("created_at")
+    else:
+        description, amount, category = row[0], row[1], row[2]
+        tags = row[3] if len(row) > 3 else None
+        created_at = row[4] if len(row) > 4 else None
+
+    return (
+        _created_at_to_iso(created_at, default_created_at),
+        str(description).strip(),
+        float(amount),
+        str(category).strip(),
+        _tags_to_str(tags),
+    )
+
+
+def add_transactions_bulk(
+    rows: Iterable[BulkRow],
+    chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+) -> BulkInsertReport:
+    """
+    Вставляет поток транзакций «всё или ничего» и возвращает отчёт о скорости.
+
+    Параметры:
+        rows       — любой iterable/генератор строк (см. BulkRow). Вход читается
+                     лениво, пачками по chunk_size, поэтому файл выписки не нужно
+                     целиком загружать в память.
+        chunk_size — размер пачки для executemany. Больше — меньше вызовов из Python,
+                     но больше памяти на одну пачку; 1–10 тысяч обычно оптимально.
+
+    Как пишется:
+        - пачки складываются в TEMP-таблицу соединения короткими транзакциями.
+          TEMP-таблица не берёт блокировку записи основной БД, поэтому генератор
+          rows (разбор и категоризация выписки — это могут быть минуты) работает,
+          пока дашборд в другом процессе спокойно сохраняет траты;
+        - в конце один INSERT…SELECT переносит всё в transactions — блокировка
+          записи держится только на время копирования;
+        - WAL + synchronous=NORMAL — без fsync на каждую страницу журнала;
+          executemany переиспользует один подготовленный INSERT.
+
+    Если хотя бы одна строка нарушит CHECK (amount < 0), не содержит обязательного
+    поля или генератор rows упадёт, в transactions не попадает ничего — в истории
+    не остаётся «половины» выписки.
+    """
+    chunk_size = max(1, int(chunk_size))
+    # Строкам без created_at ставим время начала импорта — одно на всю пачку
+    default_created_at = datetime.now(timezone.utc).isoformat()
+
+    it = iter(rows)
+    total = 0
+    chunks = 0
+    started = time.perf_counter()
+    name = f"bulk_staging_{next(_staging_ids)}"
+
+    with locked_connection() as conn:
+        conn.execute(_CREATE_STAGING_SQL.format(name=name))
+    try:
+        # Пачка готовится (генератор rows) без блокировок; соединение берём только
+        # на executemany во временную таблицу
+        while True:
+            chunk = [_bulk_row_params(r, default_created_at) for r in islice(it, chunk_size)]
+            if not chunk:
+                break
+            with locked_connection() as conn, conn:
+                conn.executemany(_INSERT_STAGING_SQL.format(name=name), chunk)
+            total += len(chunk)
+            chunks += 1
+
+        last_id = None
+        if total:
+            # `with conn` — COMMIT в конце, при исключении ROLLBACK всего переноса.
+            # После первой вставки блокировка записи SQLite у нас до COMMIT, так что
+            # чужих строк между нашими нет и диапазон id сплошной
+            with locked_connection() as conn, conn:
+                conn.execute(_COPY_STAGING_SQL.format(name=name))
+                last_id = conn.execute(_MAX_ID_SQL).fetchone()[0]
+    finally:
+        with locked_connection() as conn:
+            try:
+                conn.execute(_DROP_STAGING_SQL.format(name=name))
+            except sqlite3.OperationalError:
+                # DROP не проходит, пока другой поток дочитывает курсор на этом
+                # соединении; пустая TEMP-таблица исчезнет вместе с соединением
+                with conn:
+                    conn.execute(_CLEAR_STAGING_SQL.format(name=name))
+
+    return BulkInsertReport(
+        rows=total,
+        seconds=time.perf_counter() - started,
+        chunks=chunks,
+        first_id=last_id - total + 1 if last_id is not None else None,
+        last_id=last_id,
+    )
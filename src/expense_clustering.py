@@ -1,14 +1,33 @@
 # src/expense_clustering.py
 """
 Кластеризация трат (K-Means) для выявления типов расходов.
+
+Модель обучается один раз: параметры StandardScaler и центроиды KMeans
+сохраняются в хранилище моделей (model_store) вместе со счётчиками и суммами
+по кластерам. Дальше:
+- `assign_clusters(batch)` — номера кластеров для новых трат (NumPy, без sklearn);
+- `update_clusters(batch)` — дообучение в стиле MiniBatchKMeans по мере
+  поступления трат: центроид сдвигается к новым точкам с шагом 1/count.
+Перезапуск дашборда стоит лишь чтения статистики из кэша процесса.
+
+Признаки: [amount, category_encoded, is_weekend, n_tags]. Если модель обучена
+по таблице transactions (`train_from_database`, два потоковых прохода пачками
+с partial_fit — память не зависит от размера истории), берётся она, иначе —
+модель на синтетических данных.
+
+    python expense_clustering.py --clusters 4      # переобучить по БД
 """
+import threading
+from dataclasses import dataclass
 from functools import lru_cache
-from typing import Dict, List, Tuple
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
 
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 
+from model_store import artifact_token, fingerprint, load_latest_artifact, load_or_train, save_artifact
+
 
 # Кодировка категорий
 CATEGORY_ENCODING = {
@@ -19,12 +38,17 @@ CATEGORY_ENCODING = {
     "Coffee": 4,
     "Other": 5,
 }
+_CATEGORY_NAMES = sorted(CATEGORY_ENCODING, key=CATEGORY_ENCODING.get)
+
+N_FEATURES = 4
+DB_MODEL_PREFIX = "expense_clusters_db"
+_MINIBATCH_PARAMS = {"random_state": 42, "n_init": 3}
 
 
 def _build_synthetic_transactions() -> np.ndarray:
     """
     Синтетические траты для кластеризации.
-    Признаки: [amount, category_encoded, is_weekend].
+    Признаки: [amount, category_encoded, is_weekend, n_tags] (тегов у синтетики нет).
     """
     np.random.seed(123)
     samples = []
@@ -53,22 +77,332 @@ def _build_synthetic_transactions() -> np.ndarray:
     for _ in range(20):
         samples.append([np.random.uniform(100, 2000), CATEGORY_ENCODING["Other"], np.random.choice([0, 1])])
     
-    return np.array(samples)
+    X = np.array(samples)
+    return np.column_stack([X, np.zeros(len(X))])
 
 
-def get_expense_clusters(n_clusters: int = 4) -> List[Dict]:
+def _fit_clusters(X: np.ndarray, n_clusters: int) -> Tuple[StandardScaler, KMeans]:
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+    kmeans.fit(X_scaled)
+    return scaler, kmeans
+
+
+@dataclass
+class ExpenseClusterModel:
     """
-    Кластеризация трат K-Means.
-    
-    Returns:
-        Список кластеров с описанием: название, средняя сумма, доля, описание.
+    Обученная кластеризация в виде голых массивов NumPy.
+
+    mean/scale — параметры StandardScaler, centroids — центры в масштабированном
+    пространстве. Статистика по кластерам (по ней строится описание кластеров,
+    а counts задаёт шаг дообучения): counts — число трат, amount_sums — сумма
+    amount, weekend_counts — траты в выходные, category_counts — матрица
+    кластер × категория (порядок категорий — CATEGORY_ENCODING).
+    artifact — (имя, fingerprint) в model_store, куда сохранять дообученную модель.
+    """
+    mean: np.ndarray
+    scale: np.ndarray
+    centroids: np.ndarray
+    counts: np.ndarray
+    amount_sums: np.ndarray
+    weekend_counts: np.ndarray
+    category_counts: np.ndarray
+    artifact: Tuple[str, str] = ("", "")
+
+    @classmethod
+    def empty(cls, mean: np.ndarray, scale: np.ndarray, centroids: np.ndarray) -> "ExpenseClusterModel":
+        n_clusters = centroids.shape[0]
+        return cls(
+            mean=np.asarray(mean, dtype=float).copy(),
+            scale=np.asarray(scale, dtype=float).copy(),
+            centroids=np.asarray(centroids, dtype=float).copy(),
+            counts=np.zeros(n_clusters, dtype=np.int64),
+            amount_sums=np.zeros(n_clusters),
+            weekend_counts=np.zeros(n_clusters, dtype=np.int64),
+            category_counts=np.zeros((n_clusters, len(CATEGORY_ENCODING)), dtype=np.int64),
+        )
+
+    @classmethod
+    def from_fitted(cls, scaler: StandardScaler, kmeans: KMeans, X: np.ndarray) -> "ExpenseClusterModel":
+        model = cls.empty(scaler.mean_, scaler.scale_, kmeans.cluster_centers_)
+        model.add_stats(X, kmeans.labels_)
+        return model
+
+    def add_stats(self, X: np.ndarray, labels: np.ndarray) -> None:
+        """Добавляет пачку (признаки + метки) в статистику кластеров."""
+        k = self.n_clusters
+        self.counts += np.bincount(labels, minlength=k)
+        self.amount_sums += np.bincount(labels, weights=X[:, 0], minlength=k)
+        self.weekend_counts += np.bincount(labels, weights=X[:, 2], minlength=k).astype(np.int64)
+        n_cat = self.category_counts.shape[1]
+        cats = np.clip(X[:, 1].astype(np.intp), 0, n_cat - 1)
+        self.category_counts += np.bincount(labels * n_cat + cats, minlength=k * n_cat).reshape(k, n_cat)
+
+    @property
+    def n_clusters(self) -> int:
+        return self.centroids.shape[0]
+
+    def _scaled(self, X: np.ndarray) -> np.ndarray:
+        return (X - self.mean) / self.scale
+
+    def assign(self, X: np.ndarray) -> np.ndarray:
+        """Номер ближайшего центроида для каждой строки признаков."""
+        Z = self._scaled(X)
+        # |z - c|^2 = |z|^2 - 2 z·c + |c|^2; |z|^2 не влияет на argmin
+        distances = (self.centroids ** 2).sum(axis=1) - 2.0 * Z @ self.centroids.T
+        return np.argmin(distances, axis=1)
+
+    def partial_update(self, X: np.ndarray) -> np.ndarray:
+        """
+        Шаг MiniBatchKMeans: точки пакета назначаются кластерам, каждый центроид
+        сдвигается к среднему своих новых точек с шагом n_new / count (то есть
+        1/count на точку) — центроид остаётся средним всех своих точек.
+        Scaler не меняется, чтобы номера кластеров оставались сопоставимыми.
+
+        Returns:
+            Метки кластеров для строк пакета.
+        """
+        labels = self.assign(X)
+        Z = self._scaled(X)
+        new_counts = np.bincount(labels, minlength=self.n_clusters)
+        touched = new_counts > 0
+        self.add_stats(X, labels)
+        sums = np.zeros_like(self.centroids)
+        np.add.at(sums, labels, Z)
+        self.centroids[touched] += (
+            sums[touched] - new_counts[touched, None] * self.centroids[touched]
+        ) / self.counts[touched, None]
+        return labels
+
+
+BatchLike = Union[np.ndarray, Sequence[Mapping[str, Any]]]
+
+
+def _count_tags(tags: Any) -> int:
+    if not tags:
+        return 0
+    if isinstance(tags, str):
+        return sum(1 for t in tags.split(",") if t.strip())
+    return len(tags)
+
+
+def _as_features(batch: BatchLike) -> np.ndarray:
+    """
+    Признаки [amount, category_encoded, is_weekend, n_tags] из массива или из
+    списка словарей с ключами amount, category и необязательными is_weekend,
+    tags (строка через запятую или список).
     """
+    if isinstance(batch, np.ndarray):
+        return np.atleast_2d(batch).astype(float)
+    other = CATEGORY_ENCODING["Other"]
+    return np.array(
+        [
+            [
+                float(row["amount"]),
+                CATEGORY_ENCODING.get(row.get("category"), other),
+                float(bool(row.get("is_weekend", False))),
+                _count_tags(row.get("tags", row.get("tags_list"))),
+            ]
+            for row in batch
+        ],
+        dtype=float,
+    ).reshape(-1, N_FEATURES)
+
+
+def _chunk_features(chunk: Sequence[Tuple[Any, ...]]) -> np.ndarray:
+    """
+    Признаки пачки строк (amount, category, created_at, tags) из БД.
+    День недели считается векторно: datetime64[D] — дни от 1970-01-01 (четверг).
+    """
+    amounts, categories, created, tags = zip(*chunk)
+    other = CATEGORY_ENCODING["Other"]
+    # Категорий в пачке единицы — словарь применяется к уникальным значениям
+    uniques, inverse = np.unique(np.array(categories, dtype=object), return_inverse=True)
+    codes = np.array([CATEGORY_ENCODING.get(c, other) for c in uniques], dtype=float)[inverse]
+    days = np.array([c[:10] for c in created], dtype="datetime64[D]").astype(np.int64)
+    # Теги в БД — «a, b, c»: число тегов = число запятых + 1 у непустой строки
+    tags_arr = np.array([t or "" for t in tags], dtype=str)
+    n_tags = np.where(tags_arr == "", 0, np.char.count(tags_arr, ",") + 1)
+    return np.column_stack([
+        np.asarray(amounts, dtype=float),
+        codes,
+        ((days + 3) % 7 >= 5).astype(float),
+        n_tags.astype(float),
+    ])
+
+
+def _model_key(n_clusters: int) -> Tuple[str, str]:
+    X = _build_synthetic_transactions()
+    fp = fingerprint(X, {"n_clusters": n_clusters, "random_state": 42, "n_init": 10})
+    return f"expense_clusters_{n_clusters}", fp
+
+
+def _train_cluster_model(n_clusters: int) -> ExpenseClusterModel:
     X = _build_synthetic_transactions()
+    scaler, kmeans = _fit_clusters(X, n_clusters)
+    model = ExpenseClusterModel.from_fitted(scaler, kmeans, X)
+    model.artifact = _model_key(n_clusters)
+    return model
+
+
+def train_from_database(
+    n_clusters: int = 4,
+    chunk_size: int = 10_000,
+    min_rows: int = 50,
+) -> ExpenseClusterModel:
+    """
+    Обучает кластеризацию на таблице transactions и сохраняет модель.
+
+    Два потоковых прохода пачками по chunk_size строк (в памяти только пачка):
+    1. StandardScaler.partial_fit — среднее и разброс признаков;
+    2. MiniBatchKMeans.partial_fit на масштабированной пачке; метки, которые
+       partial_fit посчитал для этой же пачки, сразу идут в статистику кластеров.
+    Статистика накапливается по мере сходимости центроидов, поэтому для ранних
+    пачек она приблизительна — для описания кластеров этого достаточно.
+
+    Raises:
+        ValueError: если в истории меньше min_rows (или меньше n_clusters) трат.
+    """
+    from database import iter_transaction_chunks
+
+    columns = ("amount", "category", "created_at", "tags")
     scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+    seen = 0
+    for chunk in iter_transaction_chunks(columns=columns, chunk_size=chunk_size):
+        scaler.partial_fit(_chunk_features(chunk))
+        seen += len(chunk)
+    if seen < max(min_rows, n_clusters):
+        raise ValueError(f"Недостаточно трат для кластеризации: {seen} (нужно хотя бы {max(min_rows, n_clusters)})")
+
+    # Первый partial_fit требует хотя бы n_clusters строк в пачке
+    chunk_size = max(chunk_size, n_clusters)
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=chunk_size, **_MINIBATCH_PARAMS)
+    model: Optional[ExpenseClusterModel] = None
+    for chunk in iter_transaction_chunks(columns=columns, chunk_size=chunk_size):
+        X = _chunk_features(chunk)
+        kmeans.partial_fit(scaler.transform(X))
+        if model is None:
+            model = ExpenseClusterModel.empty(scaler.mean_, scaler.scale_, kmeans.cluster_centers_)
+        model.add_stats(X, kmeans.labels_)
+    model.centroids = kmeans.cluster_centers_.copy()
+
+    name = f"{DB_MODEL_PREFIX}_{n_clusters}"
+    fp = fingerprint(model.mean, model.scale, model.centroids, {"rows": seen, **_MINIBATCH_PARAMS})
+    model.artifact = (name, fp)
+    save_artifact(name, fp, model)
+    _load_cluster_model.cache_clear()
+    return model
+
+
+def cluster_model_token(n_clusters: int = 4) -> Tuple[Any, Any]:
+    """
+    Какие модели кластеров сейчас на диске (по БД и синтетическая): меняется,
+    когда модель переобучают или дообучают — в этом процессе или в другом.
+    """
+    return (
+        artifact_token(f"{DB_MODEL_PREFIX}_{n_clusters}"),
+        artifact_token(f"expense_clusters_{n_clusters}"),
+    )
+
+
+def get_cluster_model(n_clusters: int = 4) -> ExpenseClusterModel:
+    """
+    Модель процесса: обученная по БД (train_from_database), если есть,
+    иначе синтетическая — с диска, а если артефакта нет, обучается один раз.
+    Кэш процесса привязан к артефактам на диске (cluster_model_token), так что
+    переобучение из `python expense_clustering.py` подхватывается без перезапуска.
+    """
+    return _load_cluster_model(n_clusters, cluster_model_token(n_clusters))
+
+
+@lru_cache(maxsize=4)
+def _load_cluster_model(n_clusters: int, token: Tuple[Any, Any]) -> ExpenseClusterModel:
+    stored = load_latest_artifact(f"{DB_MODEL_PREFIX}_{n_clusters}", ExpenseClusterModel)
+    if stored is not None and stored.centroids.shape[1] == N_FEATURES:
+        return stored
+    name, fp = _model_key(n_clusters)
+    return load_or_train(name, fp, lambda: _train_cluster_model(n_clusters), ExpenseClusterModel)
+
+
+def assign_clusters(batch: BatchLike, n_clusters: int = 4) -> np.ndarray:
+    """Номера кластеров для новых трат без переобучения."""
+    X = _as_features(batch)
+    if len(X) == 0:
+        return np.empty(0, dtype=np.intp)
+    return get_cluster_model(n_clusters).assign(X)
+
+
+# Дообучение меняет общую модель процесса (счётчики, затем центроиды по ним), а
+# сессии Streamlit идут в разных потоках: одно обновление с сохранением за раз.
+# Модель берётся уже под блокировкой — после чужого save_artifact get_cluster_model
+# перечитывает её с диска, и обновления не расходятся по двум объектам.
+_update_lock = threading.Lock()
+
+
+def update_clusters(batch: BatchLike, n_clusters: int = 4, persist: bool = True) -> np.ndarray:
+    """
+    Дообучает модель процесса на новых тратах и (по умолчанию) сохраняет её,
+    чтобы следующий старт продолжил с обновлёнными центроидами.
+    Ошибка записи не мешает: модель в памяти уже обновлена.
+    """
+    X = _as_features(batch)
+    if len(X) == 0:
+        return np.empty(0, dtype=np.intp)
+    with _update_lock:
+        model = get_cluster_model(n_clusters)
+        labels = model.partial_update(X)
+        if persist:
+            try:
+                save_artifact(*model.artifact, model)
+            except OSError:
+                pass
+    return labels
+
+
+def update_clusters_from_database(
+    first_id: int,
+    last_id: int,
+    n_clusters: int = 4,
+    chunk_size: int = 10_000,
+) -> int:
+    """
+    Дообучает модель процесса на записях БД с id в [first_id, last_id] (например,
+    только что импортированная выписка) пачками и сохраняет её один раз в конце.
+    Возвращает число учтённых строк.
+    """
+    from database import iter_transaction_chunks
+
+    seen = 0
+    with _update_lock:
+        model = get_cluster_model(n_clusters)
+        for chunk in iter_transaction_chunks(
+            columns=("amount", "category", "created_at", "tags"),
+            chunk_size=chunk_size,
+            after_id=first_id - 1,
+            until_id=last_id,
+        ):
+            model.partial_update(_chunk_features(chunk))
+            seen += len(chunk)
+        if seen:
+            try:
+                save_artifact(*model.artifact, model)
+            except OSError:
+                pass
+    return seen
+
+
+def get_expense_clusters(n_clusters: int = 4) -> List[Dict]:
+    """
+    Описание кластеров трат по сохранённой модели (см. get_cluster_model):
+    данные заново не строятся и KMeans не переобучается.
     
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(X_scaled)
+    Returns:
+        Список кластеров с описанием: название, средняя сумма, доля, основная
+        категория, доля трат в выходные, описание.
+    """
+    model = get_cluster_model(n_clusters)
+    total = int(model.counts.sum())
     
     cluster_names = [
         "Повседневные траты",
@@ -79,21 +413,43 @@ def get_expense_clusters(n_clusters: int = 4) -> List[Dict]:
     
     results = []
     for i in range(n_clusters):
-        mask = labels == i
-        amounts = X[mask, 0]
-        avg = float(np.mean(amounts))
-        count = int(np.sum(mask))
-        pct = count / len(X) * 100
+        count = int(model.counts[i])
+        avg = float(model.amount_sums[i] / count) if count else 0.0
+        pct = count / total * 100 if total else 0.0
+        top_category = _CATEGORY_NAMES[int(np.argmax(model.category_counts[i]))]
+        weekend_pct = model.weekend_counts[i] / count * 100 if count else 0.0
         
         name = cluster_names[i] if i < len(cluster_names) else f"Кластер {i+1}"
-        desc = f"Средняя сумма: {avg:,.0f} ₸. Доля трат: {pct:.0f}%."
+        desc = (
+            f"Средняя сумма: {avg:,.0f} ₸. Доля трат: {pct:.0f}%. "
+            f"Чаще всего: {top_category}; в выходные: {weekend_pct:.0f}%."
+        )
         
         results.append({
             "name": name,
             "avg_amount": avg,
             "count": count,
             "pct": pct,
+            "top_category": top_category,
+            "weekend_pct": float(weekend_pct),
             "description": desc,
         })
     
     return results
+
+
+if __name__ == "__main__":
+    # Переобучение по истории трат и вывод статистики кластеров
+    import argparse
+
+    from database import init_db
+
+    parser = argparse.ArgumentParser(description="Кластеризация трат по истории из БД")
+    parser.add_argument("--clusters", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    args = parser.parse_args()
+
+    init_db()
+    train_from_database(n_clusters=args.clusters, chunk_size=args.chunk_size)
+    for cluster in get_expense_clusters(n_clusters=args.clusters):
+        print(f"{cluster['name']:<22} {cluster['count']:>9,} | {cluster['description']}")
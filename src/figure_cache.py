@@ -0,0 +1,131 @@
+# src/figure_cache.py
+"""
+Кэш отрисованных графиков matplotlib для дашборда.
+
+Streamlit перезапускает main.py при любом действии пользователя, и каждый
+перезапуск заново строил фигуры (прогноз, два графа знаний), хотя данные не
+менялись. Здесь фигура рисуется один раз на набор входных данных, а дальше
+отдаются готовые байты PNG/SVG:
+
+    png = get_figure_cache().render(
+        ("forecast", chart_data, total_limit),   # всё, от чего зависит картинка
+        lambda: build_forecast_figure(...),      # вызывается только при промахе
+    )
+    st.image(png)
+
+Ключ — хэш входных данных. Вытеснение — LRU с ограничением по суммарному
+размеру байтов (max_bytes) и по числу картинок (max_items).
+Фигура после отрисовки закрывается (plt.close), чтобы pyplot не копил их в памяти.
+"""
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_MAX_ITEMS = 64
+
+
+def figure_key(parts: Any) -> str:
+    """Хэш входных данных графика (JSON; несериализуемое — через repr)."""
+    payload = json.dumps(parts, sort_keys=True, default=repr, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class FigureCache:
+    """LRU-кэш байтов картинок с лимитом по памяти; потокобезопасен."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_items: int = DEFAULT_MAX_ITEMS) -> None:
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return  # картинка больше всего кэша — не кэшируем
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes or len(self._items) > self.max_items:
+                _key, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def render(
+        self,
+        parts: Any,
+        build: Callable[[], Any],
+        fmt: str = "png",
+        dpi: int = 100,
+    ) -> bytes:
+        """
+        Байты картинки для входных данных parts: из кэша или через build().
+
+        build() возвращает matplotlib Figure; она сохраняется в fmt ("png"/"svg")
+        и закрывается. Два потока могут одновременно отрисовать один и тот же
+        ключ — результат одинаковый, лишняя работа лишь однократная.
+        """
+        key = figure_key([parts, fmt, dpi])
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        import matplotlib.pyplot as plt
+
+        fig = build()
+        try:
+            buf = io.BytesIO()
+            fig.savefig(buf, format=fmt, dpi=dpi, bbox_inches="tight")
+        finally:
+            plt.close(fig)
+        data = buf.getvalue()
+        self.put(key, data)
+        return data
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_default_cache: Optional[FigureCache] = None
+_default_lock = threading.Lock()
+
+
+def get_figure_cache() -> FigureCache:
+    """Общий кэш процесса (переживает перезапуски скрипта Streamlit)."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = FigureCache()
+        return _default_cache
@@ -1,12 +1,34 @@
 # src/forecast.py
 """
 Прогноз расходов (Time Series) и оценка вероятности уложиться в бюджет.
+
+Прогноз строится по помесячным суммам из сводки daily_category_totals (SQLite).
+Модель — экспоненциальное сглаживание на NumPy:
+- Холт–Винтерс (уровень + тренд + аддитивная годовая сезонность), если есть
+  хотя бы два полных года истории;
+- метод Холта (уровень + тренд), если истории меньше;
+- если полных месяцев меньше MIN_HISTORY_MONTHS — как раньше, линейная регрессия
+  по имитационным данным, чтобы дашборд не был пустым.
+Подобранная модель кэшируется по версии данных БД: перезапуск Streamlit без
+новых трат не пересчитывает ничего.
 """
-from datetime import date
-from typing import Dict, List, Tuple
+import calendar
+import sqlite3
+from dataclasses import dataclass
+from datetime import date, timedelta
+from functools import lru_cache
+from statistics import NormalDist
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
-from sklearn.linear_model import LinearRegression
+
+# Длина сезона (месяцев) и минимальная история для реального прогноза
+SEASON_LENGTH = 12
+MIN_HISTORY_MONTHS = 3
+
+# Сетка параметров сглаживания (alpha, beta, gamma) — подбирается по SSE
+# одношаговых ошибок; все комбинации считаются одновременно как векторы NumPy.
+_SMOOTHING_GRID = np.array([0.05, 0.2, 0.4, 0.6, 0.8, 0.95])
 
 
 def _get_synthetic_monthly_data() -> List[Tuple[int, float]]:
@@ -21,13 +43,10 @@ def _get_synthetic_monthly_data() -> List[Tuple[int, float]]:
     return list(zip(months, amounts))
 
 
-def forecast_next_month(total_limit: float) -> Tuple[float, Dict]:
-    """
-    Прогноз общей суммы расходов на следующий месяц.
-    
-    Returns:
-        (прогноз_в_тенге, данные_для_графика)
-    """
+def _synthetic_forecast() -> Tuple[List[str], List[float], float, str]:
+    """Запасной вариант без истории: линейная регрессия по имитационным данным."""
+    from sklearn.linear_model import LinearRegression
+
     data = _get_synthetic_monthly_data()
     X = np.array([[m] for m, _ in data])
     y = np.array([a for _, a in data])
@@ -36,16 +55,275 @@ def forecast_next_month(total_limit: float) -> Tuple[float, Dict]:
     next_month_idx = len(data)
     forecast = model.predict([[next_month_idx]])[0]
     forecast = max(0, float(forecast))
+    labels = [f"М{i+1}" for i in range(len(data) + 1)]
+    return labels, [a for _, a in data], forecast, "демо-данные (линейная регрессия)"
+
+
+def _month_index(month: str) -> int:
+    """'YYYY-MM' → номер месяца от нулевого года (для арифметики месяцев)."""
+    year, mon = month.split("-")
+    return int(year) * 12 + int(mon) - 1
+
+
+def _month_label(index: int) -> str:
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def _complete_months(rows: List[Tuple[str, float]], current_month: str) -> Tuple[List[str], np.ndarray]:
+    """
+    Непрерывный ряд полных месяцев от первого месяца с тратами до прошлого
+    месяца включительно: месяцы без трат (в сводке их нет) — нули, в том числе
+    в конце ряда. Текущий незаконченный месяц и всё после него отбрасываются.
+    Без этого ряд с «дырами» считался бы сплошным и сезонный индекс
+    (n + horizon − 1) % m в _predict указывал бы не на тот месяц.
+    """
+    current = _month_index(current_month)
+    by_month = {_month_index(m): total for m, total in rows if _month_index(m) < current}
+    if not by_month:
+        return [], np.zeros(0)
+    indices = range(min(by_month), current)
+    return [_month_label(i) for i in indices], np.array([by_month.get(i, 0.0) for i in indices])
+
+
+def _fit_exponential_smoothing(y: np.ndarray, season_length: int = SEASON_LENGTH) -> Dict:
+    """
+    Подбор аддитивного экспоненциального сглаживания по сетке параметров.
+
+    Все комбинации (alpha, beta[, gamma]) обновляются одновременно — один цикл
+    по времени над векторами длины «число комбинаций», без цикла по сетке.
+    Возвращает состояние лучшей комбинации: level, trend, season, параметры.
+    """
+    n = len(y)
+    seasonal = n >= 2 * season_length
+    grid = _SMOOTHING_GRID
+    if seasonal:
+        alpha, beta, gamma = (a.ravel() for a in np.meshgrid(grid, grid, grid, indexing="ij"))
+    else:
+        alpha, beta = (a.ravel() for a in np.meshgrid(grid, grid, indexing="ij"))
+        gamma = np.zeros_like(alpha)
+    combos = len(alpha)
+
+    if seasonal:
+        m = season_length
+        level = np.full(combos, y[:m].mean())
+        trend = np.full(combos, (y[m:2 * m].mean() - y[:m].mean()) / m)
+        season = np.tile(y[:m] - y[:m].mean(), (combos, 1))
+        start = m  # первый сезон ушёл на инициализацию
+    else:
+        m = 1
+        level = np.full(combos, y[0])
+        trend = np.full(combos, y[1] - y[0])
+        season = np.zeros((combos, 1))
+        start = 1
+
+    sse = np.zeros(combos)
+    for t in range(start, n):
+        s_idx = t % m
+        s_t = season[:, s_idx]
+        err = y[t] - (level + trend + s_t)
+        sse += err * err
+        new_level = alpha * (y[t] - s_t) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        if seasonal:
+            season[:, s_idx] = gamma * (y[t] - new_level) + (1 - gamma) * s_t
+        level = new_level
+
+    best = int(np.argmin(sse))
+    return {
+        "method": "Холт–Винтерс" if seasonal else "Холт (тренд)",
+        "level": float(level[best]),
+        "trend": float(trend[best]),
+        "season": season[best].copy(),
+        "season_length": m,
+        "n": n,
+        "params": (float(alpha[best]), float(beta[best]), float(gamma[best])),
+        "rmse": float(np.sqrt(sse[best] / max(n - start, 1))),
+    }
+
+
+def _predict(model: Dict, horizon: int) -> float:
+    """Прогноз на horizon шагов после последнего месяца ряда (не меньше нуля)."""
+    season = model["season"][(model["n"] + horizon - 1) % model["season_length"]]
+    return max(0.0, model["level"] + horizon * model["trend"] + float(season))
+
+
+@lru_cache(maxsize=64)
+def _cached_forecast(
+    data_version: int,
+    current_month: str,
+    category: Optional[str],
+) -> Optional[Tuple[Tuple[str, ...], Tuple[float, ...], float, str]]:
+    """
+    Подбор модели по истории из БД. Ключ кэша — версия данных (database.get_data_version)
+    и текущий месяц: пока ни то, ни другое не поменялось, модель не пересчитывается.
+    None — если полных месяцев меньше MIN_HISTORY_MONTHS.
+    """
+    from database import monthly_category_totals, monthly_totals
+
+    if category is None:
+        rows = monthly_totals()
+    else:
+        rows = [(m, total) for m, c, total in monthly_category_totals() if c == category]
+
+    labels, y = _complete_months(rows, current_month)
+    if len(y) < MIN_HISTORY_MONTHS:
+        return None
+
+    model = _fit_exponential_smoothing(y)
+    # Ряд кончается прошлым месяцем; «следующий месяц» — через два шага
+    horizon = _month_index(current_month) + 1 - _month_index(labels[-1])
+    forecast = _predict(model, horizon)
+    return tuple(labels), tuple(float(v) for v in y), forecast, model["method"]
+
+
+def _history_forecast(category: Optional[str] = None) -> Optional[Tuple[Tuple[str, ...], Tuple[float, ...], float, str]]:
+    try:
+        from database import get_data_version
+        version = get_data_version()
+    except sqlite3.Error:
+        return None  # БД ещё не инициализирована
+    return _cached_forecast(version, date.today().strftime("%Y-%m"), category)
+
+
+def forecast_next_month(total_limit: float, category: Optional[str] = None) -> Tuple[float, Dict]:
+    """
+    Прогноз общей суммы расходов (или суммы по категории) на следующий месяц.
+    
+    Returns:
+        (прогноз_в_тенге, данные_для_графика) — на графике последние 12 полных
+        месяцев истории и столбец прогноза; "method" — какой моделью посчитано.
+    """
+    fitted = _history_forecast(category)
+    if fitted is None:
+        labels, actual, forecast, method = _synthetic_forecast()
+    else:
+        history_labels, history, forecast, method = fitted
+        history_labels, history = list(history_labels[-12:]), list(history[-12:])
+        next_month = _month_index(date.today().strftime("%Y-%m")) + 1
+        labels = history_labels + [_month_label(next_month)]
+        actual = history
     
     chart_data = {
-        "months": [f"М{i+1}" for i in range(len(data) + 1)],
-        "actual": [a for _, a in data],
+        "months": labels,
+        "actual": actual,
         "forecast": float(forecast),
         "limit": total_limit,
+        "method": method,
     }
     return forecast, chart_data
 
 
+@dataclass
+class MultiSeriesForecast:
+    """
+    Результат пакетного прогноза: по одному значению на ряд (строку матрицы).
+    NaN — у ряда меньше двух наблюдений (интервал — меньше трёх).
+    """
+    forecast: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+    slope: np.ndarray
+    intercept: np.ndarray
+    level: float
+
+
+def forecast_matrix(Y: np.ndarray, horizon: int = 1, level: float = 0.95) -> MultiSeriesForecast:
+    """
+    Пакетный прогноз для матрицы рядов (ряды × месяцы) одним векторным проходом.
+
+    Для каждой строки — линейный тренд по МНК в замкнутой форме (суммы по оси
+    времени, без цикла по рядам и без sklearn), прогноз на `horizon` шагов после
+    последнего столбца и интервал предсказания
+        ŷ ± z · s · sqrt(1 + 1/n + (t0 − t̄)² / Sxx),
+    где s — стандартное отклонение остатков ряда. z — квантиль нормального
+    распределения (на коротких рядах интервал получается чуть уже, чем по Стьюденту).
+    Пропуски (NaN) исключаются из подгонки своего ряда. Прогноз и нижняя граница
+    не опускаются ниже нуля — траты не бывают отрицательными.
+    """
+    Y = np.asarray(Y, dtype=float)
+    if Y.ndim == 1:
+        Y = Y[np.newaxis, :]
+    T = Y.shape[1]
+    t = np.arange(T, dtype=float)
+
+    observed = ~np.isnan(Y)
+    y = np.where(observed, Y, 0.0)
+    w = observed.astype(float)
+    n = w.sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t_mean = (w * t).sum(axis=1) / n
+        y_mean = y.sum(axis=1) / n
+        dt = (t - t_mean[:, np.newaxis]) * w
+        sxx = (dt * dt).sum(axis=1)
+        slope = (dt * (y - y_mean[:, np.newaxis])).sum(axis=1) / sxx
+        intercept = y_mean - slope * t_mean
+
+        residuals = (y - (intercept[:, np.newaxis] + slope[:, np.newaxis] * t)) * w
+        s = np.sqrt((residuals * residuals).sum(axis=1) / (n - 2))
+
+        t0 = T - 1 + horizon
+        forecast = intercept + slope * t0
+        z = NormalDist().inv_cdf(0.5 + level / 2)
+        half_width = z * s * np.sqrt(1 + 1 / n + (t0 - t_mean) ** 2 / sxx)
+
+    # Ряд из одной точки: наклон не определён
+    slope = np.where(n >= 2, slope, np.nan)
+    forecast = np.where(n >= 2, forecast, np.nan)
+    half_width = np.where(n >= 3, half_width, np.nan)
+
+    return MultiSeriesForecast(
+        forecast=np.maximum(forecast, 0.0),
+        lower=np.maximum(forecast - half_width, 0.0),
+        upper=np.maximum(forecast + half_width, 0.0),
+        slope=slope,
+        intercept=intercept,
+        level=level,
+    )
+
+
+@lru_cache(maxsize=8)
+def _cached_category_forecasts(data_version: int, current_month: str) -> Dict[str, Tuple[float, float, float]]:
+    from database import monthly_category_totals
+
+    rows = monthly_category_totals()
+    current = _month_index(current_month)
+    rows = [(m, c, total) for m, c, total in rows if _month_index(m) < current]
+    if not rows:
+        return {}
+
+    # Матрица категории × месяцы (от первого месяца истории до прошлого), пропуски — нули
+    first = min(_month_index(m) for m, _c, _t in rows)
+    if current - first < MIN_HISTORY_MONTHS:
+        return {}
+    categories = sorted({c for _m, c, _t in rows})
+    row_of = {c: i for i, c in enumerate(categories)}
+    Y = np.zeros((len(categories), current - first))
+    for m, c, total in rows:
+        Y[row_of[c], _month_index(m) - first] = total
+
+    # Последний столбец — прошлый месяц, следующий месяц — через два шага
+    result = forecast_matrix(Y, horizon=2)
+    return {
+        c: (float(result.forecast[i]), float(result.lower[i]), float(result.upper[i]))
+        for c, i in row_of.items()
+    }
+
+
+def forecast_categories_next_month() -> Dict[str, Tuple[float, float, float]]:
+    """
+    Прогноз на следующий месяц сразу по всем категориям: {категория: (прогноз,
+    нижняя, верхняя граница 95%)}. Все категории считаются одним вызовом
+    forecast_matrix; результат кэшируется по версии данных БД.
+    """
+    try:
+        from database import get_data_version
+        version = get_data_version()
+    except sqlite3.Error:
+        return {}
+    return _cached_category_forecasts(version, date.today().strftime("%Y-%m"))
+
+
 def budget_success_probability(
     total_spent: float,
     total_limit: float,
@@ -91,3 +369,128 @@ def budget_success_probability(
             f"прогноз: {projected_total:,.0f} ₸, превышение ~{over:,.0f} ₸. "
             f"Рекомендуется сократить траты."
         )
+
+
+# ---------------------------------------------------------------------------
+# Монте-Карло: вероятность уложиться в бюджет по реальной дневной истории
+# ---------------------------------------------------------------------------
+# Сколько дней истории брать для бутстрепа и минимум дней, чтобы ему доверять
+MC_HISTORY_DAYS = 90
+MC_MIN_HISTORY_DAYS = 14
+MC_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+@dataclass
+class BudgetSimulation:
+    """Итог симуляции: вероятность (0..100) и процентили суммы на конец месяца."""
+    probability: float
+    percentiles: Dict[int, float]
+    n_simulations: int
+    days_left: int
+    history_days: int
+
+    def explanation(self) -> str:
+        p5, p50, p95 = self.percentiles[5], self.percentiles[50], self.percentiles[95]
+        return (
+            f"{self.n_simulations:,} симуляций оставшихся {self.days_left} дн. "
+            f"по истории за {self.history_days} дн.: на конец месяца скорее всего "
+            f"{p50:,.0f} ₸ (90% интервал {p5:,.0f}–{p95:,.0f} ₸)."
+        )
+
+
+def simulate_budget(
+    total_spent: float,
+    total_limit: float,
+    daily_history: np.ndarray,
+    days_left: int,
+    n_simulations: int = 100_000,
+    seed: Optional[int] = None,
+    chunk_size: int = 25_000,
+) -> BudgetSimulation:
+    """
+    Бутстреп остатка месяца: каждая симуляция — сумма days_left дней, дневные
+    траты которых случайно выбраны (с возвращением) из реальной истории.
+
+    Все симуляции считаются матрицей NumPy (симуляции × дни); chunk_size
+    ограничивает память (25k × 30 дней ≈ 6 МБ на пачку). Вероятность — доля
+    симуляций, где итог месяца не превысил лимит.
+    """
+    history = np.asarray(daily_history, dtype=float)
+    rng = np.random.default_rng(seed)
+    days_left = max(0, int(days_left))
+
+    totals = np.empty(n_simulations)
+    if days_left == 0 or len(history) == 0:
+        totals[:] = total_spent
+    else:
+        for start in range(0, n_simulations, chunk_size):
+            size = min(chunk_size, n_simulations - start)
+            idx = rng.integers(0, len(history), size=(size, days_left))
+            totals[start:start + size] = total_spent + history[idx].sum(axis=1)
+
+    probability = float(np.mean(totals <= total_limit) * 100)
+    values = np.percentile(totals, MC_PERCENTILES)
+    return BudgetSimulation(
+        probability=round(probability, 1),
+        percentiles={p: float(v) for p, v in zip(MC_PERCENTILES, values)},
+        n_simulations=n_simulations,
+        days_left=days_left,
+        history_days=len(history),
+    )
+
+
+@lru_cache(maxsize=8)
+def _cached_daily_history(data_version: int, today: date, history_days: int) -> Tuple[float, ...]:
+    """
+    Дневные суммы за последние history_days полных дней (до вчера включительно).
+    Дни без трат — нули, но только начиная с первого дня, когда траты вообще
+    записывались: иначе пустое «до начала учёта» занизило бы темп.
+    """
+    from database import daily_totals_series
+
+    end = today - timedelta(days=1)
+    start = today - timedelta(days=history_days)
+    rows = daily_totals_series(start, end)
+    if not rows:
+        return ()
+    by_day = dict(rows)
+    first = date.fromisoformat(rows[0][0])
+    days = (end - first).days + 1
+    return tuple(by_day.get((first + timedelta(days=i)).isoformat(), 0.0) for i in range(days))
+
+
+def simulate_budget_from_history(
+    total_spent: float,
+    total_limit: float,
+    today: Optional[date] = None,
+    n_simulations: int = 100_000,
+    seed: Optional[int] = None,
+) -> Optional[BudgetSimulation]:
+    """
+    Монте-Карло по дневной истории из БД. None — если лимит не задан или
+    истории меньше MC_MIN_HISTORY_DAYS дней (тогда используйте
+    budget_success_probability). История кэшируется по версии данных, так что на
+    каждом перезапуске дашборда остаётся только сама симуляция (десятки мс).
+    """
+    if total_limit <= 0:
+        return None
+    today = today or date.today()
+    try:
+        from database import get_data_version
+        version = get_data_version()
+    except sqlite3.Error:
+        return None
+
+    history = _cached_daily_history(version, today, MC_HISTORY_DAYS)
+    if len(history) < MC_MIN_HISTORY_DAYS:
+        return None
+
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    return simulate_budget(
+        total_spent,
+        total_limit,
+        np.array(history),
+        days_left=days_in_month - today.day,
+        n_simulations=n_simulations,
+        seed=seed,
+    )
@@ -0,0 +1,102 @@
+# src/import_profile.py
+"""
+Профиль времени импорта — чтобы следить за холодным стартом дашборда.
+
+Два инструмента:
+- `import_timer(label)` — контекстный менеджер для ленивых импортов в main.py:
+  запоминает, сколько занял первый импорт секции (повторные — из sys.modules,
+  почти бесплатно). Результаты — в `import_timings()`, их показывает debug-панель.
+- CLI поверх `python -X importtime`: запускает импорт модулей в чистом процессе
+  и печатает самые тяжёлые пакеты по суммарному времени.
+
+    python import_profile.py                 # модули, которые тянет main.py
+    python import_profile.py forecast --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+# Модули дашборда, которые стоит профилировать по умолчанию
+DEFAULT_MODULES = [
+    "streamlit",
+    "pandas",
+    "matplotlib.pyplot",
+    "networkx",
+    "knowledge_graph",
+    "ml_classifier",
+    "anomaly_detector",
+    "forecast",
+    "expense_clustering",
+]
+
+_timings: Dict[str, float] = {}
+
+
+@contextmanager
+def import_timer(label: str) -> Iterator[None]:
+    """Замеряет блок импорта; в статистику попадает только первый (холодный) замер."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if label not in _timings:
+            _timings[label] = time.perf_counter() - started
+
+
+def import_timings() -> Dict[str, float]:
+    """{секция: секунды первого импорта} в порядке загрузки."""
+    return dict(_timings)
+
+
+def profile_imports(modules: List[str]) -> List[Tuple[str, int, int]]:
+    """
+    Импортирует модули в отдельном процессе с `-X importtime`.
+
+    Returns:
+        [(пакет, self_мкс, cumulative_мкс), ...] для пакетов верхнего уровня
+        (строки importtime без отступа), по убыванию cumulative.
+    """
+    code = "; ".join(f"import {m}" for m in modules)
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=src_dir,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "import failed")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        # Формат: "import time:   self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if name.startswith("  "):  # вложенный импорт — уже учтён в cumulative родителя
+            continue
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    rows.sort(key=lambda r: r[2], reverse=True)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Профиль времени импорта модулей SpendFlow")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    rows = profile_imports(args.modules)
+    total_ms = sum(r[2] for r in rows) / 1000
+    print(f"Всего на импорт: {total_ms:,.0f} мс")
+    print(f"{'пакет':<40}{'cumulative, мс':>16}{'self, мс':>12}")
+    for name, self_us, cumulative_us in rows[: args.top]:
+        print(f"{name:<40}{cumulative_us / 1000:>16,.1f}{self_us / 1000:>12,.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,554 @@
+# src/importer.py
+"""
+Потоковый импорт банковских выписок (CSV или OFX-подобный текст) в SQLite.
+
+До сих пор данные попадали в базу только кнопкой «Сохранить» — по одной трате.
+Импорт устроен как цепочка генераторов, каждый из которых передаёт дальше
+пачки записей (не больше chunk_size строк), так что файл никогда не читается
+в память целиком:
+
+    чтение → нормализация → категоризация → оценка аномалий → запись
+
+- чтение: csv.DictReader / построчный разбор блоков <STMTTRN>;
+- нормализация: normalize_merchant по описанию;
+- категоризация: категория из файла, если она известна (или сводится к
+  известной через BANK_CATEGORY_ALIASES), иначе точное имя/алиас магазина в графе
+  знаний, затем нечёткий поиск по нему, а остаток пачки — одним вызовом
+  ExpenseCategoryClassifier.predict_batch;
+- оценка: ExpenseAnomalyDetector.score_batch на всю пачку; подозрительные
+  траты получают тег "anomaly" / "warning";
+- запись: add_transactions_bulk — пачки копятся во временной таблице, в
+  transactions весь файл переносится одним INSERT…SELECT; вся цепочка выше
+  работает без блокировки записи, так что дашборд может сохранять траты;
+- после записи: потоковые базовые линии аномалий дочитывают новые строки
+  (sync_streaming_detector), центроиды кластеров дообучаются на диапазоне id
+  импорта (update_clusters_from_database) — дашборд видит выписку сразу.
+
+Для каждой стадии считаются строки и собственное время (без времени стадий
+выше по цепочке) — видно, что тормозит импорт. Запуск из каталога src/:
+
+    python importer.py statement.csv
+    python importer.py statement.ofx --chunk-size 5000 --dry-run
+"""
+import argparse
+import csv
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+DEFAULT_CHUNK_SIZE = 2000
+IMPORT_TAG = "import"
+
+# Названия колонок в выписках разных банков (сравниваются в нижнем регистре)
+DESCRIPTION_COLUMNS = ("description", "описание", "назначение", "payee", "name", "merchant", "memo", "details")
+AMOUNT_COLUMNS = ("amount", "сумма", "sum", "value", "трата")
+DATE_COLUMNS = ("date", "дата", "created_at", "posted", "transaction date", "дата операции")
+CATEGORY_COLUMNS = ("category", "категория")
+
+# Банковские категории → категории бюджета (ключи в casefold). Категория из файла,
+# которой нет ни среди известных, ни здесь, не принимается — трату категоризируют
+# граф знаний и классификатор.
+BANK_CATEGORY_ALIASES = {
+    "рестораны": "Food",
+    "кафе и рестораны": "Food",
+    "restaurants": "Food",
+    "супермаркеты": "Food",
+    "продукты": "Food",
+    "groceries": "Food",
+    "такси": "Transport",
+    "taxi": "Transport",
+    "транспорт": "Transport",
+    "азс": "Transport",
+    "fuel": "Transport",
+    "кофейни": "Coffee",
+    "одежда": "Shopping",
+    "clothing": "Shopping",
+    "покупки": "Shopping",
+    "развлечения": "Entertainment",
+    "кино": "Entertainment",
+    "cinema": "Entertainment",
+    "прочее": "Other",
+}
+
+_DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%d.%m.%Y", "%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S", "%d/%m/%Y")
+_OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+_AMOUNT_JUNK = re.compile(r"[\s ₸$€]|KZT|USD|EUR")
+
+
+@dataclass
+class ImportRecord:
+    """Одна трата из выписки на пути через цепочку."""
+    line: int
+    description: str
+    amount: float
+    created_at: Optional[str]
+    category: Optional[str] = None
+    merchant: str = ""
+    source: str = ""           # откуда категория: file / kg / fuzzy / ml
+    confidence: float = 0.0
+    anomaly: str = ""
+    anomaly_score: float = 0.0
+
+    def to_bulk_row(self) -> Dict[str, Any]:
+        tags = [IMPORT_TAG]
+        if self.anomaly in ("anomaly", "warning"):
+            tags.append(self.anomaly)
+        return {
+            "description": self.description,
+            "amount": self.amount,
+            "category": self.category or "Other",
+            "tags": tags,
+            "created_at": self.created_at,
+        }
+
+
+@dataclass
+class StageCounter:
+    """Счётчик стадии: строки и время внутри next() её генератора (вместе со стадиями выше)."""
+    name: str
+    rows: int = 0
+    chunks: int = 0
+    inclusive_seconds: float = 0.0
+
+
+@dataclass
+class StageStats:
+    name: str
+    rows: int
+    chunks: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float(self.rows)
+
+
+@dataclass
+class ImportReport:
+    """Итог импорта: строки, отказы, источники категорий и скорость по стадиям."""
+    path: str
+    rows_read: int = 0
+    rows_imported: int = 0
+    rejected: int = 0
+    skipped_income: int = 0
+    sources: Dict[str, int] = field(default_factory=dict)
+    anomalies: Dict[str, int] = field(default_factory=dict)
+    stages: List[StageStats] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    def __str__(self):
+        lines = [
+            f"{self.path}: импортировано {self.rows_imported} из {self.rows_read} строк "
+            f"за {self.seconds:.2f} с (отклонено: {self.rejected}, поступлений пропущено: {self.skipped_income})",
+            "Категории: " + ", ".join(f"{k}={v}" for k, v in sorted(self.sources.items())),
+            "Аномалии: " + ", ".join(f"{k}={v}" for k, v in sorted(self.anomalies.items())),
+        ]
+        for s in self.stages:
+            lines.append(
+                f"  {s.name:<12} {s.rows:>9} строк {s.seconds:>8.3f} с  {s.rows_per_sec:>12,.0f} строк/с"
+            )
+        for error in self.errors[:10]:
+            lines.append(f"  ! {error}")
+        if len(self.errors) > 10:
+            lines.append(f"  ! ... и ещё {len(self.errors) - 10}")
+        return "\n".join(lines)
+
+
+Chunks = Iterator[List[ImportRecord]]
+
+
+# ---------------------------------------------------------------------------
+# Разбор значений
+# ---------------------------------------------------------------------------
+
+def parse_amount(value: Any) -> float:
+    """'-1 234,50 ₸' → -1234.5; ValueError, если это не число."""
+    text = _AMOUNT_JUNK.sub("", str(value)).replace("−", "-")
+    if "," in text and "." in text:
+        text = text.replace(",", "")        # 1,234.50
+    else:
+        text = text.replace(",", ".")       # 1234,50
+    return float(text)
+
+
+def parse_date(value: Any) -> Optional[str]:
+    """Дата выписки → ISO-строка; пустое значение → None (время импорта). ValueError — формат не распознан."""
+    return _parse_date_text(str(value or "").strip())
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_text(text: str) -> Optional[str]:
+    # В выписке сотни строк на один день — strptime по списку форматов не повторяем
+    if not text:
+        return None
+    try:
+        return datetime.fromisoformat(text).isoformat()
+    except ValueError:
+        pass
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).isoformat()
+        except ValueError:
+            continue
+    # OFX: 20240105 или 20240105120000[.000][-5:EST]
+    digits = re.match(r"(\d{8})(\d{6})?", text)
+    if digits:
+        return datetime.strptime(digits.group(1) + (digits.group(2) or "000000"), "%Y%m%d%H%M%S").isoformat()
+    raise ValueError(f"не удалось разобрать дату {text!r}")
+
+
+def _expense_amount(amount: float, positive_expenses: bool) -> Optional[float]:
+    """
+    Сумма траты для колонки amount (>= 0) или None, если строка — поступление.
+    По умолчанию банковская конвенция: списания отрицательные.
+    """
+    if positive_expenses:
+        return amount if amount > 0 else None
+    return -amount if amount < 0 else None
+
+
+# ---------------------------------------------------------------------------
+# Стадия 1: чтение
+# ---------------------------------------------------------------------------
+
+def detect_format(path: str) -> str:
+    """Формат по началу файла: "ofx" (заголовок OFX или теги <STMTTRN>) или "csv"."""
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        head = f.read(4096).upper()
+    return "ofx" if "<OFX>" in head or "OFXHEADER" in head or "<STMTTRN>" in head else "csv"
+
+
+def _pick_column(fieldnames: List[str], candidates: Iterable[str]) -> Optional[str]:
+    by_lower = {name.strip().lower(): name for name in fieldnames if name}
+    for candidate in candidates:
+        if candidate in by_lower:
+            return by_lower[candidate]
+    return None
+
+
+def _iter_csv_rows(f: TextIO, delimiter: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Строки CSV как словари (line, description, amount, date, category)."""
+    if delimiter is None:
+        sample = f.read(8192)
+        f.seek(0)
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+        except csv.Error:
+            delimiter = ","
+    reader = csv.DictReader(f, delimiter=delimiter)
+    fieldnames = reader.fieldnames or []
+    description_col = _pick_column(fieldnames, DESCRIPTION_COLUMNS)
+    amount_col = _pick_column(fieldnames, AMOUNT_COLUMNS)
+    if description_col is None or amount_col is None:
+        raise ValueError(f"в заголовке CSV нет колонок описания и суммы: {fieldnames}")
+    date_col = _pick_column(fieldnames, DATE_COLUMNS)
+    category_col = _pick_column(fieldnames, CATEGORY_COLUMNS)
+
+    for row in reader:
+        yield {
+            "line": reader.line_num,
+            "description": row.get(description_col),
+            "amount": row.get(amount_col),
+            "date": row.get(date_col) if date_col else None,
+            "category": row.get(category_col) if category_col else None,
+        }
+
+
+def _iter_ofx_rows(f: TextIO) -> Iterator[Dict[str, Any]]:
+    """
+    Транзакции <STMTTRN> из OFX (SGML или XML): закрывающие теги у полей
+    необязательны, поэтому разбор — по тегам в строке, без XML-парсера.
+    """
+    current: Optional[Dict[str, Any]] = None
+    for line_no, line in enumerate(f, start=1):
+        for closing, tag, value in _OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if closing and current is not None:
+                    yield {
+                        "line": current["line"],
+                        "description": current.get("NAME") or current.get("MEMO"),
+                        "amount": current.get("TRNAMT"),
+                        "date": current.get("DTPOSTED"),
+                        "category": None,
+                    }
+                    current = None
+                elif not closing:
+                    current = {"line": line_no}
+            elif current is not None and not closing and value.strip():
+                current[tag] = value.strip()
+
+
+def read_statement(
+    path: str,
+    report: ImportReport,
+    fmt: str = "auto",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    delimiter: Optional[str] = None,
+    positive_expenses: bool = False,
+) -> Chunks:
+    """
+    Пачки ImportRecord из файла выписки. Строки с неразборчивой суммой/датой
+    считаются в report.rejected (с номером строки в report.errors),
+    поступления — в report.skipped_income.
+    """
+    if fmt == "auto":
+        fmt = detect_format(path)
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        rows = _iter_ofx_rows(f) if fmt == "ofx" else _iter_csv_rows(f, delimiter)
+        chunk: List[ImportRecord] = []
+        for raw in rows:
+            report.rows_read += 1
+            description = str(raw["description"] or "").strip()
+            try:
+                if not description:
+                    raise ValueError("пустое описание")
+                amount = _expense_amount(parse_amount(raw["amount"]), positive_expenses)
+                created_at = parse_date(raw["date"])
+            except (TypeError, ValueError) as exc:
+                report.rejected += 1
+                report.errors.append(f"{path}:{raw['line']}: {exc}")
+                continue
+            if amount is None:
+                report.skipped_income += 1
+                continue
+            category = str(raw["category"] or "").strip() or None
+            chunk.append(ImportRecord(raw["line"], description, amount, created_at, category))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+# ---------------------------------------------------------------------------
+# Стадии 2–4: нормализация, категоризация, оценка аномалий
+# ---------------------------------------------------------------------------
+
+def normalize_stage(chunks: Chunks) -> Chunks:
+    from merchant_matcher import normalize_merchant
+
+    for chunk in chunks:
+        for record in chunk:
+            record.merchant = normalize_merchant(record.description)
+        yield chunk
+
+
+def known_categories(graph, classifier) -> Dict[str, str]:
+    """
+    Категории, которые понимает приложение (casefold → каноническое имя):
+    категории графа знаний, классы классификатора и лимиты из rules.json.
+    """
+    from knowledge_graph import get_index
+
+    names = list(get_index(graph).category_stores) + list(classifier.classes_)
+    try:
+        from logic import load_rules
+
+        names += list(load_rules()["thresholds"]["max_category_budget"])
+    except (OSError, ValueError, KeyError):
+        pass  # без rules.json хватает графа и классификатора
+    return {str(name).casefold(): str(name) for name in names}
+
+
+def map_category(raw: str, known: Dict[str, str]) -> Optional[str]:
+    """Категория из выписки → известная категория или None, если сопоставить не с чем."""
+    key = raw.strip().casefold()
+    if key in known:
+        return known[key]
+    alias = BANK_CATEGORY_ALIASES.get(key)
+    return known.get(alias.casefold()) if alias else None
+
+
+def categorize_stage(chunks: Chunks, graph, classifier, report: ImportReport) -> Chunks:
+    """
+    Категория из файла принимается, если она сводится к известной (map_category).
+    Остальные: точное имя/алиас магазина в графе знаний, затем нечёткий поиск;
+    кто не нашёлся — predict_batch одной пачкой. Магазины в выписке повторяются,
+    поэтому ответ графа запоминается по нормализованному имени на весь импорт.
+    """
+    from knowledge_graph import find_merchants, get_index
+
+    index = get_index(graph)
+    known = known_categories(graph, classifier)
+    kg_answers: Dict[str, Any] = {}
+
+    def from_graph(record: ImportRecord):
+        key = record.merchant
+        if key not in kg_answers:
+            node = index.lookup(record.description) or index.lookup(key)
+            if node in index.store_category:
+                kg_answers[key] = (index.store_category[node], "kg", 1.0)
+            else:
+                found = find_merchants(graph, key, k=1) if key else []
+                category = index.category_for_store(found[0][0]) if found else None
+                kg_answers[key] = (category, "fuzzy", found[0][1]) if category else None
+        return kg_answers[key]
+
+    for chunk in chunks:
+        unresolved: List[ImportRecord] = []
+        for record in chunk:
+            if record.category:
+                record.category = map_category(record.category, known)
+                if record.category:
+                    record.source, record.confidence = "file", 1.0
+                    continue
+            answer = from_graph(record)
+            if answer is None:
+                unresolved.append(record)
+            else:
+                record.category, record.source, record.confidence = answer
+        if unresolved:
+            predictions = classifier.predict_batch([r.description for r in unresolved])
+            for record, (category, prob) in zip(unresolved, predictions):
+                record.category, record.source, record.confidence = category, "ml", float(prob)
+        for record in chunk:
+            report.sources[record.source] = report.sources.get(record.source, 0) + 1
+        yield chunk
+
+
+def score_stage(chunks: Chunks, detector, report: ImportReport) -> Chunks:
+    for chunk in chunks:
+        labels, scores = detector.score_batch([r.amount for r in chunk], [r.category for r in chunk])
+        for record, label, score in zip(chunk, labels, scores):
+            record.anomaly, record.anomaly_score = str(label), float(score)
+            report.anomalies[record.anomaly] = report.anomalies.get(record.anomaly, 0) + 1
+        yield chunk
+
+
+def _metered(counter: StageCounter, chunks: Chunks) -> Chunks:
+    """Пропускает пачки дальше, считая строки и время ожидания каждой пачки."""
+    it = iter(chunks)
+    while True:
+        started = time.perf_counter()
+        try:
+            chunk = next(it)
+        except StopIteration:
+            counter.inclusive_seconds += time.perf_counter() - started
+            return
+        counter.inclusive_seconds += time.perf_counter() - started
+        counter.rows += len(chunk)
+        counter.chunks += 1
+        yield chunk
+
+
+# ---------------------------------------------------------------------------
+# Сборка цепочки и запись
+# ---------------------------------------------------------------------------
+
+def import_statement(
+    path: str,
+    fmt: str = "auto",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    delimiter: Optional[str] = None,
+    positive_expenses: bool = False,
+    dry_run: bool = False,
+    graph=None,
+    classifier=None,
+    detector=None,
+) -> ImportReport:
+    """
+    Импортирует выписку и возвращает отчёт.
+
+    graph / classifier / detector по умолчанию берутся те же, что у дашборда
+    (load_graph, get_default_classifier, get_expense_anomaly_detector); их
+    загрузка в скорость стадий не входит. dry_run — пройти всю цепочку без
+    записи в БД. Ошибка записи откатывает весь файл (см. add_transactions_bulk).
+    После успешной записи обновляются потоковые базовые линии аномалий и
+    кластеры (стадия "models" в отчёте).
+    """
+    if graph is None:
+        from knowledge_graph import load_graph
+        graph = load_graph()
+    if classifier is None:
+        from ml_classifier import get_default_classifier
+        classifier = get_default_classifier()
+    if detector is None:
+        from anomaly_detector import get_expense_anomaly_detector
+        detector = get_expense_anomaly_detector()
+
+    report = ImportReport(path=path)
+    counters = [StageCounter(name) for name in ("read", "normalize", "categorize", "score")]
+    read, normalize, categorize, score = counters
+    chunks = _metered(read, read_statement(path, report, fmt, chunk_size, delimiter, positive_expenses))
+    chunks = _metered(normalize, normalize_stage(chunks))
+    chunks = _metered(categorize, categorize_stage(chunks, graph, classifier, report))
+    chunks = _metered(score, score_stage(chunks, detector, report))
+
+    rows = (record.to_bulk_row() for chunk in chunks for record in chunk)
+    started = time.perf_counter()
+    bulk = None
+    if dry_run:
+        report.rows_imported = sum(1 for _ in rows)
+    else:
+        from database import add_transactions_bulk
+        bulk = add_transactions_bulk(rows, chunk_size=chunk_size)
+        report.rows_imported = bulk.rows
+    pipeline_seconds = time.perf_counter() - started
+    if bulk is not None and bulk.rows:
+        _update_models(bulk.first_id, bulk.last_id, chunk_size)
+    report.seconds = time.perf_counter() - started
+
+    # Время стадии без стадий выше: next() каждой обёртки включает всю цепочку до неё
+    upstream = 0.0
+    for counter in counters:
+        report.stages.append(
+            StageStats(counter.name, counter.rows, counter.chunks, max(counter.inclusive_seconds - upstream, 0.0))
+        )
+        upstream = counter.inclusive_seconds
+    report.stages.append(
+        StageStats(
+            "dry-run" if dry_run else "write",
+            report.rows_imported,
+            score.chunks,
+            max(pipeline_seconds - upstream, 0.0),
+        )
+    )
+    if bulk is not None and bulk.rows:
+        report.stages.append(StageStats("models", bulk.rows, 1, report.seconds - pipeline_seconds))
+    return report
+
+
+def _update_models(first_id: int, last_id: int, chunk_size: int) -> None:
+    """
+    Доводит модели дашборда до импортированных строк: потоковый детектор
+    дочитывает новые id из БД (sync, без двойного учёта), кластеры дообучаются
+    на диапазоне id импорта. Оба сохраняются на диск.
+    """
+    from anomaly_detector import get_streaming_anomaly_detector, sync_streaming_detector
+    from expense_clustering import update_clusters_from_database
+
+    sync_streaming_detector(get_streaming_anomaly_detector())
+    update_clusters_from_database(first_id, last_id, chunk_size=chunk_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Импорт банковской выписки (CSV/OFX) в базу SpendFlow")
+    parser.add_argument("paths", nargs="+", help="файлы выписок")
+    parser.add_argument("--format", choices=("auto", "csv", "ofx"), default="auto")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--delimiter", default=None, help="разделитель CSV (по умолчанию определяется)")
+    parser.add_argument(
+        "--positive-expenses",
+        action="store_true",
+        help="траты в выписке положительные (по умолчанию траты — отрицательные суммы)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="разобрать и оценить без записи в БД")
+    args = parser.parse_args()
+
+    from database import init_db
+
+    init_db()
+    for statement_path in args.paths:
+        print(import_statement(
+            statement_path,
+            fmt=args.format,
+            chunk_size=args.chunk_size,
+            delimiter=args.delimiter,
+            positive_expenses=args.positive_expenses,
+            dry_run=args.dry_run,
+        ))
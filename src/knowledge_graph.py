@@ -1,6 +1,373 @@
 # src/knowledge_graph.py
+"""
+Граф знаний: магазины (type="store") связаны с категориями (type="category").
+
+Для быстрых запросов к графу строится KnowledgeGraphIndex — словари
+магазин → категория, категория → магазины и имя (casefold) → узел. Индекс
+хранится в атрибутах самого графа (graph.graph) и создаётся один раз; граф
+изменяйте через add_store / add_category / remove_node — они обновляют индекс
+на месте. Если граф изменили напрямую через NetworkX, вызовите rebuild_index().
+
+Источник данных — data/raw/merchants.jsonl (load_graph), по одной записи в строке:
+
+    {"category": "Coffee", "parent": "Food"}
+    {"store": "Uber", "category": "Transport", "aliases": ["Uber Trip", "UBER BV"]}
+
+Файл читается потоково; собранный граф (вместе с индексом) кэшируется pickle-файлом
+в models/ и при неизменном источнике (mtime и размер) просто загружается.
+Если файла нет — используется встроенный набор create_graph().
+
+Нечёткий поиск магазинов по строкам выписок ("UBER *TRIP 1234" → Uber) —
+find_merchants / guess_category: триграммный индекс (merchant_matcher) по именам
+и алиасам магазинов строится лениво и хранится в индексе графа (и в его кэше).
+
+Для обозревателя графа: многошаговая иерархия find_ancestors / find_descendants
+(Starbucks → Coffee → Food) по предвычисленному ReachabilityIndex и раскладка
+get_layout, кэшируемая по structure_hash графа.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
 import networkx as nx
-from typing import List
+
+_INDEX_KEY = "kg_index"
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MERCHANTS_PATH = os.path.join(BASE_DIR, "data", "raw", "merchants.jsonl")
+
+# Поднимается при изменении формата графа/индекса — старые кэши перестают подходить
+GRAPH_CACHE_VERSION = 2
+_GRAPH_CACHE_NAME = "knowledge_graph"
+
+
+class KnowledgeGraphIndex:
+    """
+    Индекс графа знаний: все запросы — O(1) по словарям (плюс длина ответа),
+    вместо обхода соседей с проверкой атрибута type на каждый вызов.
+    """
+
+    def __init__(self) -> None:
+        self.store_category: Dict[Any, Any] = {}
+        # dict вместо set: сохраняет порядок соседей и удаляет за O(1)
+        self.category_stores: Dict[Any, Dict[Any, None]] = {}
+        # Имена узлов и алиасы магазинов (casefold) → узел
+        self.name_to_node: Dict[str, Any] = {}
+        self.node_count = 0
+        # id графа-владельца: graph.copy() копирует graph.graph вместе со ссылкой на индекс
+        self.owner = 0
+        # Счётчик изменений; производные структуры (триграммный индекс, хэш,
+        # достижимость, раскладка) пересчитываются, если они от другой версии
+        self.version = 0
+        self._derived: Dict[Any, Tuple[int, Any]] = {}
+
+    @classmethod
+    def build(cls, graph) -> "KnowledgeGraphIndex":
+        """Один проход по узлам и их соседям."""
+        index = cls()
+        nodes = graph.nodes
+        for node, attrs in nodes(data=True):
+            index.name_to_node[str(node).casefold()] = node
+            node_type = attrs.get("type")
+            if node_type == "category":
+                index.category_stores.setdefault(node, {})
+            elif node_type == "store":
+                for alias in attrs.get("aliases", ()):
+                    index.name_to_node.setdefault(str(alias).casefold(), node)
+                for neighbor in graph.neighbors(node):
+                    if nodes[neighbor].get("type") == "category":
+                        index.store_category.setdefault(node, neighbor)
+                        index.category_stores.setdefault(neighbor, {})[node] = None
+        index.node_count = len(graph)
+        index.owner = id(graph)
+        return index
+
+    def lookup(self, name: str) -> Optional[Any]:
+        """Узел по имени без учёта регистра; None — если такого нет."""
+        return self.name_to_node.get(str(name).strip().casefold())
+
+    def derived(self, key: Any, build: Callable[[], Any]) -> Any:
+        """Значение, посчитанное build() для текущей версии графа (кэш по key)."""
+        cached = self._derived.get(key)
+        if cached is None or cached[0] != self.version:
+            cached = (self.version, build())
+            self._derived[key] = cached
+        return cached[1]
+
+    def category_for_store(self, store: Any) -> str:
+        return self.store_category.get(store, "Other")
+
+    def stores_in_category(self, category: Any) -> List[Any]:
+        return list(self.category_stores.get(category, ()))
+
+    # --- изменения графа вместе с индексом ---
+
+    def add_category(self, graph, category: Any, parent: Optional[Any] = None) -> None:
+        if parent is not None:
+            graph.add_node(category, type="category", parent=parent)
+            if parent not in graph:
+                self.add_category(graph, parent)
+            graph.add_edge(category, parent)
+        else:
+            graph.add_node(category, type="category")
+        self.name_to_node[str(category).casefold()] = category
+        self.category_stores.setdefault(category, {})
+        self.node_count = len(graph)
+        self.version += 1
+
+    def add_store(self, graph, store: Any, category: Any, aliases: Optional[List[str]] = None) -> None:
+        if category not in graph:
+            self.add_category(graph, category)
+        if aliases:
+            known = graph.nodes[store].get("aliases", []) if store in graph else []
+            graph.add_node(store, type="store", aliases=known + [a for a in aliases if a not in known])
+            for alias in aliases:
+                self.name_to_node.setdefault(str(alias).casefold(), store)
+        else:
+            graph.add_node(store, type="store")
+        graph.add_edge(store, category)
+        self.name_to_node[str(store).casefold()] = store
+        self.store_category.setdefault(store, category)
+        self.category_stores.setdefault(category, {})[store] = None
+        self.node_count = len(graph)
+        self.version += 1
+
+    def remove_node(self, graph, node: Any) -> None:
+        if node not in graph:
+            return
+        neighbors = list(graph.neighbors(node))
+        node_type = graph.nodes[node].get("type")
+        aliases = graph.nodes[node].get("aliases", ())
+        graph.remove_node(node)
+
+        for name in [node, *aliases]:
+            key = str(name).casefold()
+            if self.name_to_node.get(key) == node:
+                del self.name_to_node[key]
+        if node_type == "store":
+            self.store_category.pop(node, None)
+            for neighbor in neighbors:
+                self.category_stores.get(neighbor, {}).pop(node, None)
+        elif node_type == "category":
+            self.category_stores.pop(node, None)
+            # Магазины этой категории переходят к следующей категории-соседу, если она есть
+            for store in neighbors:
+                if self.store_category.get(store) == node:
+                    del self.store_category[store]
+                    for other in graph.neighbors(store):
+                        if graph.nodes[other].get("type") == "category":
+                            self.store_category[store] = other
+                            break
+        self.node_count = len(graph)
+        self.version += 1
+
+
+def rebuild_index(graph) -> KnowledgeGraphIndex:
+    """Строит индекс заново и сохраняет его в атрибутах графа."""
+    index = KnowledgeGraphIndex.build(graph)
+    graph.graph[_INDEX_KEY] = index
+    return index
+
+
+def get_index(graph) -> KnowledgeGraphIndex:
+    """
+    Индекс графа; строится при первом обращении. Если число узлов разошлось
+    с индексом (граф меняли в обход add_store/remove_node) или граф — копия
+    другого графа, индекс перестраивается.
+    """
+    index = graph.graph.get(_INDEX_KEY)
+    if index is None or index.owner != id(graph) or index.node_count != len(graph):
+        index = rebuild_index(graph)
+    return index
+
+
+def get_matcher(graph):
+    """
+    Триграммный индекс (merchant_matcher.TrigramIndex) по именам и алиасам
+    магазинов. Строится при первом нечётком запросе и после изменений графа.
+    """
+    from merchant_matcher import TrigramIndex
+
+    def entries():
+        for node, attrs in graph.nodes(data=True):
+            if attrs.get("type") == "store":
+                yield str(node), node
+                for alias in attrs.get("aliases", ()):
+                    yield str(alias), node
+
+    return get_index(graph).derived("matcher", lambda: TrigramIndex.build(entries()))
+
+
+def find_merchants(graph, text: str, k: int = 5, min_score: Optional[float] = None) -> List[Tuple[Any, float]]:
+    """
+    Нечёткий поиск магазинов по строке (название, строка выписки, часть имени).
+
+    Returns:
+        До k пар (магазин, оценка 0..1) по убыванию оценки.
+    """
+    from merchant_matcher import DEFAULT_MIN_SCORE
+
+    threshold = DEFAULT_MIN_SCORE if min_score is None else min_score
+    return get_matcher(graph).search(text, k=k, min_score=threshold)
+
+
+def guess_category(graph, text: str, min_score: Optional[float] = None) -> str:
+    """
+    Категория по произвольной строке: сначала точное имя/алиас магазина,
+    затем лучший нечёткий кандидат. "Other" — если ничего не подошло.
+    """
+    index = get_index(graph)
+    node = index.lookup(text)
+    if node in index.store_category:
+        return index.store_category[node]
+    found = find_merchants(graph, text, k=1, min_score=min_score)
+    return index.category_for_store(found[0][0]) if found else "Other"
+
+
+def structure_hash(graph) -> str:
+    """
+    Хэш структуры графа: узлы с типами и связи (без учёта порядка добавления).
+    Считается один раз на версию графа — ключ для кэшей раскладки и т.п.
+    """
+    def compute() -> str:
+        h = hashlib.sha256()
+        for line in sorted(f"{node!r}|{attrs.get('type')}" for node, attrs in graph.nodes(data=True)):
+            h.update(line.encode())
+            h.update(b"\n")
+        for line in sorted("|".join(sorted((repr(u), repr(v)))) for u, v in graph.edges()):
+            h.update(line.encode())
+            h.update(b"\n")
+        return h.hexdigest()[:16]
+
+    return get_index(graph).derived("structure_hash", compute)
+
+
+class ReachabilityIndex:
+    """
+    Многошаговая достижимость «вверх» по иерархии: магазин → категория →
+    родительская категория → ... (Starbucks → Coffee → Food), и обратно —
+    все магазины и подкатегории под категорией на любой глубине.
+
+    Хранится компактно, как CSR: узлы пронумерованы, предки узла i —
+    up_ids[up_ptr[i]:up_ptr[i + 1]] (от ближайшего), потомки —
+    down_ids[down_ptr[i]:down_ptr[i + 1]]. Запрос — срез массива, без BFS.
+    """
+
+    def __init__(self, graph, index: KnowledgeGraphIndex) -> None:
+        self.nodes: List[Any] = list(graph.nodes)
+        self.node_ids: Dict[Any, int] = {node: i for i, node in enumerate(self.nodes)}
+
+        chains: Dict[Any, List[Any]] = {}
+
+        def category_chain(category: Any) -> List[Any]:
+            """Родители категории по атрибуту parent; циклы обрываются."""
+            if category in chains:
+                return chains[category]
+            chain: List[Any] = []
+            seen = {category}
+            parent = graph.nodes[category].get("parent") if category in graph else None
+            while parent is not None and parent in graph and parent not in seen:
+                chain.append(parent)
+                seen.add(parent)
+                parent = graph.nodes[parent].get("parent")
+            chains[category] = chain
+            return chain
+
+        counts = np.zeros(len(self.nodes), dtype=np.int64)
+        up: List[int] = []
+        for i, (node, attrs) in enumerate(graph.nodes(data=True)):
+            node_type = attrs.get("type")
+            if node_type == "store":
+                category = index.store_category.get(node)
+                ancestors = [category, *category_chain(category)] if category is not None else []
+            elif node_type == "category":
+                ancestors = category_chain(node)
+            else:
+                ancestors = []
+            counts[i] = len(ancestors)
+            up.extend(self.node_ids[a] for a in ancestors)
+
+        self.up_ptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.up_ptr[1:])
+        self.up_ids = np.asarray(up, dtype=np.int32)
+
+        # Обратное отношение: пары (предок, узел), отсортированные по предку
+        owners = np.repeat(np.arange(len(self.nodes), dtype=np.int32), counts)
+        order = np.argsort(self.up_ids, kind="stable")
+        self.down_ids = owners[order]
+        self.down_ptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.up_ids, minlength=len(self.nodes)), out=self.down_ptr[1:])
+
+    def _slice(self, node: Any, ptr: np.ndarray, ids: np.ndarray) -> List[Any]:
+        i = self.node_ids.get(node)
+        if i is None:
+            return []
+        return [self.nodes[j] for j in ids[ptr[i]:ptr[i + 1]]]
+
+    def ancestors(self, node: Any) -> List[Any]:
+        return self._slice(node, self.up_ptr, self.up_ids)
+
+    def descendants(self, node: Any) -> List[Any]:
+        return self._slice(node, self.down_ptr, self.down_ids)
+
+
+def get_reachability(graph) -> ReachabilityIndex:
+    """Индекс достижимости; строится один раз на версию графа."""
+    index = get_index(graph)
+    return index.derived("reachability", lambda: ReachabilityIndex(graph, index))
+
+
+def find_ancestors(graph, node: Any) -> List[Any]:
+    """Цепочка вверх по иерархии: категория магазина и её родители."""
+    return get_reachability(graph).ancestors(node)
+
+
+def find_descendants(graph, node: Any) -> List[Any]:
+    """Все магазины и подкатегории под категорией (на любой глубине)."""
+    return get_reachability(graph).descendants(node)
+
+
+def get_layout(graph, k: float = 1.5, iterations: int = 50, seed: int = 42) -> Dict[Any, Tuple[float, float]]:
+    """
+    Раскладка spring_layout для визуализации, посчитанная один раз на структуру графа.
+
+    Внутри процесса кэшируется в индексе графа, между процессами — в models/
+    (model_store) под ключом structure_hash + параметры. seed фиксирован, чтобы
+    раскладка не «прыгала» между перезапусками.
+    """
+    from model_store import load_or_train
+
+    def compute() -> Dict[Any, Tuple[float, float]]:
+        fp = hashlib.sha256(f"{structure_hash(graph)}|{k}|{iterations}|{seed}".encode()).hexdigest()[:16]
+        return load_or_train(
+            "kg_layout",
+            fp,
+            lambda: {
+                node: (float(x), float(y))
+                for node, (x, y) in nx.spring_layout(graph, k=k, iterations=iterations, seed=seed).items()
+            },
+            dict,
+        )
+
+    return get_index(graph).derived(("layout", k, iterations, seed), compute)
+
+
+def add_category(graph, category: Any, parent: Optional[Any] = None) -> None:
+    """Добавляет категорию (и связь с родительской категорией) вместе с индексом."""
+    get_index(graph).add_category(graph, category, parent)
+
+
+def add_store(graph, store: Any, category: Any, aliases: Optional[List[str]] = None) -> None:
+    """Добавляет магазин (с алиасами названия) в категорию вместе с индексом."""
+    get_index(graph).add_store(graph, store, category, aliases)
+
+
+def remove_node(graph, node: Any) -> None:
+    """Удаляет узел из графа и из индекса."""
+    get_index(graph).remove_node(graph, node)
 
 
 def create_graph():
@@ -20,6 +387,7 @@ def create_graph():
     # Объекты типа "Б" - Категории расходов
     categories = ["Transport", "Food", "Shopping", "Entertainment", "Coffee"]
     G.add_nodes_from(categories, type="category")
+    G.nodes["Coffee"]["parent"] = "Food"
 
     # --- 2. ДОБАВЛЕНИЕ СВЯЗЕЙ (EDGES) ---
     # Соединяем Магазины с Категориями
@@ -36,6 +404,96 @@ def create_graph():
     ]
     G.add_edges_from(relationships)
 
+    rebuild_index(G)
+    return G
+
+
+def iter_merchant_records(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Потоково читает записи JSONL (пустые строки и строки с # пропускаются).
+
+    Raises:
+        ValueError: строка не JSON-объект или в ней нет store/category.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{lineno}: некорректный JSON ({e.msg})") from None
+            if not isinstance(record, dict) or "category" not in record:
+                raise ValueError(f"{path}:{lineno}: ожидается объект с полем category")
+            yield record
+
+
+def build_graph_from_file(path: str) -> nx.Graph:
+    """
+    Собирает граф из файла merchants.jsonl одним проходом: узлы и связи
+    добавляются напрямую в NetworkX, индекс строится один раз в конце.
+    """
+    G = nx.Graph()
+    for record in iter_merchant_records(path):
+        category = record["category"]
+        if category not in G:
+            G.add_node(category, type="category")
+        store = record.get("store")
+        if store is None:
+            parent = record.get("parent")
+            if parent:
+                G.nodes[category]["parent"] = parent
+                if parent not in G:
+                    G.add_node(parent, type="category")
+                G.add_edge(category, parent)
+            continue
+        G.add_node(store, type="store")
+        aliases = record.get("aliases")
+        if aliases:
+            G.nodes[store].setdefault("aliases", []).extend(aliases)
+        G.add_edge(store, category)
+    rebuild_index(G)
+    return G
+
+
+def _graph_cache_key(path: str) -> str:
+    st = os.stat(path)
+    key = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{GRAPH_CACHE_VERSION}|nx={nx.__version__}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def load_graph(path: Optional[str] = None) -> nx.Graph:
+    """
+    Граф знаний из файла (см. MERCHANTS_PATH) с кэшем собранного графа в models/.
+
+    Источник не менялся — граф с индексом загружается из pickle без пересборки;
+    менялся — собирается заново и кэш перезаписывается. Файла нет — встроенный
+    набор create_graph().
+    """
+    from model_store import load_artifact, save_artifact
+
+    path = path or MERCHANTS_PATH
+    if not os.path.exists(path):
+        return create_graph()
+
+    fp = _graph_cache_key(path)
+    G = load_artifact(_GRAPH_CACHE_NAME, fp, nx.Graph)
+    if G is not None:
+        index = G.graph.get(_INDEX_KEY)
+        if index is not None:
+            index.owner = id(G)  # индекс сохранён вместе с этим графом — он актуален
+        return G
+
+    G = build_graph_from_file(path)
+    # В кэш попадают и готовые производные структуры
+    get_matcher(G)
+    get_reachability(G)
+    structure_hash(G)
+    try:
+        save_artifact(_GRAPH_CACHE_NAME, fp, G)
+    except OSError:
+        pass
     return G
 
 
@@ -69,20 +527,7 @@ def get_category_for_store(graph, store_name: str) -> str:
     Returns:
         Название категории или "Other" если не найдено
     """
-    if store_name not in graph:
-        return "Other"
-    
-    # Проверяем, что это магазин
-    if graph.nodes[store_name].get("type") != "store":
-        return "Other"
-    
-    # Находим связанную категорию
-    related = find_related_entities(graph, store_name)
-    for node in related:
-        if graph.nodes[node].get("type") == "category":
-            return node
-    
-    return "Other"
+    return get_index(graph).category_for_store(store_name)
 
 
 def get_stores_in_category(graph, category_name: str) -> List[str]:
@@ -96,13 +541,4 @@ def get_stores_in_category(graph, category_name: str) -> List[str]:
     Returns:
         Список названий магазинов
     """
-    if category_name not in graph:
-        return []
-    
-    stores = []
-    related = find_related_entities(graph, category_name)
-    for node in related:
-        if graph.nodes[node].get("type") == "store":
-            stores.append(node)
-    
-    return stores
+    return get_index(graph).stores_in_category(category_name)
@@ -1,19 +1,83 @@
 import json
 import os
-from typing import Any, Dict, List, Optional
+import threading
+from dataclasses import dataclass
+from itertools import chain
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple, Union
 
 # Автоматическое определение пути к файлу
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 RULES_PATH = os.path.join(BASE_DIR, 'data', 'raw', 'rules.json')
 
 
+@dataclass(frozen=True)
+class CompiledRules:
+    """
+    Правила из rules.json в виде, удобном для частых проверок.
+    Списки тегов — frozenset (проверка тега за O(1)), лимиты — готовые числа.
+    """
+    block_if_budget_exceeded: bool
+    must_not_exceed_total_budget: bool
+    must_not_exceed_category_budget: bool
+    min_amount: float
+    max_total_budget: float
+    category_limits: Dict[str, float]
+    blacklist: FrozenSet[str]
+    whitelist: FrozenSet[str]
+
+
+def _compile_rules(rules: Dict[str, Any]) -> CompiledRules:
+    critical = rules['critical_rules']
+    thresholds = rules['thresholds']
+    return CompiledRules(
+        block_if_budget_exceeded=bool(critical['block_if_budget_exceeded']),
+        must_not_exceed_total_budget=bool(critical['must_not_exceed_total_budget']),
+        must_not_exceed_category_budget=bool(critical['must_not_exceed_category_budget']),
+        min_amount=thresholds['min_amount'],
+        max_total_budget=thresholds['max_total_budget'],
+        category_limits=dict(thresholds['max_category_budget']),
+        blacklist=frozenset(rules['lists']['blacklist']),
+        whitelist=frozenset(rules['lists']['whitelist']),
+    )
+
+
+# Кэш правил: (mtime_ns, size) файла → разобранный JSON и скомпилированные правила.
+# Файл перечитывается, только если изменились время модификации или размер.
+_rules_lock = threading.Lock()
+_rules_cache: Optional[Tuple[Tuple[str, int, int], Dict[str, Any], CompiledRules]] = None
+
+
+def _cached_rules() -> Tuple[Dict[str, Any], CompiledRules]:
+    global _rules_cache
+
+    st = os.stat(RULES_PATH)  # единственный системный вызов на «тёплом» пути
+    key = (RULES_PATH, st.st_mtime_ns, st.st_size)
+    cache = _rules_cache
+    if cache is not None and cache[0] == key:
+        return cache[1], cache[2]
+
+    with _rules_lock:
+        if _rules_cache is None or _rules_cache[0] != key:
+            with open(RULES_PATH, 'r', encoding='utf-8') as f:
+                rules = json.load(f)
+            _rules_cache = (key, rules, _compile_rules(rules))
+        return _rules_cache[1], _rules_cache[2]
+
+
 def load_rules():
-    """Загружает правила из JSON файла."""
-    with open(RULES_PATH, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """
+    Загружает правила из JSON файла.
+    Результат кэшируется до изменения файла — не изменяйте возвращаемый словарь.
+    """
+    return _cached_rules()[0]
+
 
+def get_compiled_rules() -> CompiledRules:
+    """Скомпилированные правила (кэшируются так же, как load_rules)."""
+    return _cached_rules()[1]
 
-def check_rules(data):
+
+def check_rules(data, rules: Optional[CompiledRules] = None):
     """
     Принимает словарь данных транзакции (data), возвращает строковый вердикт.
     
@@ -25,40 +89,43 @@ def check_rules(data):
             - tags_list: список тегов
             - is_budget_exceeded: флаг превышения общего бюджета
             - category_total: текущая сумма трат по категории
+        rules: скомпилированные правила; по умолчанию — get_compiled_rules().
+            При проверке большой пачки можно получить их один раз и передавать сюда.
     
     Returns:
         str: вердикт о соответствии правилам
     """
-    rules = load_rules()
+    if rules is None:
+        rules = get_compiled_rules()
     
     # --- 1. HARD FILTERS (Критические проверки) ---
     
     # Проверка: если общий бюджет уже превышен, блокируем новую трату
-    if rules['critical_rules']['block_if_budget_exceeded'] and data.get('is_budget_exceeded', False):
+    if rules.block_if_budget_exceeded and data.get('is_budget_exceeded', False):
         return "⛔️ Критическая ошибка: Общий бюджет уже превышен. Новая трата заблокирована."
     
     # Проверка: сумма траты должна быть положительной
-    if data['amount'] < rules['thresholds']['min_amount']:
+    if data['amount'] < rules.min_amount:
         return "⛔️ Критическая ошибка: Сумма траты не может быть отрицательной"
     
     # Проверка на запрещенные элементы в тегах (Blacklist)
     for tag in data.get('tags_list', []):
-        if tag in rules['lists']['blacklist']:
+        if tag in rules.blacklist:
             return f"⛔️ Критическая ошибка: Найден запрещенный тег ({tag})"
     
     # --- 2. БИЗНЕС-ЛОГИКА (Сравнение с лимитами) ---
     
     # Проверка превышения общего бюджета
-    if rules['critical_rules']['must_not_exceed_total_budget']:
+    if rules.must_not_exceed_total_budget:
         # Предполагаем, что data содержит текущую сумму всех трат
         current_total = data.get('total_spent', 0) + data['amount']
-        if current_total > rules['thresholds']['max_total_budget']:
-            return f"❌ Отказ: Превышен общий лимит бюджета ({rules['thresholds']['max_total_budget']}). Текущая сумма: {current_total}"
+        if current_total > rules.max_total_budget:
+            return f"❌ Отказ: Превышен общий лимит бюджета ({rules.max_total_budget}). Текущая сумма: {current_total}"
     
     # Проверка превышения лимита по категории
-    if rules['critical_rules']['must_not_exceed_category_budget']:
+    if rules.must_not_exceed_category_budget:
         category = data.get('category', 'Other')
-        category_limits = rules['thresholds']['max_category_budget']
+        category_limits = rules.category_limits
         
         if category in category_limits:
             # Проверяем, не превысит ли новая трата лимит категории
@@ -81,7 +148,7 @@ def check_rules(data):
                 )
     
     # Проверка на наличие элементов из whitelist (опционально)
-    has_whitelist_tag = any(tag in rules['lists']['whitelist'] for tag in data.get('tags_list', []))
+    has_whitelist_tag = any(tag in rules.whitelist for tag in data.get('tags_list', []))
     
     # Если все проверки пройдены
     success_msg = "✅ Успех: Трата соответствует правилам контроля бюджета"
@@ -91,6 +158,260 @@ def check_rules(data):
     return success_msg
 
 
+# Коды статуса для пакетной проверки (чем больше — тем серьёзнее)
+STATUS_OK = 0
+STATUS_WARNING = 1
+STATUS_REJECTED = 2
+STATUS_BLOCKED = 3
+
+
+def check_rules_batch(df, rules: Optional[CompiledRules] = None, with_messages: bool = True):
+    """
+    Пакетная версия check_rules: проверяет все строки DataFrame векторно (pandas/NumPy).
+
+    Args:
+        df: DataFrame с колонками amount (обязательно) и, опционально, category,
+            tags_list, total_spent, category_total, is_budget_exceeded — смысл тот же,
+            что у ключей словаря в check_rules. Отсутствующие колонки = значения по умолчанию.
+        rules: скомпилированные правила; по умолчанию — get_compiled_rules().
+        with_messages: False — только коды статуса, без сборки текстов (ещё быстрее).
+
+    Returns:
+        DataFrame с тем же индексом и колонками:
+            - status: STATUS_OK / STATUS_WARNING / STATUS_REJECTED / STATUS_BLOCKED
+            - message: тот же текст вердикта, что вернул бы check_rules для строки
+    """
+    import numpy as np
+    import pandas as pd
+
+    if rules is None:
+        rules = get_compiled_rules()
+
+    n = len(df)
+    amount = df['amount'].to_numpy()
+    category = df['category'].to_numpy(dtype=object) if 'category' in df else np.full(n, 'Other', dtype=object)
+    total_spent = df['total_spent'].to_numpy() if 'total_spent' in df else np.zeros(n, dtype=np.int64)
+    category_total = df['category_total'].to_numpy() if 'category_total' in df else np.zeros(n, dtype=np.int64)
+    if 'is_budget_exceeded' in df:
+        budget_exceeded = df['is_budget_exceeded'].fillna(False).to_numpy(dtype=bool)
+    else:
+        budget_exceeded = np.zeros(n, dtype=bool)
+
+    # Теги: склеиваем списки в один плоский массив, проверяем вхождение в множества
+    # по уникальным тегам (их единицы) и раскладываем обратно по номеру строки.
+    blacklist_pos = np.full(n, -1, dtype=np.int64)  # позиция первого запрещённого тега
+    has_whitelist = np.zeros(n, dtype=bool)
+    flat_tags = None
+    if 'tags_list' in df and n and (rules.blacklist or rules.whitelist):
+        tag_lists = df['tags_list'].to_numpy(dtype=object)
+        lengths = np.fromiter(map(len, tag_lists), dtype=np.int64, count=n)
+        flat_tags = np.fromiter(chain.from_iterable(tag_lists), dtype=object, count=int(lengths.sum()))
+        owner = np.repeat(np.arange(n), lengths)
+        # Код -1 у None/NaN-тега указывает на последний элемент масок: туда дописан
+        # False — такой тег не совпадает ни с чем, как и в check_rules
+        tag_codes, tag_uniques = pd.factorize(flat_tags)
+        if rules.blacklist:
+            is_black = np.array([t in rules.blacklist for t in tag_uniques] + [False], dtype=bool)
+            hits = np.flatnonzero(is_black[tag_codes])
+            # np.unique возвращает первое вхождение каждой строки — как цикл в check_rules
+            rows_hit, first = np.unique(owner[hits], return_index=True)
+            blacklist_pos[rows_hit] = hits[first]
+        if rules.whitelist:
+            is_white = np.array([t in rules.whitelist for t in tag_uniques] + [False], dtype=bool)
+            has_whitelist[owner[is_white[tag_codes]]] = True
+    has_blacklist = blacklist_pos >= 0
+
+    current_total = total_spent + amount
+    new_category_total = category_total + amount
+    # Лимит категории: словарь → массив через коды категорий (NaN — лимита нет).
+    # У None/NaN-категории код -1, поэтому в конец дописан NaN: без лимита, как в check_rules.
+    cat_codes, cat_uniques = pd.factorize(category)
+    limits_by_code = np.array([rules.category_limits.get(c, np.nan) for c in cat_uniques] + [np.nan], dtype=float)
+    limit_values = limits_by_code[cat_codes]
+    has_limit = ~np.isnan(limit_values)
+    new_cat_values = new_category_total.astype(float)
+
+    # Условия в порядке приоритета check_rules: срабатывает первое истинное
+    blocked_budget = budget_exceeded & rules.block_if_budget_exceeded
+    negative = amount < rules.min_amount
+    over_total = rules.must_not_exceed_total_budget & (current_total > rules.max_total_budget)
+    check_category = rules.must_not_exceed_category_budget & has_limit
+    with np.errstate(invalid='ignore'):
+        over_category = check_category & (new_cat_values > limit_values)
+        near_category = check_category & (new_cat_values >= limit_values * 0.8)
+
+    conditions = [blocked_budget, negative, has_blacklist, over_total, over_category, near_category]
+    kind = np.select(conditions, np.arange(1, len(conditions) + 1), default=0)
+    status = np.select(
+        conditions,
+        [STATUS_BLOCKED, STATUS_BLOCKED, STATUS_BLOCKED, STATUS_REJECTED, STATUS_REJECTED, STATUS_WARNING],
+        default=STATUS_OK,
+    ).astype(np.int8)
+
+    if not with_messages:
+        return pd.DataFrame({'status': status}, index=df.index)
+
+    # Постоянные вердикты (успех, успех с подтверждённым тегом, две блокировки)
+    # раскладываются выборкой из массива из четырёх строк — без заполнения
+    # объектного массива и без f-строк; f-строки (тот же формат чисел, что в
+    # check_rules) собираются только для строк с числами в тексте.
+    verdicts = np.array([
+        "✅ Успех: Трата соответствует правилам контроля бюджета",
+        "✅ Успех: Трата соответствует правилам контроля бюджета (найден подтвержденный тег)",
+        "⛔️ Критическая ошибка: Общий бюджет уже превышен. Новая трата заблокирована.",
+        "⛔️ Критическая ошибка: Сумма траты не может быть отрицательной",
+    ], dtype=object)
+    verdict_idx = np.where(kind == 1, 2, np.where(kind == 2, 3, has_whitelist & (kind == 0)))
+    message = verdicts[verdict_idx.astype(np.intp)]
+
+    m = kind == 3
+    if m.any():
+        message[m] = [
+            f"⛔️ Критическая ошибка: Найден запрещенный тег ({tag})"
+            for tag in flat_tags[blacklist_pos[m]].tolist()
+        ]
+
+    m = kind == 4
+    if m.any():
+        # Текст зависит только от суммы, а суммы повторяются — f-строка на уникальную
+        totals, inverse = np.unique(current_total[m], return_inverse=True)
+        texts = np.array([
+            f"❌ Отказ: Превышен общий лимит бюджета ({rules.max_total_budget}). Текущая сумма: {total}"
+            for total in totals.tolist()
+        ], dtype=object)
+        message[m] = texts[inverse]
+
+    # Лимит берём из словаря правил, чтобы int из JSON печатался как int
+    limits = rules.category_limits
+
+    m = kind == 5
+    if m.any():
+        message[m] = [
+            f"❌ Отказ: Превышен лимит категории '{cat}' ({limits[cat]}). "
+            f"Текущая сумма по категории: {before}, "
+            f"новая трата: {amt}, итого: {after}"
+            for cat, before, amt, after in zip(
+                category[m].tolist(), category_total[m].tolist(),
+                amount[m].tolist(), new_category_total[m].tolist(),
+            )
+        ]
+
+    m = kind == 6
+    if m.any():
+        message[m] = [
+            f"⚠️ Предупреждение: Приближение к лимиту категории '{cat}'. "
+            f"Использовано {after} из {limits[cat]} "
+            f"({int(after / limits[cat] * 100)}%)"
+            for cat, after in zip(category[m].tolist(), new_category_total[m].tolist())
+        ]
+
+    # dtype=object: иначе pandas перекладывает строки в свой строковый тип (копия
+    # каждой строки), и это дольше, чем вся сборка текстов
+    return pd.DataFrame(
+        {'status': status, 'message': pd.Series(message, index=df.index, dtype=object)},
+        index=df.index,
+    )
+
+
+@dataclass(frozen=True)
+class LimitCrossing:
+    """
+    Событие потоковой проверки: в месяце `month` накопленная сумма по `scope`
+    впервые достигла уровня `level`.
+
+    scope — "total" (общий бюджет) или название категории;
+    level — "warning" (80% лимита, как в check_rules) или "exceeded" (больше лимита).
+    """
+    month: str
+    scope: str
+    level: str
+    limit: float
+    running_total: float
+    index: int
+    transaction: Dict[str, Any]
+
+
+def _month_key(created_at: Any) -> str:
+    """ISO-строка или date/datetime → 'YYYY-MM'."""
+    if isinstance(created_at, str):
+        return created_at[:7]
+    return created_at.strftime('%Y-%m')
+
+
+def evaluate_stream(
+    transactions: Iterable[Dict[str, Any]],
+    rules: Union[CompiledRules, Dict[str, Any], None] = None,
+    warning_ratio: float = 0.8,
+) -> Iterator[LimitCrossing]:
+    """
+    Потоковая проверка лимитов для истории трат (бэктест правил).
+
+    Принимает транзакции в порядке времени (словари с created_at, amount, category —
+    например, database.iter_transactions()) и сам ведёт накопленные суммы за месяц:
+    общую и по каждой категории. Обновление — O(1) на строку, память — O(категорий),
+    поэтому годы истории проходятся одним проходом без выгрузки в память.
+
+    Для каждого месяца и каждого лимита выдаётся только первая строка, на которой
+    лимит пересечён: сначала "warning" (>= warning_ratio лимита), затем "exceeded".
+    В начале нового месяца суммы обнуляются.
+
+    Args:
+        transactions: итерируемый поток транзакций, отсортированный по created_at.
+        rules: CompiledRules, словарь в формате rules.json (например, новая версия
+            файла для сравнения) или None — текущие правила.
+        warning_ratio: доля лимита для предупреждения.
+
+    Raises:
+        ValueError: если поток не упорядочен по месяцам.
+    """
+    if rules is None:
+        rules = get_compiled_rules()
+    elif isinstance(rules, dict):
+        rules = _compile_rules(rules)
+
+    total_limit = rules.max_total_budget if rules.must_not_exceed_total_budget else None
+    category_limits = rules.category_limits if rules.must_not_exceed_category_budget else {}
+
+    month: Optional[str] = None
+    month_total = 0.0
+    category_totals: Dict[str, float] = {}
+    reached: Dict[str, int] = {}  # scope → 0 (ничего), 1 (warning), 2 (exceeded)
+
+    for index, tx in enumerate(transactions):
+        tx_month = _month_key(tx['created_at'])
+        if tx_month != month:
+            if month is not None and tx_month < month:
+                raise ValueError(
+                    f"Транзакции должны идти по времени: {tx_month} после {month} (строка {index})"
+                )
+            month = tx_month
+            month_total = 0.0
+            category_totals = {}
+            reached = {}
+
+        amount = float(tx['amount'])
+        category = tx.get('category', 'Other')
+        month_total += amount
+        category_total = category_totals.get(category, 0.0) + amount
+        category_totals[category] = category_total
+
+        checks = []
+        if total_limit is not None:
+            checks.append(('total', total_limit, month_total))
+        limit = category_limits.get(category)
+        if limit is not None:
+            checks.append((category, limit, category_total))
+
+        for scope, limit, running in checks:
+            level = reached.get(scope, 0)
+            if level < 1 and running >= limit * warning_ratio and running <= limit:
+                reached[scope] = 1
+                yield LimitCrossing(month, scope, 'warning', limit, running, index, tx)
+            elif level < 2 and running > limit:
+                reached[scope] = 2
+                yield LimitCrossing(month, scope, 'exceeded', limit, running, index, tx)
+
+
 def process_text_message(text: str, data_source: Any, context: dict = None) -> str:
     """
     «Мозг» чатбота: поиск в графе знаний и умные рекомендации по бюджету.
@@ -134,16 +455,28 @@ def process_text_message(text: str, data_source: Any, context: dict = None) -> s
         )
     
     # Работа с графом знаний (NetworkX Graph из Lab 3)
-    # Ищем узел без учета регистра
+    # Ищем узел без учета регистра — по индексу графа, без перебора узлов
     if hasattr(data_source, "nodes"):
-        node_map = {str(node).lower(): node for node in data_source.nodes}
-        if query in node_map:
-            node = node_map[query]
+        from knowledge_graph import get_index
+        node = get_index(data_source).lookup(original_text)
+        if node is not None:
             neighbors = list(data_source.neighbors(node))
             if neighbors:
                 neighbors_str = ", ".join(str(n) for n in neighbors)
                 return f"Я нашёл '{node}' в графе знаний. С этим связано: {neighbors_str}."
             return f"Я нашёл '{node}' в графе знаний, но у него пока нет связей."
+
+        # Точного совпадения нет — нечёткий поиск магазина ("UBER *TRIP 1234" → Uber)
+        from knowledge_graph import find_merchants, get_category_for_store
+        candidates = find_merchants(data_source, original_text, k=3)
+        if candidates:
+            store = candidates[0][0]
+            category = get_category_for_store(data_source, store)
+            others = ", ".join(str(c) for c, _score in candidates[1:])
+            reply = f"Похоже, это '{store}' (категория: {category})."
+            if others:
+                reply += f" Возможно также: {others}."
+            return reply
     
     # Если ничего не нашли
     return (
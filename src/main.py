@@ -1,21 +1,24 @@
 import streamlit as st
 from datetime import date
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # Для работы без GUI
 
+# Сверху — только лёгкие модули (стандартная библиотека). pandas, matplotlib,
+# networkx и sklearn-модели импортируются в тех секциях, где нужны, чтобы первая
+# отрисовка не ждала их загрузки. Время первых импортов видно в debug-панели
+# внизу, полный профиль — `python import_profile.py`.
+from import_profile import import_timer, import_timings
 from mock_data import test_entity as default_data
 from logic import check_rules, load_rules, process_text_message
-from knowledge_graph import create_graph, find_related_entities, get_category_for_store, get_stores_in_category
-from ml_classifier import get_default_classifier
-from anomaly_detector import get_expense_anomaly_detector
-from forecast import forecast_next_month, budget_success_probability
 from report_generator import generate_weekly_report, generate_monthly_summary
-from expense_clustering import get_expense_clusters
 from recommendations import get_smart_recommendations
-from database import init_db, add_transaction, fetch_recent_transactions, sum_amounts_since
-import networkx as nx
+from database import (
+    init_db,
+    add_transaction,
+    dashboard_aggregates,
+    fetch_transactions_page,
+    sum_amounts_since,
+)
+from figure_cache import get_figure_cache
+from memo import memo_stats, memoized
 
 
 st.set_page_config(
@@ -68,28 +71,63 @@ init_db()
 # Инициализация графа знаний (создается один раз и кэшируется)
 @st.cache_resource
 def get_knowledge_graph():
-    """Создает и возвращает граф знаний для классификации транзакций."""
-    return create_graph()
-
-kg = get_knowledge_graph()
+    """Граф знаний для классификации транзакций: из data/raw/merchants.jsonl или встроенный."""
+    with import_timer("knowledge_graph (networkx)"):
+        from knowledge_graph import load_graph
+    return load_graph()
 
 
 # Инициализация ML‑классификатора категорий расходов
 @st.cache_resource
 def get_expense_classifier():
+    with import_timer("ml_classifier (sklearn)"):
+        from ml_classifier import get_default_classifier
     return get_default_classifier()
 
 
-expense_classifier = get_expense_classifier()
+# Инициализация детектора аномалий расходов. Без st.cache_resource: модуль сам
+# кэширует модель и перечитывает её после переобучения (artifact_token)
+def get_anomaly_detector():
+    with import_timer("anomaly_detector (sklearn)"):
+        from anomaly_detector import get_expense_anomaly_detector
+    return get_expense_anomaly_detector()
 
 
-# Инициализация детектора аномалий расходов
+# Потоковые базовые линии по категориям (состояние хранится на диске)
 @st.cache_resource
-def get_anomaly_detector():
-    return get_expense_anomaly_detector()
+def get_streaming_detector():
+    with import_timer("anomaly_detector (sklearn)"):
+        from anomaly_detector import get_streaming_anomaly_detector
+    return get_streaming_anomaly_detector()
+
+
+def get_synced_streaming_detector():
+    """
+    Общий детектор, доведённый до текущего состояния БД: импорт выписок, удаления
+    и записи из других сессий подхватываются здесь. Без изменений в БД — один запрос.
+    """
+    from anomaly_detector import sync_streaming_detector
+
+    return sync_streaming_detector(get_streaming_detector())
+
+
+def get_pyplot():
+    """matplotlib с бэкендом Agg (без GUI) — загружается при первом графике."""
+    with import_timer("matplotlib"):
+        import matplotlib
+        matplotlib.use('Agg')  # Для работы без GUI
+        import matplotlib.pyplot as plt
+    return plt
+
 
+def get_pandas():
+    with import_timer("pandas"):
+        import pandas as pd
+    return pd
 
-anomaly_detector = get_anomaly_detector()
+
+# Готовые PNG графиков: перерисовка только при изменении входных данных
+figure_cache = get_figure_cache()
 
 # ───── ЛЕВАЯ ПАНЕЛЬ (Навигация + фильтры) ─────
 with st.sidebar:
@@ -133,18 +171,13 @@ with st.sidebar:
         else 0,
     )
 
-    user_category_total = st.number_input(
-        "Текущая сумма по категории (₸)",
-        min_value=0,
-        value=default_data["category_total"],
-        step=100,
-    )
-
-    user_total_spent = st.number_input(
-        "Общая сумма всех трат (₸)",
-        min_value=0,
-        value=default_data.get("total_spent", 0),
-        step=100,
+    # Суммы до операции — из сводки в БД за выбранный период (один запрос)
+    aggregates = dashboard_aggregates(_start, _end)
+    user_category_total = aggregates.category_totals.get(user_category, 0.0)
+    user_total_spent = aggregates.total
+    st.caption(
+        f"За период: {aggregates.tx_count} трат на {user_total_spent:,.0f} ₸, "
+        f"из них {user_category} — {user_category_total:,.0f} ₸".replace(",", " ")
     )
 
     st.markdown("**Критические флаги**")
@@ -189,6 +222,12 @@ category_limit = category_limits.get(user_category, category_limits.get("Other",
 
 current_total = current_test_data["total_spent"] + current_test_data["amount"]
 new_category_total = current_test_data["category_total"] + current_test_data["amount"]
+# Суммы по всем категориям за период с учётом текущей операции
+period_category_totals = {
+    **{c: 0.0 for c in category_limits},
+    **aggregates.category_totals,
+    user_category: new_category_total,
+}
 
 remaining_total = max(total_limit - current_total, 0)
 remaining_category = max(category_limit - new_category_total, 0)
@@ -234,15 +273,17 @@ st.write("")  # отступ
 # ── Блок графиков, как на современном дашборде ──
 chart_col1, chart_col2 = st.columns((2, 1.2))
 
+pd = get_pandas()
+
 with chart_col1:
     st.markdown(
-        '<div class="spendflow-section-title">Динамика трат за неделю</div>',
+        '<div class="spendflow-section-title">Траты по дням недели за период</div>',
         unsafe_allow_html=True,
     )
     weekly_data = pd.DataFrame(
         {
             "День": ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"],
-            "Расходы, ₸": [12000, 8000, 9500, 11000, 15000, 13000, 7000],
+            "Расходы, ₸": aggregates.weekday_totals,
         }
     ).set_index("День")
     st.bar_chart(weekly_data, height=260)
@@ -266,11 +307,22 @@ with chart_col2:
 st.write("")
 
 # ── Прогноз расходов и вероятность бюджета ──
-forecast_val, chart_data = forecast_next_month(total_limit)
-prob, prob_explanation = budget_success_probability(
-    total_spent=current_total,
-    total_limit=total_limit,
-)
+with import_timer("forecast (sklearn)"):
+    from forecast import forecast_next_month, budget_success_probability, simulate_budget_from_history
+plt = get_pyplot()
+
+# Чистые расчёты мемоизированы по аргументам и версии данных в БД:
+# сообщение в чат или клик по виджету не запускает их заново
+forecast_val, chart_data = memoized(forecast_next_month)(total_limit)
+# Монте-Карло по дневной истории из БД; если истории мало — прежняя оценка по темпу
+budget_sim = memoized(simulate_budget_from_history)(total_spent=current_total, total_limit=total_limit)
+if budget_sim is not None:
+    prob, prob_explanation = budget_sim.probability, budget_sim.explanation()
+else:
+    prob, prob_explanation = memoized(budget_success_probability)(
+        total_spent=current_total,
+        total_limit=total_limit,
+    )
 
 forecast_col1, forecast_col2 = st.columns([1.5, 1])
 with forecast_col1:
@@ -278,14 +330,22 @@ with forecast_col1:
         '<div class="spendflow-section-title">Прогноз расходов на следующий месяц</div>',
         unsafe_allow_html=True,
     )
-    fig_fc, ax_fc = plt.subplots(figsize=(8, 4))
-    ax_fc.bar(chart_data["months"][:-1], chart_data["actual"], color="#3B82F6", alpha=0.7, label="Факт")
-    ax_fc.bar(chart_data["months"][-1], chart_data["forecast"], color="#F97316", alpha=0.7, label="Прогноз")
-    ax_fc.axhline(y=total_limit, color="red", linestyle="--", linewidth=2, label=f"Лимит {total_limit:,.0f} ₸")
-    ax_fc.legend()
-    ax_fc.set_ylabel("₸")
-    plt.tight_layout()
-    st.pyplot(fig_fc, use_container_width=True)
+    def build_forecast_figure():
+        fig_fc, ax_fc = plt.subplots(figsize=(8, 4))
+        ax_fc.bar(chart_data["months"][:-1], chart_data["actual"], color="#3B82F6", alpha=0.7, label="Факт")
+        ax_fc.bar(chart_data["months"][-1], chart_data["forecast"], color="#F97316", alpha=0.7, label="Прогноз")
+        ax_fc.axhline(y=total_limit, color="red", linestyle="--", linewidth=2, label=f"Лимит {total_limit:,.0f} ₸")
+        ax_fc.legend()
+        ax_fc.set_ylabel("₸")
+        plt.tight_layout()
+        return fig_fc
+
+    # Картинка перерисовывается только при изменении данных прогноза или лимита
+    st.image(
+        figure_cache.render(("forecast", chart_data, total_limit), build_forecast_figure),
+        use_container_width=True,
+    )
+    st.caption(f"Модель прогноза: {chart_data['method']}")
 
 with forecast_col2:
     st.markdown(
@@ -298,18 +358,20 @@ with forecast_col2:
         delta=prob_explanation[:60] + "..." if len(prob_explanation) > 60 else prob_explanation,
     )
     st.caption(prob_explanation)
+    if budget_sim is not None:
+        bands = budget_sim.percentiles
+        st.caption(
+            "Итог месяца по процентилям: "
+            + " · ".join(f"P{p}: {bands[p]:,.0f} ₸".replace(",", " ") for p in sorted(bands))
+        )
 
 st.write("")
 
 # ── Умные рекомендации ──
-category_totals_demo = {
-    user_category: new_category_total,
-    **{c: 0 for c in category_limits if c != user_category},
-}
-tips = get_smart_recommendations(
+tips = memoized(get_smart_recommendations)(
     current_total=current_total,
     total_limit=total_limit,
-    category_totals=category_totals_demo,
+    category_totals=period_category_totals,
     category_limits=category_limits,
     current_transaction_amount=user_amount,
     current_category=user_category,
@@ -321,14 +383,11 @@ for tip in tips:
 st.write("")
 
 # ── Текстовый отчёт ──
-weekly_amounts = [12000, 8000, 9500, 11000, 15000, 13000, 7000]
+# Последние 7 дней периода — из того же запроса сводки, что и метрики периода
+weekly_amounts = aggregates.last_week_totals
 weekly_report = generate_weekly_report(weekly_amounts)
-category_totals_report = {
-    user_category: new_category_total,
-    **{c: 0 for c in category_limits if c != user_category},
-}
 monthly_report = generate_monthly_summary(
-    category_totals=category_totals_report,
+    category_totals=period_category_totals,
     total_spent=current_total,
     total_limit=total_limit,
 )
@@ -339,7 +398,10 @@ st.markdown(monthly_report)
 st.write("")
 
 # ── Кластеризация трат (K-Means) ──
-clusters = get_expense_clusters(n_clusters=4)
+with import_timer("expense_clustering (sklearn)"):
+    from expense_clustering import cluster_model_token, get_expense_clusters, update_clusters
+# Кластеры зависят и от модели на диске: переобучение меняет её без изменения БД
+clusters = memoized(get_expense_clusters, token=cluster_model_token)(n_clusters=4)
 st.markdown('<div class="spendflow-section-title">Типы трат (кластеризация K-Means)</div>', unsafe_allow_html=True)
 cluster_cols = st.columns(4)
 for i, cluster in enumerate(clusters):
@@ -365,10 +427,12 @@ with details_col:
     )
 
     # Предсказание категории с помощью ML‑классификатора
+    expense_classifier = get_expense_classifier()
     ml_category, ml_prob = expense_classifier.predict(current_test_data["description"])
     st.write(f"**ML‑категория (по описанию):** {ml_category} ({ml_prob * 100:.0f}%)")
 
     # Оценка «нетипичности» траты (анализ аномалий)
+    anomaly_detector = get_anomaly_detector()
     anomaly_label, anomaly_score = anomaly_detector.score(
         amount=current_test_data["amount"],
         category=current_test_data["category"],
@@ -380,6 +444,20 @@ with details_col:
     else:
         st.write(f"**Аномалия:** ⚠ нетипично высокая трата (score={anomaly_score:.2f})")
 
+    # Сравнение с историей своей категории (потоковые базовые линии)
+    stream_label, stream_z = get_synced_streaming_detector().score(
+        amount=current_test_data["amount"],
+        category=current_test_data["category"],
+    )
+    stream_texts = {
+        "normal": "обычная сумма для категории",
+        "warning": "выше обычного для категории",
+        "anomaly": "⚠ нетипично для категории",
+        "learning": "мало истории по категории",
+        "invalid": "некорректная сумма",
+    }
+    st.write(f"**По истории категории:** {stream_texts[stream_label]} (z={stream_z:.1f})")
+
 with result_col:
     st.write("**Проверка правил**")
     run_check = st.button("🔍 Запустить проверку", type="primary", use_container_width=True)
@@ -427,6 +505,15 @@ with hist_col1:
                 tags=current_test_data["tags_list"],
             )
             st.success(f"Запись добавлена (id={new_id}). Обновите страницу или прокрутите таблицу ниже.")
+            # Базовая линия категории дочитывает новую строку из БД и сохраняется сразу
+            get_synced_streaming_detector()
+            # Центроиды кластеров дообучаются на новой трате, без полного переобучения
+            update_clusters([{
+                "amount": float(user_amount),
+                "category": user_category,
+                "is_weekend": date.today().weekday() >= 5,
+                "tags": current_test_data["tags_list"],
+            }])
         except Exception as e:
             st.error(f"Не удалось сохранить: {e}")
 
@@ -434,77 +521,128 @@ with hist_col1:
     st.metric("Сумма всех сохранённых трат в БД", f"{total_in_db:,.0f} ₸".replace(",", " "))
 
 with hist_col2:
-    recent = fetch_recent_transactions(limit=30)
-    if recent:
-        df_hist = pd.DataFrame(recent)
+    # Фильтры истории: период берём из сайдбара, остальное — здесь
+    filter_col1, filter_col2 = st.columns(2)
+    with filter_col1:
+        hist_category = st.selectbox("Категория", ["Все"] + categories, key="hist_category")
+    with filter_col2:
+        hist_tag = st.text_input("Тег", value="", key="hist_tag")
+
+    hist_filters = {
+        "start": _start,
+        "end": _end,
+        "category": None if hist_category == "Все" else hist_category,
+        "tag": hist_tag.strip() or None,
+    }
+    # Keyset-пагинация: в session_state храним стек курсоров просмотренных страниц.
+    # При смене фильтров начинаем с первой страницы.
+    if st.session_state.get("hist_filters") != hist_filters:
+        st.session_state.hist_filters = hist_filters
+        st.session_state.hist_cursors = [None]
+
+    page_rows, next_cursor = fetch_transactions_page(
+        **hist_filters,
+        cursor=st.session_state.hist_cursors[-1],
+        page_size=30,
+    )
+    if page_rows:
+        df_hist = pd.DataFrame(page_rows)
         st.dataframe(df_hist, use_container_width=True, hide_index=True)
     else:
-        st.info("Пока нет сохранённых записей. Заполните форму слева и нажмите «Сохранить».")
+        st.info("Нет записей за выбранный период. Заполните форму слева и нажмите «Сохранить».")
+
+    page_col1, page_col2, page_col3 = st.columns([1, 1, 1])
+    with page_col1:
+        if st.button("⟵ Назад", key="hist_prev", disabled=len(st.session_state.hist_cursors) <= 1):
+            st.session_state.hist_cursors.pop()
+            st.rerun()
+    with page_col2:
+        st.caption(f"Страница {len(st.session_state.hist_cursors)}")
+    with page_col3:
+        if st.button("Дальше ⟶", key="hist_next", disabled=next_cursor is None):
+            st.session_state.hist_cursors.append(next_cursor)
+            st.rerun()
 
 st.write("")
 
 # ── Граф знаний ──
+kg = get_knowledge_graph()
+from knowledge_graph import (
+    find_ancestors,
+    find_descendants,
+    find_related_entities,
+    get_category_for_store,
+    get_layout,
+    get_stores_in_category,
+    structure_hash,
+)
+
 st.markdown('<div class="spendflow-section-title">Граф знаний: Магазины и Категории</div>', unsafe_allow_html=True)
 
 graph_col1, graph_col2 = st.columns([1.5, 1])
 
 with graph_col1:
-    # Визуализация графа с помощью matplotlib
-    fig, ax = plt.subplots(figsize=(12, 8))
+    def build_graph_figure():
+        # Визуализация графа с помощью matplotlib
+        fig, ax = plt.subplots(figsize=(12, 8))
     
-    # Получаем позиции узлов для красивого отображения
-    pos = {}
+        # Получаем позиции узлов для красивого отображения
+        pos = {}
     
-    # Разделяем узлы по типам
-    stores = []
-    categories = []
-    for node in kg.nodes():
-        node_type = kg.nodes[node].get("type", "unknown")
-        if node_type == "store":
-            stores.append(node)
-        elif node_type == "category":
-            categories.append(node)
+        # Разделяем узлы по типам
+        stores = []
+        categories = []
+        for node in kg.nodes():
+            node_type = kg.nodes[node].get("type", "unknown")
+            if node_type == "store":
+                stores.append(node)
+            elif node_type == "category":
+                categories.append(node)
     
-    # Располагаем категории слева, магазины справа
-    import numpy as np
-    n_categories = len(categories)
-    n_stores = len(stores)
+        # Располагаем категории слева, магазины справа
+        n_categories = len(categories)
+        n_stores = len(stores)
     
-    # Категории слева
-    for i, cat in enumerate(categories):
-        pos[cat] = (0, i * 1.5)
+        # Категории слева
+        for i, cat in enumerate(categories):
+            pos[cat] = (0, i * 1.5)
     
-    # Магазины справа
-    for i, store in enumerate(stores):
-        pos[store] = (3, i * 0.8)
+        # Магазины справа
+        for i, store in enumerate(stores):
+            pos[store] = (3, i * 0.8)
     
-    # Рисуем связи
-    for edge in kg.edges():
-        ax.plot([pos[edge[0]][0], pos[edge[1]][0]], 
-                [pos[edge[0]][1], pos[edge[1]][1]], 
-                'gray', alpha=0.3, linewidth=1.5)
+        # Рисуем связи
+        for edge in kg.edges():
+            ax.plot([pos[edge[0]][0], pos[edge[1]][0]], 
+                    [pos[edge[0]][1], pos[edge[1]][1]], 
+                    'gray', alpha=0.3, linewidth=1.5)
     
-    # Рисуем узлы-категории (кружки, синие)
-    for cat in categories:
-        ax.scatter(pos[cat][0], pos[cat][1], s=2000, c='#3B82F6', alpha=0.7, edgecolors='darkblue', linewidths=2)
-        ax.text(pos[cat][0], pos[cat][1], cat, ha='center', va='center', 
-                fontsize=10, fontweight='bold', color='white')
+        # Рисуем узлы-категории (кружки, синие)
+        for cat in categories:
+            ax.scatter(pos[cat][0], pos[cat][1], s=2000, c='#3B82F6', alpha=0.7, edgecolors='darkblue', linewidths=2)
+            ax.text(pos[cat][0], pos[cat][1], cat, ha='center', va='center', 
+                    fontsize=10, fontweight='bold', color='white')
     
-    # Рисуем узлы-магазины (кружки, оранжевые)
-    for store in stores:
-        ax.scatter(pos[store][0], pos[store][1], s=1500, c='#F97316', alpha=0.7, 
-                  edgecolors='darkorange', linewidths=2)
-        ax.text(pos[store][0], pos[store][1], store, ha='center', va='center', 
-                fontsize=9, fontweight='bold', color='white')
+        # Рисуем узлы-магазины (кружки, оранжевые)
+        for store in stores:
+            ax.scatter(pos[store][0], pos[store][1], s=1500, c='#F97316', alpha=0.7, 
+                      edgecolors='darkorange', linewidths=2)
+            ax.text(pos[store][0], pos[store][1], store, ha='center', va='center', 
+                    fontsize=9, fontweight='bold', color='white')
     
-    ax.set_xlim(-0.5, 3.5)
-    ax.set_ylim(-1, max(len(categories) * 1.5, len(stores) * 0.8) + 1)
-    ax.axis('off')
-    ax.set_title('Граф знаний: Связи между магазинами и категориями', 
-                 fontsize=14, fontweight='bold', pad=20)
+        ax.set_xlim(-0.5, 3.5)
+        ax.set_ylim(-1, max(len(categories) * 1.5, len(stores) * 0.8) + 1)
+        ax.axis('off')
+        ax.set_title('Граф знаний: Связи между магазинами и категориями', 
+                     fontsize=14, fontweight='bold', pad=20)
     
-    plt.tight_layout()
-    st.pyplot(fig, use_container_width=True)
+        plt.tight_layout()
+        return fig
+
+    st.image(
+        figure_cache.render(("kg_overview", structure_hash(kg)), build_graph_figure),
+        use_container_width=True,
+    )
 
 with graph_col2:
     st.markdown("**Информация о графе:**")
@@ -553,6 +691,9 @@ with graph_col2:
 st.write("")
 
 # ── Knowledge Graph Explorer ──
+with import_timer("networkx"):
+    import networkx as nx
+
 st.markdown('<div class="spendflow-section-title">Knowledge Graph Explorer 🕸</div>', unsafe_allow_html=True)
 
 explorer_col1, explorer_col2 = st.columns([1, 1.5])
@@ -583,47 +724,62 @@ with explorer_col1:
         else:
             st.info(f"Объект '{selected_node}' не имеет связей")
 
+        # Многошаговые связи — из предвычисленного индекса, без обхода графа
+        ancestors = find_ancestors(kg, selected_node)
+        if ancestors:
+            st.write("**Иерархия:** " + " → ".join(str(n) for n in [selected_node, *ancestors]))
+        descendants = find_descendants(kg, selected_node)
+        if descendants:
+            st.write(f"**Входит в '{selected_node}' (на всех уровнях):** " + ", ".join(str(n) for n in descendants))
+
 with explorer_col2:
     st.write("**Визуализация структуры графа:**")
     
-    # Создаем визуализацию с помощью spring_layout
-    fig, ax = plt.subplots(figsize=(10, 8))
+    def build_explorer_figure():
+        # Создаем визуализацию с помощью spring_layout
+        fig, ax = plt.subplots(figsize=(10, 8))
     
-    # Раскладка (layout) - как расположить точки
-    pos = nx.spring_layout(kg, k=1.5, iterations=50)
+        # Раскладка (layout) считается один раз на структуру графа и кэшируется
+        pos = get_layout(kg, k=1.5, iterations=50)
     
-    # Разделяем узлы по типам для разных цветов
-    stores = [node for node in kg.nodes() if kg.nodes[node].get("type") == "store"]
-    categories = [node for node in kg.nodes() if kg.nodes[node].get("type") == "category"]
+        # Разделяем узлы по типам для разных цветов
+        stores = [node for node in kg.nodes() if kg.nodes[node].get("type") == "store"]
+        categories = [node for node in kg.nodes() if kg.nodes[node].get("type") == "category"]
     
-    # Рисуем связи
-    nx.draw_networkx_edges(kg, pos, edge_color='gray', alpha=0.3, width=1.5, ax=ax)
+        # Рисуем связи
+        nx.draw_networkx_edges(kg, pos, edge_color='gray', alpha=0.3, width=1.5, ax=ax)
     
-    # Рисуем узлы-категории (синие)
-    if categories:
-        nx.draw_networkx_nodes(kg, pos, nodelist=categories, 
-                              node_color='#3B82F6', node_size=2000, 
-                              alpha=0.7, ax=ax)
+        # Рисуем узлы-категории (синие)
+        if categories:
+            nx.draw_networkx_nodes(kg, pos, nodelist=categories, 
+                                  node_color='#3B82F6', node_size=2000, 
+                                  alpha=0.7, ax=ax)
     
-    # Рисуем узлы-магазины (оранжевые)
-    if stores:
-        nx.draw_networkx_nodes(kg, pos, nodelist=stores, 
-                              node_color='#F97316', node_size=1500, 
-                              alpha=0.7, ax=ax)
+        # Рисуем узлы-магазины (оранжевые)
+        if stores:
+            nx.draw_networkx_nodes(kg, pos, nodelist=stores, 
+                                  node_color='#F97316', node_size=1500, 
+                                  alpha=0.7, ax=ax)
     
-    # Выделяем выбранный узел (красный)
-    if selected_node in kg:
-        nx.draw_networkx_nodes(kg, pos, nodelist=[selected_node], 
-                              node_color='red', node_size=2500, 
-                              alpha=0.9, ax=ax)
+        # Выделяем выбранный узел (красный)
+        if selected_node in kg:
+            nx.draw_networkx_nodes(kg, pos, nodelist=[selected_node], 
+                                  node_color='red', node_size=2500, 
+                                  alpha=0.9, ax=ax)
     
-    # Подписи узлов
-    nx.draw_networkx_labels(kg, pos, font_size=9, font_weight='bold', ax=ax)
+        # Подписи узлов
+        nx.draw_networkx_labels(kg, pos, font_size=9, font_weight='bold', ax=ax)
     
-    ax.set_title('Граф знаний: Структура связей', fontsize=14, fontweight='bold', pad=20)
-    ax.axis('off')
-    plt.tight_layout()
-    st.pyplot(fig, use_container_width=True)
+        ax.set_title('Граф знаний: Структура связей', fontsize=14, fontweight='bold', pad=20)
+        ax.axis('off')
+        plt.tight_layout()
+        return fig
+
+    # Ключ — структура графа и выбранный узел: смена узла рисуется один раз, дальше из кэша
+    st.image(
+        figure_cache.render(("kg_explorer", structure_hash(kg), selected_node), build_explorer_figure),
+        use_container_width=True,
+    )
 
 st.write("")
 
@@ -652,10 +808,7 @@ if user_prompt:
     chat_context = {
         "current_total": current_total,
         "total_limit": total_limit,
-        "category_totals": {
-            user_category: new_category_total,
-            **{c: 0 for c in category_limits if c != user_category},
-        },
+        "category_totals": period_category_totals,
         "category_limits": category_limits,
         "amount": user_amount,
         "category": user_category,
@@ -698,3 +851,21 @@ with st.expander("ℹ️ Правила и лимиты"):
         """
     )
 
+with st.expander("🛠 Debug: время загрузки модулей и кэши"):
+    timings = import_timings()
+    if timings:
+        for label, seconds in timings.items():
+            st.write(f"- {label}: {seconds * 1000:,.0f} мс")
+        st.caption("Учитывается первый (холодный) импорт в этом процессе. Полный профиль: `python import_profile.py`.")
+    else:
+        st.caption("Все модули уже были загружены в этом процессе.")
+
+    for name, stats in memo_stats().items():
+        st.write(f"- Мемо `{name}`: попаданий {stats['hits']}, промахов {stats['misses']}, записей {stats['size']}")
+
+    fc_stats = figure_cache.stats()
+    st.write(
+        f"- Кэш графиков: {fc_stats['items']} шт., {fc_stats['bytes'] / 1024:,.0f} КБ; "
+        f"попаданий {fc_stats['hits']}, промахов {fc_stats['misses']}, вытеснено {fc_stats['evictions']}"
+    )
+
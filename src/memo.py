@@ -0,0 +1,142 @@
+# src/memo.py
+"""
+Мемоизация тяжёлых расчётов дашборда между перезапусками скрипта Streamlit.
+
+Streamlit выполняет main.py целиком на любое действие, даже на сообщение в чат,
+и прогноз, вероятность бюджета, рекомендации и кластеры считались каждый раз.
+Эти функции чистые: результат зависит только от аргументов и данных в БД.
+Поэтому ключ кэша — аргументы + версия данных (database.get_data_version,
+растёт с каждой вставкой/удалением) + сегодняшняя дата (прогнозы считают
+оставшиеся дни месяца).
+
+    forecast_next_month = memoized(forecast_next_month)
+
+Если результат зависит ещё и от обученной модели (кластеры), версии данных мало:
+переобучение из командной строки меняет артефакт, не трогая БД. Для таких
+функций передаётся token — функция с теми же аргументами, что и func,
+возвращающая идентичность модели (например, artifact_token из model_store);
+её значение входит в ключ:
+
+    clusters = memoized(get_expense_clusters, token=cluster_model_token)(n_clusters=4)
+
+memoized() возвращает одну и ту же обёртку для одной функции, так что вызов на
+каждом перезапуске main.py не сбрасывает кэш. Результаты общие для всех
+вызовов — не изменяйте их на месте. Счётчики попаданий/промахов — memo_stats().
+"""
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, Optional, Tuple
+
+DEFAULT_MAXSIZE = 64
+
+_registry: Dict[Tuple[str, str], "MemoizedFunction"] = {}
+_registry_lock = threading.Lock()
+
+
+def _current_data_version() -> int:
+    from database import get_data_version
+
+    return get_data_version()
+
+
+class MemoizedFunction:
+    """Обёртка с LRU-кэшем по (аргументы, версия данных, дата[, token]) и счётчиками."""
+
+    def __init__(
+        self,
+        func: Callable[..., Any],
+        maxsize: int = DEFAULT_MAXSIZE,
+        token: Optional[Callable[..., Any]] = None,
+    ) -> None:
+        self.func = func
+        self.maxsize = maxsize
+        self.token = token
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        functools.update_wrapper(self, func)
+
+    def _key(self, args: tuple, kwargs: dict, version: int) -> str:
+        model = self.token(*args, **kwargs) if self.token is not None else None
+        payload = json.dumps(
+            [args, kwargs, version, date.today().isoformat(), model],
+            sort_keys=True,
+            default=repr,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        try:
+            version = _current_data_version()
+        except sqlite3.Error:
+            # Без версии данных кэшу нельзя доверять — считаем напрямую
+            with self._lock:
+                self.misses += 1
+            return self.func(*args, **kwargs)
+
+        key = self._key(args, kwargs, version)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        result = self.func(*args, **kwargs)
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return result
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
+
+def memoized(
+    func: Callable[..., Any],
+    maxsize: int = DEFAULT_MAXSIZE,
+    token: Optional[Callable[..., Any]] = None,
+) -> MemoizedFunction:
+    """
+    Мемоизированная версия func; повторный вызов для той же функции возвращает
+    ту же обёртку. token(*args, **kwargs) — идентичность моделей, от которых
+    зависит результат (см. описание модуля).
+    """
+    if isinstance(func, MemoizedFunction):
+        return func
+    key = (func.__module__, func.__qualname__)
+    with _registry_lock:
+        wrapper = _registry.get(key)
+        if wrapper is None or wrapper.func is not func or wrapper.token is not token:
+            wrapper = MemoizedFunction(func, maxsize=maxsize, token=token)
+            _registry[key] = wrapper
+        return wrapper
+
+
+def memo_stats() -> Dict[str, Dict[str, int]]:
+    """{имя функции: {hits, misses, size}} по всем мемоизированным функциям."""
+    with _registry_lock:
+        wrappers = list(_registry.values())
+    return {w.name: w.stats() for w in wrappers}
+
+
+def clear_memo() -> None:
+    with _registry_lock:
+        wrappers = list(_registry.values())
+    for w in wrappers:
+        w.cache_clear()
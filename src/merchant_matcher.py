@@ -0,0 +1,181 @@
+# src/merchant_matcher.py
+"""
+Нечёткий поиск магазинов по названию: триграммный инвертированный индекс.
+
+Строки из банковских выписок редко совпадают с названием магазина дословно:
+"UBER *TRIP 1234", "STARBUCKS #0423 ALMATY". Поэтому:
+- `normalize_merchant` убирает регистр, цифры и пунктуацию ("uber trip");
+- `TrigramIndex` хранит две CSR-таблицы (общий массив id + смещения):
+  триграмма → строки и строка → триграммы. Кандидаты берутся из списков
+  строк по триграммам запроса, число общих триграмм для них считается
+  векторно по второй таблице, лучшие k — через argpartition. Все имена
+  не перебираются.
+
+Частые триграммы ("mar", "ket", " ca"...) встречаются в тысячах имён, поэтому
+кандидаты собираются только по редким триграммам запроса (частые всё равно
+учитываются в оценке), и точная оценка считается лишь для MAX_CANDIDATES строк
+с наибольшим числом общих редких триграмм. Если в запросе есть редкие
+триграммы, строки, с которыми у него общие только частые (например, голое
+"Market"), не рассматриваются — это почти всегда ложные совпадения.
+
+Оценка совпадения — среднее двух мер по числу общих триграмм o:
+    dice        = 2·o / (n_запроса + n_имени)   — похожесть строк целиком;
+    containment = o / min(n_запроса, n_имени)   — одна строка внутри другой,
+чтобы "uber trip" уверенно находил "Uber", а "star" — "Starbucks".
+"""
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+_NON_LETTERS = re.compile(r"[\W\d_]+", re.UNICODE)
+
+DEFAULT_MIN_SCORE = 0.45
+# Триграмма «частая», если встречается в большей доле строк (но не реже чем в 1000)
+FREQUENT_GRAM_SHARE = 0.01
+MAX_CANDIDATES = 256
+
+
+def normalize_merchant(text: str) -> str:
+    """Нижний регистр (casefold), без цифр и пунктуации, одиночные пробелы."""
+    return _NON_LETTERS.sub(" ", str(text).casefold()).strip()
+
+
+def trigrams(normalized: str) -> List[str]:
+    """Уникальные триграммы строки с пробелом по краям (начало/конец слова тоже значимы)."""
+    if not normalized:
+        return []
+    padded = f" {normalized} "
+    return list(dict.fromkeys(padded[i:i + 3] for i in range(len(padded) - 2)))
+
+
+@dataclass
+class TrigramIndex:
+    """
+    Индекс строк (имена и алиасы) → целевые объекты (узлы графа).
+
+    postings_ids[postings_ptr[g]:postings_ptr[g + 1]] — id строк с триграммой g;
+    entry_grams[entry_ptr[i]:entry_ptr[i + 1]] — триграммы строки i;
+    gram_counts[i] — их число; targets[i] — объект строки.
+    """
+    gram_ids: Dict[str, int]
+    postings_ptr: np.ndarray
+    postings_ids: np.ndarray
+    entry_ptr: np.ndarray
+    entry_grams: np.ndarray
+    gram_counts: np.ndarray
+    names: List[str]
+    targets: List[Any]
+
+    @classmethod
+    def build(cls, entries: Iterable[Tuple[str, Any]]) -> "TrigramIndex":
+        """entries — пары (строка, объект); пустые после нормализации строки пропускаются."""
+        gram_ids: Dict[str, int] = {}
+        entry_grams: List[int] = []
+        gram_counts: List[int] = []
+        names: List[str] = []
+        targets: List[Any] = []
+        for text, target in entries:
+            normalized = normalize_merchant(text)
+            grams = trigrams(normalized)
+            if not grams:
+                continue
+            for g in grams:
+                entry_grams.append(gram_ids.setdefault(g, len(gram_ids)))
+            gram_counts.append(len(grams))
+            names.append(normalized)
+            targets.append(target)
+
+        counts = np.asarray(gram_counts, dtype=np.int32)
+        grams_flat = np.asarray(entry_grams, dtype=np.int32)
+        owners = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+        # Сортировка по триграмме (стабильная — id строк внутри списка по возрастанию)
+        order = np.argsort(grams_flat, kind="stable")
+        ptr = np.zeros(len(gram_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(grams_flat, minlength=len(gram_ids)), out=ptr[1:])
+        entry_ptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=entry_ptr[1:])
+        return cls(
+            gram_ids=gram_ids,
+            postings_ptr=ptr,
+            postings_ids=owners[order],
+            entry_ptr=entry_ptr,
+            entry_grams=grams_flat,
+            gram_counts=counts,
+            names=names,
+            targets=targets,
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def search(self, query: str, k: int = 5, min_score: float = DEFAULT_MIN_SCORE) -> List[Tuple[Any, float]]:
+        """
+        До k лучших объектов с оценкой >= min_score, по убыванию оценки.
+        Несколько строк одного объекта (имя и алиасы) дают один результат.
+        """
+        grams = trigrams(normalize_merchant(query))
+        if not grams or not self.names:
+            return []
+        known = [self.gram_ids[g] for g in grams if g in self.gram_ids]
+        if not known:
+            return []
+
+        ptr, postings = self.postings_ptr, self.postings_ids
+        cap = max(1000, int(len(self.names) * FREQUENT_GRAM_SHARE))
+        rare = [g for g in known if ptr[g + 1] - ptr[g] <= cap]
+        if not rare:  # запрос только из частых триграмм ("market") — берём две самые редкие
+            rare = sorted(known, key=lambda g: ptr[g + 1] - ptr[g])[:2]
+
+        hits = np.concatenate([postings[ptr[g]:ptr[g + 1]] for g in rare])
+        hits.sort()
+        first = np.empty(len(hits), dtype=bool)
+        first[0] = True
+        np.not_equal(hits[1:], hits[:-1], out=first[1:])
+        candidates = hits[first]
+        if len(candidates) > MAX_CANDIDATES:
+            rare_overlap = np.diff(np.append(np.flatnonzero(first), len(hits)))
+            candidates = candidates[np.argpartition(-rare_overlap, MAX_CANDIDATES - 1)[:MAX_CANDIDATES]]
+
+        # Общие триграммы: все триграммы кандидатов одним массивом, отметка
+        # «есть в запросе» и сумма по каждому кандидату (reduceat по смещениям)
+        in_query = np.zeros(len(self.gram_ids), dtype=np.int32)
+        in_query[known] = 1
+        n_entry = self.gram_counts[candidates]
+        offsets = np.zeros(len(candidates), dtype=np.int64)
+        np.cumsum(n_entry[:-1], out=offsets[1:])
+        positions = np.repeat(self.entry_ptr[candidates] - offsets, n_entry) + np.arange(int(n_entry.sum()))
+        overlap = np.add.reduceat(in_query[self.entry_grams[positions]], offsets)
+        n_query = len(grams)
+        dice = 2.0 * overlap / (n_query + n_entry)
+        containment = overlap / np.minimum(n_query, n_entry)
+        scores = 0.5 * (dice + containment)
+
+        keep = scores >= min_score
+        candidates, scores = candidates[keep], scores[keep]
+        # С запасом на дубли одного объекта под разными алиасами
+        limit = min(len(scores), k * 4)
+        if limit == 0:
+            return []
+        if len(scores) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            candidates, scores = candidates[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+
+        results: List[Tuple[Any, float]] = []
+        seen = set()
+        for i in order:
+            target = self.targets[candidates[i]]
+            if target in seen:
+                continue
+            seen.add(target)
+            results.append((target, float(scores[i])))
+            if len(results) == k:
+                break
+        return results
+
+    def best(self, query: str, min_score: float = DEFAULT_MIN_SCORE) -> Tuple[Any, float]:
+        """Лучшее совпадение (объект, оценка) или (None, 0.0)."""
+        found = self.search(query, k=1, min_score=min_score)
+        return found[0] if found else (None, 0.0)
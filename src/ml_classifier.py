@@ -1,12 +1,17 @@
-from dataclasses import dataclass
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from functools import lru_cache
-from typing import List, Tuple
+from typing import Dict, List, Sequence, Tuple
 
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
 from sklearn.pipeline import Pipeline
 
+from model_store import fingerprint, load_or_train
+
 
 @dataclass
 class TrainingSample:
@@ -55,50 +60,154 @@ def _build_training_data() -> List[TrainingSample]:
     return samples
 
 
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_description(text: str) -> str:
+    """
+    Ключ кэша предсказаний: нижний регистр и схлопнутые пробелы.
+    TF‑IDF и так приводит текст к нижнему регистру, поэтому на ответ модели
+    нормализация не влияет — она лишь склеивает «Uber  ride» и «uber ride».
+    """
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+
 @dataclass
 class ExpenseCategoryClassifier:
     """
     Простой ML‑классификатор категории расходов по тексту описания.
     Использует TF‑IDF + Logistic Regression.
+
+    Описания трат сильно повторяются (одни и те же магазины), поэтому ответы
+    кэшируются в LRU: нормализованное описание → (категория, вероятность).
     """
 
     pipeline: Pipeline
     classes_: List[str]
+    cache_size: int = 10_000
+    _cache: "OrderedDict[str, Tuple[str, float]]" = field(default_factory=OrderedDict, repr=False)
+    _cache_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _hits: int = field(default=0, repr=False)
+    _misses: int = field(default=0, repr=False)
 
     def predict(self, text: str) -> Tuple[str, float]:
         """
         Возвращает (предсказанная_категория, вероятность).
         """
-        if not text:
-            return "Other", 0.0
-
-        probs = self.pipeline.predict_proba([text])[0]
-        best_idx = int(np.argmax(probs))
-        return self.classes_[best_idx], float(probs[best_idx])
+        return self.predict_batch([text])[0]
 
+    def predict_batch(self, texts: Sequence[str]) -> List[Tuple[str, float]]:
+        """
+        Предсказания для списка описаний: [(категория, вероятность), ...] в том же порядке.
 
-def _train_classifier() -> ExpenseCategoryClassifier:
-    samples = _build_training_data()
+        Повторы и уже виденные описания берутся из кэша; остальные уникальные тексты
+        проходят через модель одним вызовом — одно разреженное TF‑IDF преобразование
+        и одно умножение матриц в LogisticRegression вместо вызова на каждую строку.
+        """
+        results: List[Tuple[str, float]] = [("Other", 0.0)] * len(texts)
+        pending: Dict[str, List[int]] = {}
+
+        with self._cache_lock:
+            for i, text in enumerate(texts):
+                if not text:
+                    continue
+                key = normalize_description(text)
+                if not key:
+                    continue
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    self._hits += 1
+                    results[i] = cached
+                elif key in pending:
+                    # Повтор внутри пачки — модель для него тоже не вызывается
+                    self._hits += 1
+                    pending[key].append(i)
+                else:
+                    self._misses += 1
+                    pending[key] = [i]
+
+        if not pending:
+            return results
+
+        keys = list(pending)
+        tfidf = self.pipeline.named_steps["tfidf"]
+        clf = self.pipeline.named_steps["clf"]
+        probs = clf.predict_proba(tfidf.transform(keys))
+        best = np.argmax(probs, axis=1)
+        best_probs = probs[np.arange(len(keys)), best]
+
+        with self._cache_lock:
+            for key, idx, prob in zip(keys, best.tolist(), best_probs.tolist()):
+                answer = (self.classes_[idx], float(prob))
+                for i in pending[key]:
+                    results[i] = answer
+                self._cache[key] = answer
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return results
+
+    def cache_stats(self) -> Dict[str, float]:
+        """Статистика кэша предсказаний: попадания, промахи, доля попаданий, размер."""
+        with self._cache_lock:
+            total = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0,
+                "size": len(self._cache),
+            }
+
+    def clear_cache(self) -> None:
+        with self._cache_lock:
+            self._cache.clear()
+            self._hits = 0
+            self._misses = 0
+
+
+# Гиперпараметры пайплайна; входят в хэш артефакта модели
+_TFIDF_PARAMS = {"ngram_range": (1, 2), "min_df": 1}
+_CLF_PARAMS = {"max_iter": 1000}
+
+
+def _train_pipeline(samples: List[TrainingSample]) -> Pipeline:
     texts = [s.text for s in samples]
     labels = [s.category for s in samples]
 
     pipeline = Pipeline(
         [
-            ("tfidf", TfidfVectorizer(ngram_range=(1, 2), min_df=1)),
-            ("clf", LogisticRegression(max_iter=1000)),
+            ("tfidf", TfidfVectorizer(**_TFIDF_PARAMS)),
+            ("clf", LogisticRegression(**_CLF_PARAMS)),
         ]
     )
 
     pipeline.fit(texts, labels)
-    classes = list(pipeline.classes_)
-    return ExpenseCategoryClassifier(pipeline=pipeline, classes_=classes)
+    return pipeline
+
+
+def _train_classifier() -> ExpenseCategoryClassifier:
+    """
+    Классификатор из хранилища моделей; обучение — только если артефакта
+    для этих данных и гиперпараметров ещё нет.
+    """
+    samples = _build_training_data()
+    fp = fingerprint(
+        [(s.text, s.category) for s in samples],
+        _TFIDF_PARAMS,
+        _CLF_PARAMS,
+    )
+    # На диске храним только sklearn-пайплайн: кэш и блокировка классификатора
+    # относятся к процессу и не сериализуются.
+    pipeline = load_or_train("expense_classifier", fp, lambda: _train_pipeline(samples), Pipeline)
+    return ExpenseCategoryClassifier(pipeline=pipeline, classes_=list(pipeline.classes_))
 
 
 @lru_cache(maxsize=1)
 def get_default_classifier() -> ExpenseCategoryClassifier:
     """
     Возвращает обученный классификатор.
-    Обучение выполняется один раз и кэшируется.
+    Внутри процесса кэшируется, между процессами — загружается с диска (model_store).
     """
     return _train_classifier()
 
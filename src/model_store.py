@@ -0,0 +1,199 @@
+# src/model_store.py
+"""
+Хранилище обученных моделей на диске.
+
+Зачем:
+------
+`lru_cache` в get_default_classifier / get_expense_anomaly_detector живёт только
+внутри одного процесса: каждый воркер Streamlit и каждый холодный старт заново
+обучает sklearn-модели. Здесь обученные объекты сохраняются в файлы и при
+следующем старте просто читаются с диска.
+
+Когда артефакт считается актуальным:
+-------------------------------------
+Имя файла: `<name>-v<STORE_VERSION>-<libs>-<fingerprint>.pkl` в каталоге `models/`
+в корне проекта. libs — версии scikit-learn и NumPy (library_tag): pickle между
+версиями библиотек не гарантированно совместим, а модели, обученные по БД,
+загружаются без fingerprint (load_latest_artifact) — после обновления библиотек
+их файлы просто не находятся, и модель берётся заново. fingerprint — хэш
+обучающих данных, гиперпараметров и тех же версий библиотек. Изменились данные или параметры — изменился хэш, старый файл
+не подходит, модель обучается заново и сохраняется под новым именем (старые
+версии этой модели удаляются). STORE_VERSION поднимается, если меняется формат
+сохраняемых объектов — тип или набор полей pickle-объекта, даже если
+fingerprint при этом остался прежним. Вдобавок загрузчики принимают
+expected_type: объект другого типа (файл от старой версии кода) считается
+отсутствующим, и модель обучается заново вместо падения при первом обращении.
+
+История STORE_VERSION:
+    1 — первые артефакты;
+    2 — кластеры трат хранятся как ExpenseClusterModel, а не кортеж (scaler, kmeans).
+
+Файлы — pickle, поэтому загружать стоит только свои артефакты из каталога проекта.
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from functools import lru_cache
+from typing import Any, Callable, List, Optional, Tuple, Type, Union
+
+_THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_ROOT = os.path.dirname(_THIS_DIR)
+MODELS_DIR = os.path.join(_PROJECT_ROOT, "models")
+
+STORE_VERSION = 2
+
+ExpectedType = Optional[Union[Type[Any], Tuple[Type[Any], ...]]]
+
+
+def get_models_dir() -> str:
+    """Каталог артефактов (функция — чтобы тесты и скрипты могли подменить MODELS_DIR)."""
+    return MODELS_DIR
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    Хэш частей описания модели: обучающих данных, гиперпараметров и т.п.
+
+    Массивы NumPy хэшируются по байтам, остальное — через JSON (repr для
+    несериализуемых значений). Версии sklearn и NumPy входят в хэш всегда:
+    pickle между версиями библиотек не гарантированно совместим.
+    """
+    import numpy as np
+    import sklearn
+
+    h = hashlib.sha256()
+    h.update(f"sklearn={sklearn.__version__};numpy={np.__version__}".encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(str(part.dtype).encode())
+            h.update(str(part.shape).encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=repr, ensure_ascii=False).encode())
+    return h.hexdigest()[:16]
+
+
+@lru_cache(maxsize=1)
+def library_tag() -> str:
+    """Версии библиотек, от которых зависит pickle моделей, — часть имени файла."""
+    import numpy as np
+    import sklearn
+
+    return f"sklearn{sklearn.__version__}-numpy{np.__version__}"
+
+
+def artifact_path(name: str, fp: str) -> str:
+    return os.path.join(get_models_dir(), f"{name}-v{STORE_VERSION}-{library_tag()}-{fp}.pkl")
+
+
+def _latest_artifact_paths(name: str) -> List[str]:
+    """Все файлы модели name текущих STORE_VERSION и версий библиотек (с любым fingerprint)."""
+    return glob.glob(os.path.join(get_models_dir(), f"{name}-v{STORE_VERSION}-{library_tag()}-*.pkl"))
+
+
+def _read_pickle(path: str, expected_type: ExpectedType) -> Optional[Any]:
+    try:
+        with open(path, "rb") as f:
+            obj = pickle.load(f)
+    except Exception:
+        # Битый/недописанный файл — просто обучим заново и перезапишем
+        return None
+    if expected_type is not None and not isinstance(obj, expected_type):
+        return None
+    return obj
+
+
+def load_artifact(name: str, fp: str, expected_type: ExpectedType = None) -> Optional[Any]:
+    """
+    Загружает артефакт; None — если файла нет, он не читается или объект
+    не является expected_type (если тип задан).
+    """
+    path = artifact_path(name, fp)
+    if not os.path.exists(path):
+        return None
+    return _read_pickle(path, expected_type)
+
+
+def save_artifact(name: str, fp: str, obj: Any) -> str:
+    """
+    Сохраняет артефакт атомарно (временный файл + os.replace), чтобы параллельный
+    воркер никогда не прочитал наполовину записанный файл. Устаревшие версии
+    этой же модели удаляются.
+    """
+    models_dir = get_models_dir()
+    os.makedirs(models_dir, exist_ok=True)
+    path = artifact_path(name, fp)
+
+    fd, tmp_path = tempfile.mkstemp(dir=models_dir, prefix=f".{name}-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    for old in glob.glob(os.path.join(models_dir, f"{name}-v*-*.pkl")):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return path
+
+
+def load_latest_artifact(name: str, expected_type: ExpectedType = None) -> Optional[Any]:
+    """
+    Последний сохранённый артефакт модели без проверки fingerprint — для моделей,
+    которые переобучаются отдельной задачей (например, по данным из БД), а при
+    старте просто подхватываются. Файлы, сохранённые при других версиях
+    scikit-learn/NumPy, не рассматриваются (версии — в имени файла). None — если
+    артефакта нет, он не читается или объект не является expected_type.
+    """
+    paths = _latest_artifact_paths(name)
+    if not paths:
+        return None
+    return _read_pickle(max(paths, key=os.path.getmtime), expected_type)
+
+
+def artifact_token(name: str) -> Optional[Tuple[str, int]]:
+    """
+    Идентичность последнего артефакта модели на диске: (имя файла, mtime_ns) или
+    None, если его нет. Меняется при каждом сохранении — в том числе из другого
+    процесса (ночное переобучение), поэтому годится в ключ кэшей процесса.
+    Как и load_latest_artifact, видит только файлы текущих версий библиотек.
+    """
+    paths = _latest_artifact_paths(name)
+    best: Optional[Tuple[str, int]] = None
+    for path in paths:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue  # файл удалили между glob и stat
+        if best is None or mtime > best[1]:
+            best = (os.path.basename(path), mtime)
+    return best
+
+
+def load_or_train(name: str, fp: str, train: Callable[[], Any], expected_type: ExpectedType = None) -> Any:
+    """
+    Возвращает артефакт с диска, а если его нет (или на диске объект не того
+    типа, см. expected_type) — обучает через train() и сохраняет.
+
+    Ошибка записи (например, каталог только для чтения) не мешает работе:
+    модель всё равно возвращается, просто в следующий раз обучится снова.
+    """
+    obj = load_artifact(name, fp, expected_type)
+    if obj is not None:
+        return obj
+
+    obj = train()
+    try:
+        save_artifact(name, fp, obj)
+    except OSError:
+        pass
+    return obj